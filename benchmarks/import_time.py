@@ -0,0 +1,140 @@
+""" Import time of QED entry points
+
+    Usage (from the repository root)
+        python -m benchmarks.import_time                                   # all statements
+        python -m benchmarks.import_time --repeat 10 --output import.json
+        python -m benchmarks.import_time --output new.json --baseline import.json
+
+    Each statement is run 'repeat' times in a fresh interpreter, so nothing is cached in sys.modules.
+    'median' is the wall time of the statement alone (interpreter startup excluded), and 'loaded'
+    lists the heavy dependencies it pulled in. Results use the schema of benchmarks.run, so 'compare' applies.
+"""
+
+from typing import Dict, List, Optional
+from .run import compare, _git_commit, _ratio
+import subprocess
+import statistics
+import platform
+import argparse
+import json
+import time
+import sys
+import os
+
+
+
+
+STATEMENTS = {
+    'python': 'pass',
+    'qed.data': 'import qed.data',
+    'qed.pl': 'import qed.pl',
+    'readtxt': 'from qed.data import readtxt',
+    'merge_df': 'from qed.data import merge_df',
+    'get_enrichment_dataframes': 'from qed.data import get_enrichment_dataframes',
+    'select_top_n': 'from qed.pl import select_top_n',
+    'heatmap': 'from qed.pl import heatmap',
+}
+
+HEAVY_MODULES = ['numpy', 'pandas', 'requests', 'tqdm', 'scipy.sparse', 'scipy.stats', 'scipy.cluster',
+                 'matplotlib', 'matplotlib.pyplot']
+
+# Run in the child interpreter: time the statement, then report it with the heavy modules now loaded
+_CHILD = """
+import time, sys, json
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {modules!r} if m in sys.modules]}}))
+"""
+
+
+
+
+def measure_import(statement: str, repeat: int) -> Dict:
+
+    code = _CHILD.format(statement=statement, modules=HEAVY_MODULES)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+
+    times = []
+    totals = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=env).stdout
+        totals.append(time.perf_counter() - start)
+
+        child = json.loads(output.strip().splitlines()[-1])
+        times.append(child['seconds'])
+
+    return {'times': times,
+            'min': min(times),
+            'median': statistics.median(times),
+            'median_process': statistics.median(totals),
+            'peak_memory': None,
+            'loaded': child['loaded']}
+
+
+
+
+def run_import_benchmarks(only: Optional[List[str]] = None, repeat: int = 5) -> Dict:
+
+    """ Import time of each statement of STATEMENTS and metadata, in the format of benchmarks.run """
+
+    names = only if only else list(STATEMENTS)
+    unknown = [name for name in names if name not in STATEMENTS]
+
+    if unknown:
+        raise ValueError(f'Unknown statements {unknown}. Available: {list(STATEMENTS)}')
+
+    results = []
+
+    for name in names:
+        params = {'statement': STATEMENTS[name]}
+        result = dict({'name': f'import.{name}', 'params': params}, **measure_import(STATEMENTS[name], repeat))
+        results.append(result)
+
+        print(f"{name:<32}median {result['median']:7.3f} s   process {result['median_process']:7.3f} s   "
+              f"loaded {', '.join(result['loaded']) or '-'}", file=sys.stderr)
+
+    metadata = {'repeat': repeat,
+                'commit': _git_commit(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count()}
+
+    return {'metadata': metadata, 'results': results}
+
+
+
+
+def main(argv: Optional[List[str]] = None) :
+
+    parser = argparse.ArgumentParser(description='Import time of QED entry points')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help=f'Statements to time among {list(STATEMENTS)}')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write results as JSON to this file (Defaults to stdout)')
+    parser.add_argument('--baseline', help='JSON written by a previous run to compare against')
+    args = parser.parse_args(argv)
+
+    report = run_import_benchmarks(args.only, args.repeat)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(json.load(f), report)
+
+        for row in report['comparison']:
+            print(f"{row['name']:<32}time x{_ratio(row['time_ratio'])}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+from typing import Optional
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+from requests.adapters import BaseAdapter
+from qed.data import session, query
+from .synthetic import make_response
+import itertools
+import requests
+import json
+import time
+
+
+
+
+# In-process EnrichR mock mounted on the shared session of qed.data.session.
+# Requests never leave the process; 'latency' emulates the round trip to EnrichR.
+
+class MockEnrichrAdapter(BaseAdapter):
+
+    """ Answers 'addList' and 'enrich' with synthetic responses after 'latency' seconds
+
+        Args
+            latency (float, optional): Seconds slept per request (releases the GIL, like network I/O). Defaults to 0.05.
+
+            n_rows (int, optional): Number of terms of each 'enrich' response. Defaults to 500.
+    """
+
+    def __init__(self, latency: float = 0.05, n_rows: int = 500):
+
+        super().__init__()
+
+        self.latency = latency
+        self.n_rows = n_rows
+        self.requests = 0
+
+        self._ids = itertools.count(1)
+        self._responses = {}
+
+    def _body(self, request) -> dict:
+
+        url = urlsplit(request.url)
+        endpoint = url.path.rsplit('/', 1)[-1]
+
+        if endpoint == 'addList':
+            return {'userListId': next(self._ids), 'shortId': 'mock'}
+
+        if endpoint == 'enrich':
+            database = parse_qs(url.query)['backgroundType'][0]
+
+            # Same response for each database, built once so it is not part of the measured time
+            if database not in self._responses:
+                self._responses[database] = make_response(database, self.n_rows, seed=len(self._responses))
+
+            return self._responses[database]
+
+        raise ValueError(f'Endpoint {endpoint} is not mocked')
+
+    def send(self, request, **kwargs) -> requests.Response:
+
+        self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = 200
+        response._content = json.dumps(self._body(request)).encode()
+        response.headers['Content-Type'] = 'application/json'
+
+        return response
+
+    def close(self) :
+
+        pass
+
+
+
+
+@contextmanager
+def mock_enrichr(latency: float = 0.05, n_rows: int = 500, base_url: Optional[str] = None) :
+
+    """ Route requests to EnrichR through MockEnrichrAdapter inside the block """
+
+    base_url = base_url if base_url is not None else query.ENRICHR_BASE_URL
+    prefix = base_url.rstrip('/') + '/'
+
+    adapter = MockEnrichrAdapter(latency, n_rows)
+    shared = session.get_session()
+    shared.mount(prefix, adapter)
+
+    try:
+        yield adapter
+
+    finally:
+        shared.adapters.pop(prefix, None)
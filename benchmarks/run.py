@@ -0,0 +1,306 @@
+""" Benchmarks of QED hot paths
+
+    Usage (from the repository root)
+        python -m benchmarks.run                                  # all benchmarks, 'small' size
+        python -m benchmarks.run --size medium --output bench.json
+        python -m benchmarks.run --only merge_df select_top_n
+        python -m benchmarks.run --output new.json --baseline bench.json
+
+    Each case is run 'repeat' times for wall time and once more under tracemalloc for peak memory
+    (bytes allocated by Python during the call). Results are written as JSON for regression tracking.
+"""
+
+import os
+
+# No progress bars in timings (read by tqdm when it is imported)
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+from typing import Callable, Dict, List, Optional
+from .synthetic import make_results, make_genesets, write_rowside, write_seurat_markers, make_rank_genes_groups
+from .mock import mock_enrichr
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import qed.data as qd
+import qed.pl as qp
+import tracemalloc
+import subprocess
+import statistics
+import platform
+import tempfile
+import argparse
+import logging
+import json
+import time
+import sys
+
+
+
+
+# Dataset sizes: number of genesets, libraries (databases) and result rows per (geneset, library)
+SIZES = {
+    'small': {'n_genesets': 8, 'n_libraries': 3, 'n_rows': 200},
+    'medium': {'n_genesets': 32, 'n_libraries': 8, 'n_rows': 1000},
+    'large': {'n_genesets': 128, 'n_libraries': 16, 'n_rows': 3000},
+}
+
+# Round trip emulated by the mock EnrichR server (seconds)
+MOCK_LATENCY = 0.02
+
+N_JOBS = [1, 4, 16]
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+
+
+def benchmark(func: Callable) :
+
+    """ Register 'func(size, tmp_dir)' yielding (params, run) pairs. Data is prepared before each yield, and 'run()' is timed """
+
+    BENCHMARKS[func.__name__] = func
+
+    return func
+
+
+
+
+def measure(run: Callable, repeat: int) -> Dict:
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'times': times,
+            'min': min(times),
+            'median': statistics.median(times),
+            'peak_memory': peak}
+
+
+
+
+# Query
+
+@benchmark
+def query(size: Dict, tmp_dir: str) :
+
+    genesets = make_genesets(size['n_genesets'])
+    dblist = [f'Library{j}' for j in range(size['n_libraries'])]
+
+    for n_jobs in N_JOBS:
+
+        def run(n_jobs=n_jobs) :
+            # Each run is a fresh batch, so gene lists are uploaded again
+            with mock_enrichr(latency=MOCK_LATENCY, n_rows=size['n_rows']):
+                qd.get_enrichment_dataframes(genesets, dblist, 'Celltype', n_jobs=n_jobs, cache=False)
+
+        yield {'n_jobs': n_jobs, 'requests': len(genesets) * (len(dblist) + 1), 'latency': MOCK_LATENCY}, run
+
+
+
+
+# Merge and organize
+
+@benchmark
+def merge_df(size: Dict, tmp_dir: str) :
+
+    results = make_results(size['n_genesets'], size['n_libraries'], size['n_rows'])
+
+    for term_suffix in [True, False]:
+        yield {'term_suffix': term_suffix}, lambda term_suffix=term_suffix: qd.merge_df(results, term_suffix)
+
+
+@benchmark
+def select_top_n(size: Dict, tmp_dir: str) :
+
+    df = qd.merge_df(make_results(size['n_genesets'], size['n_libraries'], size['n_rows']))
+
+    for allow_duplicate in [False, True]:
+        yield ({'n': 10, 'allow_duplicate': allow_duplicate},
+               lambda allow_duplicate=allow_duplicate: qp.select_top_n(df, 10, 'Celltype', allow_duplicate=allow_duplicate))
+
+
+
+
+# Plotting
+
+@benchmark
+def heatmap(size: Dict, tmp_dir: str) :
+
+    df = qd.merge_df(make_results(size['n_genesets'], 1, size['n_rows']))
+
+    def draw() :
+        qp.clear_linkage_cache()
+        fig, _, _ = qp.heatmap(df, 10, 'Celltype')
+        fig.canvas.draw()
+        plt.close(fig)
+
+    yield {'n': 10}, draw
+
+
+
+
+# Readers
+
+@benchmark
+def readtxt(size: Dict, tmp_dir: str) :
+
+    file_path = os.path.join(tmp_dir, 'rowside.csv')
+    write_rowside(file_path, size['n_genesets'] * size['n_libraries'] * 10)
+
+    yield {'format': 'rowside'}, lambda: qd.readtxt(file_path, ',')
+
+
+@benchmark
+def readseurat(size: Dict, tmp_dir: str) :
+
+    file_path = os.path.join(tmp_dir, 'markers.csv')
+    write_seurat_markers(file_path, size['n_genesets'], n_genes=size['n_rows'] * 10)
+
+    yield {'index_col': 0}, lambda: qd.readseurat(file_path, ',', index_col=0)
+
+
+@benchmark
+def readscanpy(size: Dict, tmp_dir: str) :
+
+    adata = make_rank_genes_groups(size['n_genesets'], n_genes=size['n_rows'] * 10)
+
+    for select_top_n in [None, 100]:
+        yield ({'select_top_n': select_top_n},
+               lambda select_top_n=select_top_n: qd.readscanpy(adata, select_top_n=select_top_n))
+
+
+
+
+def _git_commit() -> Optional[str]:
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+
+def _metadata(size_name: str, repeat: int) -> Dict:
+
+    import numpy
+    import pandas
+    import scipy
+
+    return {'size': size_name,
+            'params': SIZES[size_name],
+            'repeat': repeat,
+            'commit': _git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'versions': {'numpy': numpy.__version__, 'pandas': pandas.__version__,
+                         'scipy': scipy.__version__, 'matplotlib': matplotlib.__version__}}
+
+
+
+
+def run_benchmarks(size_name: str = 'small', only: Optional[List[str]] = None, repeat: int = 3) -> Dict:
+
+    """ Run registered benchmarks and return metadata and one result per (benchmark, params) """
+
+    names = only if only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+
+    if unknown:
+        raise ValueError(f'Unknown benchmarks {unknown}. Available: {list(BENCHMARKS)}')
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in names:
+            for params, run in BENCHMARKS[name](SIZES[size_name], tmp_dir):
+
+                result = dict({'name': name, 'params': params}, **measure(run, repeat))
+                results.append(result)
+
+                print(f"{name:<14}{json.dumps(params):<56}median {result['median']:9.4f} s   "
+                      f"peak {result['peak_memory'] / 1024 ** 2:9.1f} MiB", file=sys.stderr)
+
+    return {'metadata': _metadata(size_name, repeat), 'results': results}
+
+
+
+
+def compare(baseline: Dict, current: Dict) -> List[Dict]:
+
+    """ Ratio of median time and peak memory of 'current' to 'baseline' for cases present in both """
+
+    def key(result: Dict) :
+        return result['name'], json.dumps(result['params'], sort_keys=True)
+
+    previous = {key(result): result for result in baseline['results']}
+    rows = []
+
+    for result in current['results']:
+        if key(result) in previous:
+            old = previous[key(result)]
+            rows.append({'name': result['name'],
+                         'params': result['params'],
+                         'time_ratio': result['median'] / old['median'] if old['median'] else None,
+                         'memory_ratio': result['peak_memory'] / old['peak_memory'] if old['peak_memory'] else None})
+
+    return rows
+
+
+
+
+def _ratio(value: Optional[float]) -> str:
+
+    return 'n/a' if value is None else f'{value:.2f}'
+
+
+
+
+def main(argv: Optional[List[str]] = None) :
+
+    parser = argparse.ArgumentParser(description='Benchmarks of QED hot paths')
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help=f'Benchmarks to run among {list(BENCHMARKS)}')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write results as JSON to this file (Defaults to stdout)')
+    parser.add_argument('--baseline', help='JSON written by a previous run to compare against')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    report = run_benchmarks(args.size, args.only, args.repeat)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(json.load(f), report)
+
+        for row in report['comparison']:
+            print(f"{row['name']:<14}{json.dumps(row['params']):<56}time x{_ratio(row['time_ratio'])}   "
+                  f"memory x{_ratio(row['memory_ratio'])}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+from typing import List, Dict
+from types import SimpleNamespace
+from qed.data.structure import geneset
+from qed.data import query
+import pandas as pd
+import numpy as np
+
+
+
+
+# Synthetic inputs of the benchmarks. Every generator is seeded, so runs are reproducible.
+
+def gene_names(n: int) -> np.ndarray:
+
+    return np.array([f'GENE{i}' for i in range(n)], dtype=object)
+
+
+
+
+def make_genesets(n_genesets: int, genes_per_set: int = 200, n_genes: int = 20000, seed: int = 0) -> List[geneset]:
+
+    rng = np.random.default_rng(seed)
+    genes = gene_names(n_genes)
+
+    return [geneset(name=f'Set{i}', genes=genes[rng.choice(n_genes, genes_per_set, replace=False)].tolist())
+            for i in range(n_genesets)]
+
+
+
+
+def make_response(database: str, n_rows: int, n_terms: int = None, seed: int = 0) -> Dict:
+
+    """ EnrichR 'enrich' response of 'n_rows' terms drawn from 'n_terms' terms of 'database' """
+
+    rng = np.random.default_rng(seed)
+    n_terms = n_terms if n_terms is not None else 2 * n_rows
+
+    terms = rng.choice(n_terms, n_rows, replace=False)
+    pvalues = np.sort(rng.random(n_rows) ** 4)
+    odds = rng.gamma(2.0, 2.0, n_rows)
+    overlaps = rng.integers(1, 20, n_rows)
+    genes = gene_names(2000)
+
+    rows = [[rank + 1,
+             f'{database} term {term} (GO:{term:07d})',
+             float(p),
+             float(o),
+             float(-np.log(p) * o),
+             genes[rng.choice(len(genes), k, replace=False)].tolist(),
+             float(min(p * n_rows / (rank + 1), 1.0)),
+             0,
+             0] for rank, (term, p, o, k) in enumerate(zip(terms, pvalues, odds, overlaps))]
+
+    return {database: rows}
+
+
+
+
+def make_results(n_genesets: int, n_libraries: int, n_rows: int, seed: int = 0) -> List[geneset]:
+
+    """ Genesets with 'n_libraries' enrichment dataframes of 'n_rows' rows each, as returned by get_enrichment_dataframes """
+
+    setlist = []
+
+    for i, gs in enumerate(make_genesets(n_genesets, seed=seed)):
+
+        dblist = [f'Library{j}' for j in range(n_libraries)]
+        dfs = [query.to_dataframe(make_response(database, n_rows, seed=seed + i * n_libraries + j), database, 'Celltype', gs.name)
+               for j, database in enumerate(dblist)]
+
+        setlist.append(gs.with_GO(dfs, database=dblist, annot_colname='Celltype', annot=gs.name))
+
+    return setlist
+
+
+
+
+def write_rowside(file_path: str, n_genesets: int, genes_per_set: int = 200, seed: int = 0) :
+
+    with open(file_path, 'w') as f:
+        for gs in make_genesets(n_genesets, genes_per_set, seed=seed):
+            f.write(','.join([gs.name] + gs.genes) + '\n')
+
+
+
+
+def write_seurat_markers(file_path: str, n_clusters: int, n_genes: int = 2000, seed: int = 0) :
+
+    """ FindAllMarkers output: 'n_genes' tested genes for each of 'n_clusters' clusters """
+
+    rng = np.random.default_rng(seed)
+    n = n_clusters * n_genes
+    genes = gene_names(n_genes)
+
+    df = pd.DataFrame({'p_val': rng.random(n) ** 4,
+                       'avg_log2FC': rng.normal(0.5, 1.0, n),
+                       'pct.1': rng.random(n),
+                       'pct.2': rng.random(n),
+                       'p_val_adj': np.minimum(rng.random(n) ** 4 * 10, 1.0),
+                       'cluster': np.repeat([f'Cluster{i}' for i in range(n_clusters)], n_genes),
+                       'gene': np.tile(genes, n_clusters)})
+
+    df.index = [f'{gene}.{cluster}' for gene, cluster in zip(df['gene'], df['cluster'])]
+    df.to_csv(file_path)
+
+
+
+
+def make_rank_genes_groups(n_groups: int, n_genes: int = 2000, seed: int = 0) :
+
+    """ Object with 'uns["rank_genes_groups"]' as written by scanpy.tl.rank_genes_groups
+
+        Uses anndata.AnnData if installed. readscanpy only reads 'uns', so a plain namespace is used otherwise.
+    """
+
+    rng = np.random.default_rng(seed)
+    groups = [f'Group{i}' for i in range(n_groups)]
+    genes = gene_names(n_genes)
+
+    def records(values: List[np.ndarray], dtype) -> np.ndarray:
+        return np.rec.fromarrays(values, dtype=[(group, dtype) for group in groups])
+
+    result = {'names': records([genes[rng.permutation(n_genes)] for _ in groups], 'O'),
+              'scores': records([np.sort(rng.normal(0, 5, n_genes))[::-1] for _ in groups], 'f4'),
+              'logfoldchanges': records([rng.normal(0.5, 1.5, n_genes) for _ in groups], 'f4'),
+              'pvals': records([np.sort(rng.random(n_genes) ** 4) for _ in groups], 'f8'),
+              'pvals_adj': records([np.sort(np.minimum(rng.random(n_genes) ** 4 * 10, 1.0)) for _ in groups], 'f8')}
+
+    try:
+        import anndata
+    except ImportError:
+        return SimpleNamespace(uns={'rank_genes_groups': result})
+
+    adata = anndata.AnnData(np.zeros((1, n_genes), dtype=np.float32))
+    adata.uns['rank_genes_groups'] = result
+
+    return adata
@@ -1,6 +1,82 @@
-from .reader import readtxt
-from .reader import readseurat
-from .reader import readscanpy
-from .query import get_enrichment_data
-from .query import get_enrichment_dataframes, get_enrichment_dataframes_with_background, find_terms_with_gene
-from .structure import merge_df, ENRICHR_DB
\ No newline at end of file
+from typing import TYPE_CHECKING
+import importlib
+
+
+
+
+# Public API, imported from its submodule on first access (PEP 562).
+# 'import qed.data' loads neither pandas, requests nor scipy until a name below is used.
+
+_EXPORTS = {
+    'readtxt': 'reader',
+    'readseurat': 'reader',
+    'readscanpy': 'reader',
+    'iter_genesets': 'reader',
+    'read_gmt': 'reader',
+    'get_enrichment_data': 'query',
+    'get_enrichment_dataframes': 'query',
+    'get_enrichment_dataframes_with_background': 'query',
+    'find_terms_with_gene': 'query',
+    'iter_enrichment_dataframes': 'query',
+    'set_base_url': 'query',
+    'get_enrichment_dataframes_async': 'query_async',
+    'merge_df': 'structure',
+    'ENRICHR_DB': 'structure',
+    'ResultStore': 'store',
+    'compact_results': 'store',
+    'memory_footprint': 'store',
+    'OverlappingGenes': 'overlap',
+    'GeneVocabulary': 'overlap',
+    'save_results': 'persist',
+    'load_results': 'persist',
+    'load_library': 'local',
+    'read_gmt_library': 'local',
+    'get_cache': 'cache',
+    'set_cache': 'cache',
+    'configure_session': 'session',
+    'EnrichrServer': 'server',
+}
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .reader import readtxt, readseurat, readscanpy, iter_genesets, read_gmt
+    from .query import get_enrichment_data, get_enrichment_dataframes, get_enrichment_dataframes_with_background
+    from .query import find_terms_with_gene, iter_enrichment_dataframes, set_base_url
+    from .query_async import get_enrichment_dataframes_async
+    from .structure import merge_df, ENRICHR_DB
+    from .store import ResultStore, compact_results, memory_footprint
+    from .overlap import OverlappingGenes, GeneVocabulary
+    from .persist import save_results, load_results
+    from .local import load_library, read_gmt_library
+    from .cache import get_cache, set_cache
+    from .session import configure_session
+    from .server import EnrichrServer
+
+
+
+
+def __getattr__(name: str) :
+
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    else:
+        # Submodules were attributes of the package when it imported them eagerly ('qed.data.query')
+        try:
+            value = importlib.import_module(f'.{name}', __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f'{__name__}.{name}':
+                raise
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+    # Later lookups find the name in the module namespace and skip __getattr__
+    globals()[name] = value
+
+    return value
+
+
+
+
+def __dir__() :
+
+    return sorted(set(globals()) | set(__all__))
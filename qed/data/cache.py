@@ -0,0 +1,274 @@
+from typing import List, Dict, Optional
+from threading import Lock
+from .. import metrics
+import hashlib
+import sqlite3
+import json
+import time
+import zlib
+import os
+
+
+
+
+# Persistent cache of EnrichR responses.
+# Query functions use it by default: pass cache=False to a query, or call set_cache(enabled=False) to turn it off.
+
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+# Uploaded lists are kept by EnrichR for a limited time
+DEFAULT_UPLOAD_TTL = 24 * 60 * 60
+
+
+
+
+def default_cache_dir() -> str:
+
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return os.environ.get('QED_CACHE_DIR', os.path.join(cache_home, 'qed'))
+
+
+
+
+def hash_genes(genes: Optional[List[str]]) -> str:
+
+    """ Order independent hash of a gene list. Returns empty string for None """
+
+    if genes is None:
+        return ''
+
+    return hashlib.sha256('\n'.join(sorted(genes)).encode()).hexdigest()
+
+
+
+
+class EnrichrCache:
+
+    """ Content-addressed on-disk cache of parsed EnrichR results
+
+        Entries are keyed on (hash of sorted gene list, library name, hash of background genes)
+        and stored as zlib compressed JSON in a SQLite file. Entries older than 'ttl' seconds are
+        dropped, and least recently used entries are evicted when the cache exceeds 'max_bytes'.
+
+        Args
+            path (str, optional): Path of SQLite file. Defaults to ~/.cache/qed/enrichr_cache.sqlite
+
+            max_bytes (int, optional): Maximum size of stored results. Defaults to 512 MB.
+
+            ttl (float, optional): Time to live of an entry in seconds. Defaults to 30 days.
+
+            enabled (bool, optional): Whether to use the cache. Defaults to True.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl: Optional[float] = DEFAULT_TTL,
+                 enabled: bool = True):
+
+        self.path = path if path is not None else os.path.join(default_cache_dir(), 'enrichr_cache.sqlite')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._conn = None
+
+    def __repr__(self) :
+
+        return f"EnrichrCache object [path: {self.path}, enabled: {self.enabled}, hits: {self.hits}, misses: {self.misses}]"
+
+    @staticmethod
+    def make_key(genes: List[str], 
+                 database: str, 
+                 background_genes: Optional[List[str]] = None, 
+                 source: Optional[str] = None) -> str:
+
+        # 'source' (server URL) is None for the public EnrichR service, so existing keys stay valid
+        key = f'{hash_genes(genes)}|{database}|{hash_genes(background_genes)}'
+
+        if source is not None:
+            key += f'|{source}'
+
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _connect(self) :
+
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                         'key TEXT PRIMARY KEY, database TEXT, size INTEGER, '
+                         'created REAL, accessed REAL, data BLOB)')
+            conn.execute('CREATE TABLE IF NOT EXISTS uploads ('
+                         'key TEXT PRIMARY KEY, value TEXT, created REAL)')
+            conn.commit()
+            self._conn = conn
+
+        return self._conn
+
+    def get(self, key: str) :
+
+        """ Return cached result or None """
+
+        if not self.enabled:
+            return None
+
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT created, data FROM results WHERE key = ?', (key,)).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[0] > self.ttl:
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                metrics.count('cache.misses')
+                return None
+
+            conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            conn.commit()
+            self.hits += 1
+            metrics.count('cache.hits')
+
+        return json.loads(zlib.decompress(row[1]))
+
+    def set(self, key: str, value, database: str = None) :
+
+        if not self.enabled:
+            return
+
+        data = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, database, len(data), now, now, data))
+            self._evict(conn, now)
+            conn.commit()
+
+    def get_upload(self, key: str, ttl: Optional[float] = DEFAULT_UPLOAD_TTL) :
+
+        """ Return identifier of a previously uploaded list (e.g. backgroundid) or None """
+
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT value, created FROM uploads WHERE key = ?', (key,)).fetchone()
+
+        if row is None or (ttl is not None and time.time() - row[1] > ttl):
+            return None
+
+        return json.loads(row[0])
+
+    def set_upload(self, key: str, value) :
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)',
+                         (key, json.dumps(value), time.time()))
+            conn.commit()
+
+    def _evict(self, conn, now: float) :
+
+        if self.ttl is not None:
+            conn.execute('DELETE FROM results WHERE created < ?', (now - self.ttl,))
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+        if total <= self.max_bytes:
+            return
+
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+            conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def evict(self) :
+
+        """ Drop expired entries and shrink cache to 'max_bytes' """
+
+        with self._lock:
+            conn = self._connect()
+            self._evict(conn, time.time())
+            conn.commit()
+
+    def info(self) -> Dict:
+
+        """ Summary of cache contents and hit/miss counts """
+
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            databases = dict(conn.execute('SELECT database, COUNT(*) FROM results GROUP BY database').fetchall())
+
+        return {'path': self.path,
+                'enabled': self.enabled,
+                'entries': entries,
+                'size_bytes': size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'databases': databases,
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def stats(self) -> Dict:
+
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self, database: Optional[str] = None) :
+
+        """ Remove all entries, or entries of one library """
+
+        with self._lock:
+            conn = self._connect()
+            if database is None:
+                conn.execute('DELETE FROM results')
+                conn.execute('DELETE FROM uploads')
+            else:
+                conn.execute('DELETE FROM results WHERE database = ?', (database,))
+            conn.commit()
+            conn.execute('VACUUM')
+
+            self.hits = 0
+            self.misses = 0
+
+
+
+
+_CACHE = EnrichrCache()
+
+
+def get_cache() -> EnrichrCache:
+
+    return _CACHE
+
+
+def set_cache(path: Optional[str] = None,
+              max_bytes: int = DEFAULT_MAX_BYTES,
+              ttl: Optional[float] = DEFAULT_TTL,
+              enabled: bool = True) -> EnrichrCache:
+
+    """ Replace the cache used by query functions. Returns the new cache. """
+
+    global _CACHE
+
+    _CACHE = EnrichrCache(path=path, max_bytes=max_bytes, ttl=ttl, enabled=enabled)
+
+    return _CACHE
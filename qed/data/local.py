@@ -0,0 +1,322 @@
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, TYPE_CHECKING
+from threading import Lock
+from .cache import default_cache_dir
+from .. import metrics
+import numpy as np
+import gzip
+import os
+
+if TYPE_CHECKING:
+    from scipy import sparse
+
+
+
+
+# Offline over-representation analysis with EnrichR gene set libraries
+
+ENRICHR_LIBRARY_URL = 'https://maayanlab.cloud/Enrichr/geneSetLibrary'
+
+# EnrichR uses a fixed universe of 20,000 genes when no background is given
+ENRICHR_BACKGROUND_SIZE = 20000
+
+
+
+
+@dataclass
+class GeneSetLibrary:
+
+    name: str
+    terms: np.ndarray
+    genes: np.ndarray
+    membership: 'sparse.csr_matrix'
+    gene_index: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+
+        if not self.gene_index:
+            self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+
+        self.term_sizes = np.asarray(self.membership.sum(axis=1)).ravel()
+
+    def __repr__(self) :
+
+        return f"GeneSetLibrary object [name: {self.name}, number of terms: {len(self.terms)}, number of genes: {len(self.genes)}]"
+
+
+
+
+def _open_text(file_path: str):
+
+    with open(file_path, 'rb') as f:
+        magic = f.read(2)
+
+    if magic == b'\x1f\x8b':
+        return gzip.open(file_path, 'rt')
+
+    return open(file_path, 'r')
+
+
+
+
+def read_gmt_library(file_path: str, name: Optional[str] = None) -> GeneSetLibrary:
+
+    """ Read a GMT file (EnrichR library text format) into a term x gene membership matrix
+
+        Args
+            file_path (str): Path to GMT file. gzip compressed files are supported.
+
+            name (str, optional): Name of library. Defaults to file name without extension.
+
+    """
+
+    if name is None:
+        name = os.path.basename(file_path).split('.')[0]
+
+    terms = []
+    gene_index = {}
+    rows = []
+    cols = []
+
+    with _open_text(file_path) as f:
+        for line in f:
+            fields = line.rstrip('\r\n').split('\t')
+
+            if len(fields) < 3 or not fields[0]:
+                continue
+
+            row = len(terms)
+            terms.append(fields[0])
+
+            # Some EnrichR libraries store weighted genes as 'GENE,1.0'
+            members = {gene.split(',')[0].strip().upper() for gene in fields[2:]}
+            members.discard('')
+
+            for gene in members:
+                cols.append(gene_index.setdefault(gene, len(gene_index)))
+            rows.extend([row] * len(members))
+
+    from scipy import sparse
+
+    genes = np.empty(len(gene_index), dtype=object)
+    genes[list(gene_index.values())] = list(gene_index.keys())
+
+    membership = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                   shape=(len(terms), len(genes)))
+
+    return GeneSetLibrary(name=name,
+                          terms=np.array(terms, dtype=object),
+                          genes=genes,
+                          membership=membership,
+                          gene_index=gene_index)
+
+
+
+
+def download_library(database: str, library_dir: str) -> str:
+
+    """ Download EnrichR gene set library as GMT file
+
+        Args
+            database (str): Name of EnrichR library.
+
+            library_dir (str): Directory to save the GMT file.
+
+    """
+
+    from . import session
+
+    check_library_name(database)
+
+    os.makedirs(library_dir, exist_ok=True)
+    file_path = os.path.join(library_dir, f'{database}.gmt')
+
+    response = session.get(ENRICHR_LIBRARY_URL,
+                           params={'mode': 'text', 'libraryName': database})
+
+    if not response.ok:
+        raise Exception(f'Error downloading gene set library {database}')
+
+    tmp_path = file_path + '.part'
+
+    with open(tmp_path, 'w') as f:
+        f.write(response.text)
+
+    os.replace(tmp_path, file_path)
+
+    return file_path
+
+
+
+
+def default_library_dir() -> str:
+
+    return os.path.join(default_cache_dir(), 'libraries')
+
+
+
+
+_LIBRARIES: Dict[tuple, GeneSetLibrary] = {}
+_LIBRARIES_LOCK = Lock()
+
+
+def check_library_name(database: str) -> str:
+
+    """ Return 'database' if it is a plain library name, raise ValueError if it could leave the library directory """
+
+    separators = [sep for sep in ['/', '\\', os.sep, os.altsep] if sep]
+
+    if not database or '..' in database or any(sep in database for sep in separators) or os.path.isabs(database):
+        raise ValueError(f'Invalid gene set library name {database!r}')
+
+    return database
+
+
+
+
+def load_library(database: str,
+                 library_dir: Optional[str] = None,
+                 download: bool = True) -> GeneSetLibrary:
+
+    """ Load EnrichR gene set library. Loaded libraries are kept in memory.
+
+        Args
+            database (str): Name of EnrichR library. Searched as '{database}.gmt',
+                            '{database}.gmt.gz', '{database}.txt' in 'library_dir'.
+
+            library_dir (str, optional): Directory of GMT files. Defaults to ~/.cache/qed/libraries
+
+            download (bool, optional): Download library from EnrichR if not found. Defaults to True.
+
+    """
+
+    check_library_name(database)
+
+    library_dir = library_dir if library_dir is not None else default_library_dir()
+    key = (os.path.abspath(library_dir), database)
+
+    with _LIBRARIES_LOCK:
+
+        if key in _LIBRARIES:
+            return _LIBRARIES[key]
+
+        candidates = [os.path.join(library_dir, database + ext) for ext in ['.gmt', '.gmt.gz', '.txt', '.txt.gz']]
+        file_path = next((path for path in candidates if os.path.exists(path)), None)
+
+        if file_path is None:
+            if not download:
+                raise FileNotFoundError(f'Gene set library {database} not found in {library_dir}')
+            file_path = download_library(database, library_dir)
+
+        library = read_gmt_library(file_path, name=database)
+        _LIBRARIES[key] = library
+
+    return library
+
+
+
+
+def restrict_library(library: GeneSetLibrary, genes: List[str]) -> GeneSetLibrary:
+
+    """ Same terms with members restricted to 'genes' (e.g. background genes of speedrichr) """
+
+    cols = sorted({library.gene_index[gene] for gene in (gene.upper() for gene in genes) if gene in library.gene_index})
+    cols = np.array(cols, dtype=np.int64)
+
+    return GeneSetLibrary(name=library.name,
+                          terms=library.terms,
+                          genes=library.genes[cols],
+                          membership=library.membership[:, cols].tocsr())
+
+
+
+
+def _adjust_pvalues(pvalues: np.ndarray) -> np.ndarray:
+
+    # Benjamini-Hochberg correction
+    n = len(pvalues)
+    order = np.argsort(pvalues, kind='stable')
+    ranked = pvalues[order] * n / np.arange(1, n + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+
+    adjusted = np.empty(n)
+    adjusted[order] = np.minimum(ranked, 1)
+
+    return adjusted
+
+
+
+
+@metrics.timed('local.enrich')
+def enrich(genes: List[str],
+           library: GeneSetLibrary,
+           background_size: int = ENRICHR_BACKGROUND_SIZE) -> Dict:
+
+    """ Over-representation analysis of gene list against a gene set library
+
+        Statistics follow EnrichR: one-sided Fisher exact test (hypergeometric),
+        odds ratio, combined score (-ln(p) x odds ratio) and Benjamini-Hochberg adjusted p-value.
+
+        Args
+            genes (List): A list of genes to query.
+
+            library (GeneSetLibrary): Gene set library to test against.
+
+            background_size (int, optional): Size of gene universe. Defaults to 20000 as in EnrichR.
+
+        Returns
+            Dict: Same structure as JSON response of EnrichR 'enrich' API.
+                  {library name: [[Rank, Term, P-value, Odds ratio, Combined score, Overlapping genes,
+                                   Adjusted p-value, Old p-value, Old adjusted p-value], ...]}
+    """
+
+    # scipy.stats alone takes longer to import than the rest of qed.data
+    from scipy.stats import hypergeom
+
+    query = {gene.upper() for gene in genes}
+    n_query = len(query)
+
+    query_idx = np.array(sorted(library.gene_index[gene] for gene in query if gene in library.gene_index), dtype=np.int64)
+
+    sub = library.membership[:, query_idx]
+    overlap = np.asarray(sub.sum(axis=1)).ravel()
+
+    hit = np.flatnonzero(overlap > 0)
+
+    if len(hit) == 0:
+        return {library.name: []}
+
+    k = overlap[hit]
+    K = library.term_sizes[hit]
+    N = background_size
+
+    pvalues = hypergeom.sf(k - 1, N, K, n_query)
+
+    b = K - k
+    c = n_query - k
+    d = N - K - c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odds_ratio = (k * d) / np.maximum(b * c, 1)
+        combined_score = -np.log(pvalues) * odds_ratio
+
+    adjusted = _adjust_pvalues(pvalues)
+
+    order = np.argsort(pvalues, kind='stable')
+
+    sub = sub[hit].tocsr()
+    query_genes = library.genes[query_idx]
+
+    rows = []
+    for rank, i in enumerate(order, start=1):
+        overlapping = query_genes[sub.indices[sub.indptr[i]:sub.indptr[i + 1]]].tolist()
+        rows.append([rank,
+                     library.terms[hit[i]],
+                     float(pvalues[i]),
+                     float(odds_ratio[i]),
+                     float(combined_score[i]),
+                     overlapping,
+                     float(adjusted[i]),
+                     0,
+                     0])
+
+    return {library.name: rows}
@@ -0,0 +1,212 @@
+from typing import List, Dict, Iterable, Optional, TYPE_CHECKING
+import pandas as pd
+import numpy as np
+import itertools
+
+if TYPE_CHECKING:
+    from scipy import sparse
+
+
+
+
+# Integer-encoded 'Overlapping genes' (CSR: offsets + indices into a shared gene vocabulary)
+
+class GeneVocabulary:
+
+    """ Gene symbols and their integer IDs. Grows as new genes are encoded. """
+
+    def __init__(self, genes: Iterable[str] = ()):
+
+        self._index: Dict[str, int] = {}
+        self._genes: List[str] = []
+        self._array: Optional[np.ndarray] = None
+
+        self.encode(np.asarray(list(genes), dtype=object))
+
+    def __repr__(self) :
+
+        return f"GeneVocabulary object [number of genes: {len(self)}]"
+
+    def __len__(self) :
+
+        return len(self._genes)
+
+    def __contains__(self, gene: str) :
+
+        return gene in self._index
+
+    @property
+    def genes(self) -> np.ndarray:
+
+        if self._array is None or len(self._array) != len(self._genes):
+            self._array = np.array(self._genes, dtype=object)
+
+        return self._array
+
+    def get(self, gene: str, default: int = -1) -> int:
+
+        return self._index.get(gene, default)
+
+    def encode(self, genes: np.ndarray) -> np.ndarray:
+
+        """ IDs of genes, adding unseen genes to vocabulary. Hashes each distinct gene once. """
+
+        codes, uniques = pd.factorize(genes)
+        ids = np.empty(len(uniques), dtype=np.int32)
+
+        for i, gene in enumerate(uniques):
+            if gene not in self._index:
+                self._index[gene] = len(self._genes)
+                self._genes.append(gene)
+            ids[i] = self._index[gene]
+
+        return ids[codes]
+
+    def decode(self, ids: np.ndarray) -> np.ndarray:
+
+        return self.genes[ids]
+
+
+
+
+class OverlappingGenes:
+
+    """ Overlapping genes of many rows as CSR arrays
+
+        Genes of row i are vocabulary.genes[indices[offsets[i]:offsets[i + 1]]].
+        The list view of 'Overlapping genes' column is built on demand with 'to_lists'.
+
+        Example
+            overlaps = OverlappingGenes.from_lists(df['Overlapping genes'])
+            overlaps.counts                       # number of overlapping genes of each row
+            overlaps.rows_with_gene('INS')        # rows (terms) containing a gene
+            overlaps.restrict(['INS', 'GCG'])     # leading-edge genes of each row among given genes
+    """
+
+    def __init__(self, offsets: np.ndarray, indices: np.ndarray, vocabulary: GeneVocabulary):
+
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.vocabulary = vocabulary
+
+    def __repr__(self) :
+
+        return f"OverlappingGenes object [number of rows: {len(self)}, number of genes: {len(self.vocabulary)}]"
+
+    def __len__(self) :
+
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> List[str]:
+
+        return self.vocabulary.decode(self.indices[self.offsets[i]:self.offsets[i + 1]]).tolist()
+
+    @classmethod
+    def from_lists(cls, lists: Iterable[List[str]], vocabulary: Optional[GeneVocabulary] = None) :
+
+        """ Encode a list of gene lists (e.g. 'Overlapping genes' column) """
+
+        lists = list(lists)
+        vocabulary = vocabulary if vocabulary is not None else GeneVocabulary()
+
+        counts = np.fromiter((len(genes) for genes in lists), dtype=np.int64, count=len(lists))
+        flat = np.fromiter(itertools.chain.from_iterable(lists), dtype=object, count=int(counts.sum()))
+
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(offsets, vocabulary.encode(flat), vocabulary)
+
+    @classmethod
+    def concat(cls, overlaps: List['OverlappingGenes']) :
+
+        """ Concatenate rows of OverlappingGenes sharing one vocabulary """
+
+        vocabulary = overlaps[0].vocabulary
+
+        if any(other.vocabulary is not vocabulary for other in overlaps):
+            raise ValueError('OverlappingGenes should share one vocabulary')
+
+        counts = np.concatenate([other.counts for other in overlaps])
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(offsets, np.concatenate([other.indices for other in overlaps]), vocabulary)
+
+    @property
+    def counts(self) -> np.ndarray:
+
+        """ Number of overlapping genes of each row """
+
+        return np.diff(self.offsets)
+
+    @property
+    def matrix(self) -> 'sparse.csr_matrix':
+
+        """ Row x gene boolean matrix """
+
+        from scipy import sparse
+
+        return sparse.csr_matrix((np.ones(len(self.indices), dtype=bool), self.indices, self.offsets),
+                                 shape=(len(self), len(self.vocabulary)))
+
+    def _row_of_indices(self) -> np.ndarray:
+
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def to_lists(self) -> List[List[str]]:
+
+        """ List view, same as the 'Overlapping genes' column of EnrichR results """
+
+        genes = self.vocabulary.decode(self.indices).tolist()
+
+        return [genes[start:stop] for start, stop in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())]
+
+    def take(self, rows: np.ndarray) :
+
+        """ Subset of rows in the given order """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = self.counts[rows]
+
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # Position of each gathered index in self.indices
+        positions = np.repeat(self.offsets[rows] - offsets[:-1], counts) + np.arange(offsets[-1])
+
+        return OverlappingGenes(offsets, self.indices[positions], self.vocabulary)
+
+    def rows_with_gene(self, gene: str) -> np.ndarray:
+
+        """ Rows (terms) whose overlapping genes contain 'gene' """
+
+        gene_id = self.vocabulary.get(gene)
+
+        if gene_id < 0:
+            return np.array([], dtype=np.int64)
+
+        return np.unique(self._row_of_indices()[self.indices == gene_id])
+
+    def restrict(self, genes: Iterable[str]) :
+
+        """ Overlapping genes of each row among 'genes' (e.g. leading-edge genes of a ranked list) """
+
+        mask = np.zeros(len(self.vocabulary), dtype=bool)
+        ids = np.array([self.vocabulary.get(gene) for gene in genes], dtype=np.int64)
+        mask[ids[ids >= 0]] = True
+
+        keep = mask[self.indices]
+        counts = np.bincount(self._row_of_indices()[keep], minlength=len(self))
+
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return OverlappingGenes(offsets, self.indices[keep], self.vocabulary)
+
+    def overlap_counts(self, genes: Iterable[str]) -> np.ndarray:
+
+        """ Number of overlapping genes of each row among 'genes' """
+
+        return self.restrict(genes).counts
@@ -0,0 +1,197 @@
+from typing import List, Union, Optional, Iterable
+from .structure import geneset, merge_df
+from .store import ResultStore
+import pandas as pd
+import json
+import os
+
+
+
+
+# Partitioned Parquet/Feather persistence of enrichment results (requires pyarrow)
+
+RESULT_COLUMNS = ["Rank", "Term", "Term ID", "P-value", "Odds ratio", "Combined score", "Overlapping genes",
+                  "Adjusted p-value", "Old p-value", "Old adjusted p-value", "Database"]
+
+# Written at the root of a saved result directory
+METADATA_FILE = '_qed_results.json'
+
+FORMATS = {'parquet': 'parquet', 'feather': 'ipc'}
+
+
+
+
+def _import_pyarrow():
+
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError as e:
+        raise ImportError("Saving and loading results requires 'pyarrow'. Install it with 'pip install pyarrow' "
+                          "or 'pip install QED[parquet]'") from e
+
+    return pyarrow
+
+
+
+
+def _annot_colname(df: pd.DataFrame) -> str:
+
+    # merge_df output has one column besides EnrichR columns: the annotation column
+    extra = [col for col in df.columns if col not in RESULT_COLUMNS]
+
+    if len(extra) != 1:
+        raise ValueError(f"Cannot find annotation column among {extra}. Pass 'annot_colname'.")
+
+    return extra[0]
+
+
+
+
+def save_results(results: Union[List[geneset], ResultStore, pd.DataFrame],
+                 path: str,
+                 format: str = 'parquet',
+                 annot_colname: Optional[str] = None,
+                 overwrite: bool = False) :
+
+    """ Save enrichment results partitioned by database and geneset
+
+        Files are written as '{path}/Database={database}/{annot_colname}={annot}/part-0.{format}'.
+        'Overlapping genes' is kept as a list column.
+
+        Args
+            results (List[geneset], ResultStore or pd.DataFrame): Genesets with enrichment dataframes,
+                                                                 a ResultStore or output of merge_df.
+
+            path (str): Directory to write.
+
+            format (str, optional): 'parquet' or 'feather'. Feather files are uncompressed and are
+                                    memory-mapped without decoding when loaded. Defaults to 'parquet'.
+
+            annot_colname (str, optional): Column naming each geneset. Defaults to the column added
+                                           by get_enrichment_dataframes.
+
+            overwrite (bool, optional): Replace partitions already in 'path'. Defaults to False.
+
+    """
+
+    if format not in FORMATS:
+        raise ValueError("Invalid 'format' parameter. Supported values: 'parquet', 'feather'")
+
+    pa = _import_pyarrow()
+
+    if not overwrite and os.path.exists(os.path.join(path, METADATA_FILE)):
+        raise FileExistsError(f"Results already saved in {path}. Pass 'overwrite=True' to replace them.")
+
+    df = results if isinstance(results, pd.DataFrame) else merge_df(results)
+    annot_colname = annot_colname if annot_colname is not None else _annot_colname(df)
+
+    partitions = ['Database', annot_colname]
+    dtypes = {col: str(df[col].dtype) for col in partitions}
+
+    # Partition values are written as directory names
+    table = pa.Table.from_pandas(df.astype({col: str for col in partitions}), preserve_index=False)
+
+    file_format = pa.dataset.ParquetFileFormat() if format == 'parquet' else pa.dataset.IpcFileFormat()
+    file_options = None if format == 'parquet' else file_format.make_write_options(compression=None)
+
+    pa.dataset.write_dataset(table,
+                             path,
+                             format=file_format,
+                             file_options=file_options,
+                             partitioning=pa.dataset.partitioning(table.select(partitions).schema, flavor='hive'),
+                             basename_template='part-{i}.' + format,
+                             existing_data_behavior='delete_matching' if overwrite else 'error')
+
+    metadata = {'format': format,
+                'columns': list(df.columns),
+                'partitions': partitions,
+                'dtypes': dtypes}
+
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f)
+
+
+
+
+def _read_metadata(path: str) -> dict:
+
+    file_path = os.path.join(path, METADATA_FILE)
+
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f'{path} is not a directory written by save_results')
+
+    with open(file_path) as f:
+        return json.load(f)
+
+
+
+
+def load_results(path: str,
+                 columns: Optional[List[str]] = None,
+                 databases: Optional[Iterable[str]] = None,
+                 genesets: Optional[Iterable] = None,
+                 lazy: bool = False) :
+
+    """ Load enrichment results written by save_results
+
+        Files are memory-mapped. Only partitions of selected databases/genesets are opened
+        and only selected columns are read.
+
+        Args
+            path (str): Directory written by save_results.
+
+            columns (List, optional): Columns to read. Defaults to all columns.
+
+            databases (Iterable, optional): Databases to read. Defaults to all databases.
+
+            genesets (Iterable, optional): Values of annotation column to read. Defaults to all genesets.
+
+            lazy (bool, optional): Return a pyarrow Scanner without reading any data.
+                                   Use '.to_table()', '.to_batches()' or '.head(n)' on it. Defaults to False.
+
+        Returns
+            pd.DataFrame: Same columns as merge_df output, with 'Overlapping genes' as lists.
+    """
+
+    pa = _import_pyarrow()
+
+    metadata = _read_metadata(path)
+    partitions = metadata['partitions']
+
+    dataset = pa.dataset.dataset(path,
+                                 format=FORMATS[metadata['format']],
+                                 partitioning=pa.dataset.partitioning(pa.schema([(col, pa.string()) for col in partitions]),
+                                                                      flavor='hive'),
+                                 filesystem=pa.fs.LocalFileSystem(use_mmap=True),
+                                 exclude_invalid_files=False,
+                                 ignore_prefixes=['.', '_'])
+
+    columns = columns if columns is not None else metadata['columns']
+
+    # Filters on partition fields skip files of other databases/genesets
+    expression = None
+
+    for col, values in zip(partitions, [databases, genesets]):
+        if values is not None:
+            condition = pa.dataset.field(col).isin([str(value) for value in values])
+            expression = condition if expression is None else expression & condition
+
+    scanner = dataset.scanner(columns=columns, filter=expression)
+
+    if lazy:
+        return scanner
+
+    table = scanner.to_table()
+    df = table.select([col for col in columns if col != 'Overlapping genes']).to_pandas()
+
+    # Arrow converts list column to numpy arrays
+    if 'Overlapping genes' in columns:
+        df.insert(columns.index('Overlapping genes'), 'Overlapping genes', table.column('Overlapping genes').to_pylist())
+
+    for col, dtype in metadata['dtypes'].items():
+        if col in df.columns and dtype not in ['object', 'str', 'string']:
+            df[col] = df[col].astype(dtype)
+
+    return df
@@ -1,19 +1,105 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Callable
 from .structure import geneset
+from .store import ResultStore, compact_results
+from . import local
+from . import session
+from .cache import get_cache, hash_genes
+from .. import metrics
 import concurrent.futures
-from concurrent.futures import as_completed
 from threading import Lock
 from tqdm import tqdm
 import pandas as pd
 import requests
+import itertools
+import logging
+import random
 import json
-import copy
+import time
+import os
+
+
+
+
+ENRICHR_DEFAULT_URL = 'https://maayanlab.cloud/Enrichr'
+
+SPEEDRICHR_DEFAULT_URL = 'https://maayanlab.cloud/speedrichr'
+
+# Set by set_base_url. Defaults to $QED_ENRICHR_URL and $QED_SPEEDRICHR_URL, or the public service
+ENRICHR_BASE_URL = ENRICHR_DEFAULT_URL
+
+SPEEDRICHR_BASE_URL = SPEEDRICHR_DEFAULT_URL
+
+logger = logging.getLogger(__name__)
+
+
+
+
+def set_base_url(enrichr_url: str = None, speedrichr_url: str = None) :
+
+    """ Send requests to another EnrichR/speedrichr server, e.g. qed.data.server.EnrichrServer
+
+        Args
+            enrichr_url (str, optional): Base URL of EnrichR API (e.g. 'http://127.0.0.1:8000/Enrichr').
+                                         Also used to download libraries of 'local' backend.
+                                         Defaults to None (public EnrichR).
+
+            speedrichr_url (str, optional): Base URL of speedrichr API (requests with background genes).
+                                            Defaults to None (public speedrichr).
+
+        Results of other servers are cached apart from results of the public service.
+    """
+
+    global ENRICHR_BASE_URL, SPEEDRICHR_BASE_URL
+
+    ENRICHR_BASE_URL = (enrichr_url or ENRICHR_DEFAULT_URL).rstrip('/')
+    SPEEDRICHR_BASE_URL = (speedrichr_url or SPEEDRICHR_DEFAULT_URL).rstrip('/')
+
+    local.ENRICHR_LIBRARY_URL = ENRICHR_BASE_URL + '/geneSetLibrary'
+
+
+
+
+def _source(base_url: str, default_url: str) :
+
+    # Namespace of cache entries: None for the public service
+    return None if base_url == default_url else base_url
+
+
+set_base_url(os.environ.get('QED_ENRICHR_URL'), os.environ.get('QED_SPEEDRICHR_URL'))
+
+
+
+
+class EnrichrError(Exception):
+
+    """ Error response of EnrichR. 'status_code' is the HTTP status of the response. """
+
+    def __init__(self, message: str, status_code: int = None):
+
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Failures a re-request may recover from. Other errors (invalid library name, malformed response, ...) are raised at once.
+_TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                     ConnectionError, TimeoutError)
+
+
+def _is_transient(error: Exception) -> bool:
+
+    """ Whether 'error' is a rate limited (429) or server error (5xx) response, a connection error or a timeout """
+
+    if isinstance(error, EnrichrError):
+        return error.status_code is not None and (error.status_code == 429 or error.status_code >= 500)
+
+    return isinstance(error, _TRANSIENT_ERRORS)
 
 
 
 
 # Basic Gene Ontoloy Analysis
 
+@metrics.timed('query.upload', api='enrichr')
 def upload_genes(genes: List[str]) :
 
     """ Upload gene sets to EnrichR website
@@ -23,7 +109,7 @@ def upload_genes(genes: List[str]) :
 
     """
 
-    ENRICHR_URL = 'https://maayanlab.cloud/Enrichr/addList'
+    ENRICHR_URL = ENRICHR_BASE_URL + '/addList'
     genes_str = '\n'.join(genes)
     description = 'Example gene list'
     payload = {
@@ -31,10 +117,10 @@ def upload_genes(genes: List[str]) :
         'description': (None, description)
     }
 
-    response = requests.post(ENRICHR_URL, files=payload)
+    response = session.post(ENRICHR_URL, files=payload)
     
     if not response.ok:
-        raise Exception('Error analyzing gene list')
+        raise EnrichrError('Error analyzing gene list', response.status_code)
 
     data = json.loads(response.text)
 
@@ -43,6 +129,93 @@ def upload_genes(genes: List[str]) :
 
 
 
+class _UploadMemo:
+
+    """ Upload each distinct gene list once and share the result between threads
+
+        Gene lists with identical contents (regardless of order) share one upload.
+        A failed upload is not memoized, so it can be retried.
+        If 'persist' is given, identifiers are also stored in the on-disk cache under
+        that namespace and reused across runs.
+    """
+
+    def __init__(self, upload, persist: str = None):
+
+        self._upload = upload
+        self._persist = persist
+        self._lock = Lock()
+        self._futures = {}
+
+        self.uploaded = 0
+        self.reused = 0
+        self.bytes_saved = 0
+
+    def __len__(self) :
+
+        return len(self._futures)
+
+    def _load_or_upload(self, key: str, genes: List[str]) :
+
+        if self._persist is not None:
+            value = get_cache().get_upload(f'{self._persist}|{key}')
+
+            if value is not None:
+                return value, False
+
+        value = self._upload(genes)
+
+        if self._persist is not None:
+            get_cache().set_upload(f'{self._persist}|{key}', value)
+
+        return value, True
+
+    def get(self, genes: List[str]) :
+
+        key = hash_genes(genes)
+
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+
+            if owner:
+                future = concurrent.futures.Future()
+                self._futures[key] = future
+
+        if owner:
+            try:
+                value, uploaded = self._load_or_upload(key, genes)
+                future.set_result(value)
+
+            except Exception as e:
+                with self._lock:
+                    del self._futures[key]
+                future.set_exception(e)
+                raise
+
+        else:
+            value = future.result()
+            uploaded = False
+
+        with self._lock:
+            if uploaded:
+                self.uploaded += 1
+            else:
+                self.reused += 1
+                self.bytes_saved += len('\n'.join(genes).encode())
+
+        if metrics.is_enabled():
+            if uploaded:
+                metrics.count('uploads.uploaded')
+            else:
+                metrics.count('uploads.reused')
+                metrics.count('uploads.bytes_saved', len('\n'.join(genes).encode()))
+
+        return value
+
+
+
+
+@metrics.timed('parse.to_dataframe')
 def to_dataframe(request_res: Dict, 
                  database: str, 
                  annot_colname: str, 
@@ -58,15 +231,20 @@ def to_dataframe(request_res: Dict,
     df['Database'] = database
     df[annot_colname] = annot
 
-    return df
+    return compact_results(df, annot_colname)
 
 
 
 
+@metrics.timed('query.enrich', api='enrichr')
 def get_enrichment_data(genes: List, 
                         database: str, 
                         annot_colname: str, 
-                        annot: Any) :
+                        annot: Any,
+                        backend: str = 'enrichr',
+                        library_dir: str = None,
+                        cache: bool = True,
+                        uploads: _UploadMemo = None) :
 
     """ Get response from EnrichR website using querying gene set
     
@@ -79,28 +257,62 @@ def get_enrichment_data(genes: List,
 
             annot (Any): value for column 'annot_colname'.
 
+            backend (str, optional): 'enrichr' queries EnrichR website, 
+                                     'local' computes enrichment offline from GMT files. 
+                                     Defaults to 'enrichr'.
+
+            library_dir (str, optional): Directory of GMT files for 'local' backend.
+                                         Missing libraries are downloaded once. Defaults to ~/.cache/qed/libraries
+
+            cache (bool, optional): Reuse results stored in the on-disk cache (see qed.data.cache). 
+                                    Defaults to True.
+
+            uploads (_UploadMemo, optional): Uploaded gene lists shared within a batch. 
+                                             Defaults to None (upload every time).
+
     """
+
+    if backend == 'local':
+        library = local.load_library(database, library_dir)
+        res = local.enrich(genes, library)
+
+        return to_dataframe(res, database, annot_colname, annot)
+
+    elif backend != 'enrichr':
+        raise ValueError("Invalid 'backend' parameter. Supported values: 'enrichr', 'local'")
+
+    if cache:
+        key = get_cache().make_key(genes, database, source=_source(ENRICHR_BASE_URL, ENRICHR_DEFAULT_URL))
+        cached = get_cache().get(key)
+
+        if cached is not None:
+            return to_dataframe({database: cached}, database, annot_colname, annot)
     
-    data = upload_genes(genes)
+    data = uploads.get(genes) if uploads is not None else upload_genes(genes)
 
-    ENRICHR_URL = 'https://maayanlab.cloud/Enrichr/enrich'
+    ENRICHR_URL = ENRICHR_BASE_URL + '/enrich'
     query_string = '?userListId=%s&backgroundType=%s'
     user_list_id = data['userListId']
     gene_set_library = database
 
     url = ENRICHR_URL + query_string % (user_list_id, gene_set_library)
-    response = requests.get(url, stream=True)
+    response = session.get(url, stream=True)
     
     if not response.ok:
 
-        print(f"Status code: {response.status_code}")
-        print(f"Response content: {response.content}")
+        # Reported by the caller once re-requests are exhausted
+        logger.debug('Error fetching enrichment results for %s (status code: %s): %r', database, response.status_code, 
+                     response.content, extra={'database': database, 'status_code': response.status_code})
 
-        raise Exception('Error fetching enrichment results')
+        raise EnrichrError(f'Error fetching enrichment results for {database} (status code: {response.status_code})', 
+                           response.status_code)
     
     res = json.loads(response.text)
 
     df = to_dataframe(res, database, annot_colname, annot)
+
+    if cache:
+        get_cache().set(key, res[database], database)
     
     return df
 
@@ -110,7 +322,11 @@ def get_enrichment_data(genes: List,
 def _get_multiple_enrichment_data(geneset: geneset, 
                                   database: str, 
                                   annot_colname: str, 
-                                  annot: Any = None):
+                                  annot: Any = None,
+                                  backend: str = 'enrichr',
+                                  library_dir: str = None,
+                                  cache: bool = True,
+                                  uploads: _UploadMemo = None):
     """
     Get multiple enrichment data.
 
@@ -123,11 +339,19 @@ def _get_multiple_enrichment_data(geneset: geneset,
         annot_colname (str): The name of the column containing annotations in the database.
 
         annot (Any, optional): The annotation to use. Defaults to None. 
+
+        backend (str, optional): 'enrichr' or 'local'. Defaults to 'enrichr'.
+
+        library_dir (str, optional): Directory of GMT files for 'local' backend. Defaults to None.
+
+        cache (bool, optional): Whether to use the on-disk result cache. Defaults to True.
+
+        uploads (_UploadMemo, optional): Uploaded gene lists shared within a batch. Defaults to None.
     """
     
     try:
         annot = annot if annot is not None else geneset.name
-        result_df = get_enrichment_data(geneset.genes, database, annot_colname, annot)
+        result_df = get_enrichment_data(geneset.genes, database, annot_colname, annot, backend, library_dir, cache, uploads)
         geneset.GO.append(result_df)
 
         geneset.params['annot_colname'] = annot_colname
@@ -135,19 +359,250 @@ def _get_multiple_enrichment_data(geneset: geneset,
     
     except Exception as e:
         
-        print(f"Error processing {geneset.name} for {database}: {str(e)}")
+        _log_failure(geneset.name, database, e)
 
     return geneset
 
 
 
 
+def _log_failure(name: Any, database: str, error: Exception) :
+
+    logger.error('Error processing %s for %s: %s', name, database, error, 
+                 extra={'geneset': name, 'database': database, 'error': type(error).__name__})
+
+    metrics.count('query.failures', database=database)
+
+
+
+
+def _backoff_delay(attempt: int, backoff: float, backoff_max: float = 60.0) -> float:
+
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(backoff_max, backoff * 2 ** attempt))
+
+
+
+
+class _RetryStats:
+
+    """ Re-requests made by the tasks of one batch """
+
+    def __init__(self):
+
+        self._lock = Lock()
+        self.retries = 0
+        self.retried = 0
+        self.recovered = 0
+
+    def __repr__(self) :
+
+        return f"_RetryStats object [re-requests: {self.retries}, retried: {self.retried}, recovered: {self.recovered}]"
+
+    def add(self, retries: int, ok: bool) :
+
+        if retries == 0:
+            return
+
+        with self._lock:
+            self.retries += retries
+            self.retried += 1
+            self.recovered += int(ok)
+
+
+
+
+def _call_with_retry(func, 
+                     args: tuple, 
+                     max_retry: int = 0, 
+                     backoff: float = 1.0, 
+                     submitted: float = None, 
+                     stats: _RetryStats = None) :
+
+    """ Call 'func(*args)' and retry transient failures (see _is_transient) up to 'max_retry' times
+        with jittered exponential backoff. Other errors are raised at once.
+    """
+
+    if submitted is not None:
+        metrics.observe('query.queue_wait', time.perf_counter() - submitted)
+
+    for attempt in range(max_retry + 1):
+        try:
+            result = func(*args)
+
+        except Exception as e:
+            if attempt == max_retry or not _is_transient(e):
+                if stats is not None:
+                    stats.add(attempt, False)
+                raise
+
+            delay = _backoff_delay(attempt, backoff)
+
+            # Final failures are logged at ERROR by the caller
+            logger.debug('Retrying after %.2f seconds (attempt %d): %s', delay, attempt + 1, e)
+            metrics.count('query.retries')
+            metrics.observe('query.backoff', delay)
+
+            time.sleep(delay)
+            continue
+
+        if stats is not None:
+            stats.add(attempt, True)
+
+        return result
+
+
+
+
+def _iter_results(func: Callable, 
+                  tasks: Iterable, 
+                  n_jobs: int = None, 
+                  n_retry: int = 0, 
+                  backoff: float = 1.0, 
+                  rate_limit: float = None,
+                  max_pending: int = None,
+                  stats: _RetryStats = None) -> Iterator:
+
+    """ Run 'func(*args)' for each (key, args) of 'tasks' on a thread pool
+
+        Yields (key, result, error) as each task completes. Failed tasks are retried inside the pool 
+        with jittered exponential backoff. At most 'max_pending' tasks are submitted ahead of the consumer, 
+        so a slow consumer holds back new requests.
+    """
+
+    n_workers = n_jobs if n_jobs is not None else session.DEFAULT_POOL_SIZE
+    max_pending = max_pending if max_pending is not None else 2 * n_workers
+
+    tasks = iter(tasks)
+    pending = {}
+
+    session.ensure_pool_size(n_workers)
+
+    # Limiter of this call only, seen by its workers; other batches keep theirs
+    context = session.limited_context(rate_limit)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+
+        try:
+            while True:
+
+                for key, args in itertools.islice(tasks, max(max_pending - len(pending), 0)):
+                    submitted = time.perf_counter() if metrics.is_enabled() else None
+                    pending[executor.submit(context.copy().run, _call_with_retry, func, args, n_retry, backoff, submitted, stats)] = key
+
+                if not pending:
+                    break
+
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    key = pending.pop(future)
+                    error = future.exception()
+
+                    yield key, (future.result() if error is None else None), error
+
+        finally:
+            # Consumer stopped early
+            for future in pending:
+                future.cancel()
+
+
+
+
+def _collect_results(results: Iterator, 
+                     geneset_list: List[geneset],
+                     dblist: List,
+                     annot_colname: str, 
+                     annot: Any, 
+                     handle_error: bool, 
+                     max_iter: int,
+                     cache_stats: Dict = None,
+                     store: ResultStore = None,
+                     retry_stats: _RetryStats = None) -> List[geneset]:
+
+    """ Gather results keyed by (geneset index, database index) into new geneset objects
+
+        Workers only return dataframes. Input genesets are left untouched and new genesets
+        share their genes and existing dataframes (copy-on-write), with new results in 'dblist' order.
+        New results are also appended to 'store' as each request completes, keyed so that the
+        store consolidates them in the same order, after results of earlier calls.
+    """
+
+    pbar = tqdm(total=len(geneset_list) * len(dblist), desc='Processing genesets')
+    collected = [{} for _ in geneset_list]
+    batch = store.new_batch() if store is not None else None
+    n_failed = 0
+
+    for (i, j), df, error in results:
+
+        if error is None:
+            collected[i][j] = df
+
+            if store is not None:
+                store.append(df, geneset_list[i].name, dblist[j], order=(batch, i, j))
+
+        else:
+            _log_failure(geneset_list[i].name, dblist[j], error)
+            n_failed += 1
+
+        pbar.update(1)
+
+    pbar.close()
+
+    if handle_error and retry_stats is not None:
+        if retry_stats.retried == 0:
+            logger.info('Nothing to re-request')
+        else:
+            logger.info('%d requests re-requested (%d re-requests), %d recovered', 
+                        retry_stats.retried, retry_stats.retries, retry_stats.recovered,
+                        extra={'retried': retry_stats.retried, 'retries': retry_stats.retries, 
+                               'recovered': retry_stats.recovered})
+
+    if n_failed:
+        logger.warning('%d requests failed%s', n_failed, f' after up to {max_iter} re-requests' if handle_error else '', 
+                       extra={'n_failed': n_failed, 'max_iter': max_iter if handle_error else 0})
+
+    if cache_stats is not None:
+        _report_cache(cache_stats)
+
+    return [_attach_results(gs, [dfs[j] for j in sorted(dfs)], dblist, annot_colname, annot) 
+            for gs, dfs in zip(geneset_list, collected)]
+
+
+
+
+def _attach_results(gs: geneset, 
+                    results: List[pd.DataFrame], 
+                    dblist: List, 
+                    annot_colname: str, 
+                    annot: Any) -> geneset:
+
+    params = {'database': dblist}
+
+    if results:
+        params['annot_colname'] = annot_colname
+        params['annot'] = annot if annot is not None else gs.name
+
+    return gs.with_GO(results, **params)
+
+
+
+
+def _report_cache(start_stats: Dict) :
+
+    stats = get_cache().stats()
+    hits = stats['hits'] - start_stats['hits']
+    misses = stats['misses'] - start_stats['misses']
+
+    logger.info('Cache hits: %d, misses: %d', hits, misses, extra={'cache_hits': hits, 'cache_misses': misses})
+
+
+
+
 def get_enrichment_dataframes_spare(geneset_list :List[geneset], 
                                     dblist: List, annot_colname: str, 
                                     annot: Any = None):
     
-    print_lock = Lock()
-
     with concurrent.futures.ThreadPoolExecutor() as executor:
         for geneset in geneset_list:
             futures = {executor.submit(_get_multiple_enrichment_data, 
@@ -157,11 +612,9 @@ def get_enrichment_dataframes_spare(geneset_list :List[geneset],
                                        annot): database for database in dblist}
             concurrent.futures.wait(futures)
             
-            with print_lock:
-                print(f'{geneset.name} completed!')
+            logger.info('%s completed!', geneset.name)
     
-    with print_lock :    
-        print(f'All process completed!')
+    logger.info('All process completed!')
 
     return geneset_list
 
@@ -174,13 +627,13 @@ def get_enrichment_dataframes(geneset_list: List[geneset],
                               annot: Any = None, 
                               n_jobs: int = None,
                               handle_error: bool = False,
-                              max_iter: int = 10):
-    
-    _geneset_list = copy.deepcopy(geneset_list)
-
-    for geneset in _geneset_list:
-        geneset.params['database'] = dblist
-    
+                              max_iter: int = 10,
+                              backend: str = 'enrichr',
+                              library_dir: str = None,
+                              cache: bool = True,
+                              backoff: float = 1.0,
+                              rate_limit: float = None,
+                              store: ResultStore = None):
     """
     Retrieves enrichment dataframes for a list of genesets from multiple databases.
 
@@ -195,135 +648,128 @@ def get_enrichment_dataframes(geneset_list: List[geneset],
         
         n_jobs (int, optional): The number of parallel jobs to run. Defaults to None.
 
-        handle_error (bool, optional): Whether to handle errors. Defaults to False.
+        handle_error (bool, optional): Whether to re-request queries that failed with a transient error
+                                       (status 429 or 5xx, connection error or timeout). Defaults to False.
 
-        max_iter (int, optional): The maximum number of iterations to run. Defaults to 10.
+        max_iter (int, optional): The maximum number of re-requests for each query. Defaults to 10.
 
-    Returns:
-        List[geneset]: The input geneset list.
+        backend (str, optional): 'enrichr' queries EnrichR website, 'local' computes the same
+                                 statistics offline from EnrichR GMT libraries. Defaults to 'enrichr'.
 
-    """
-    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as executor:
-        futures = {executor.submit(_get_multiple_enrichment_data, 
-                                   geneset, 
-                                   database, 
-                                   annot_colname, 
-                                   annot): geneset for geneset in _geneset_list for database in dblist}
-        
-        pbar = tqdm(total=len(geneset_list), desc='Processing genesets')
-        
-        for future in concurrent.futures.as_completed(futures):
-
-            geneset = futures[future]
-            pbar.update(1)
-        
-    pbar.close()
+        library_dir (str, optional): Directory of GMT files for 'local' backend. 
+                                     Missing libraries are downloaded once. Defaults to ~/.cache/qed/libraries
 
+        cache (bool, optional): Reuse results stored in the on-disk cache (~/.cache/qed by default, see qed.data.cache) 
+                                and store new ones. False skips the cache for this call; set_cache(enabled=False) 
+                                disables it for all calls. Hit/miss counts are logged at INFO level. Defaults to True.
 
-    # Re-request for geneset that has error
-    if handle_error :
+        backoff (float, optional): Base delay in seconds of jittered exponential backoff between re-requests. 
+                                   Defaults to 1.0.
 
-        print('Trying to re-request...')
+        rate_limit (float, optional): Maximum requests per second sent to EnrichR during this call. 
+                                      Defaults to None (see qed.data.configure_session).
 
-        geneset_list_2 = copy.deepcopy(_geneset_list)
-
-        for geneset in geneset_list_2:
-            
-            len_success = len(geneset.GO)
-            db_successs = [df['Database'].values[0] for df in geneset.GO]
-            retry_db = [db for db in geneset.params['database'] if db not in db_successs]
+        store (ResultStore, optional): Also append each result dataframe to this store. 
+                                       'merge_df(store)' then skips the per-call concat. Defaults to None.
 
-            if len_success < len(geneset.params['database']) :
-                geneset.params['re_request'] = retry_db
-            else :
-                geneset.params['re_request'] = []
-
-        if all([len(geneset.params['re_request']) == 0 for geneset in geneset_list_2]):
-            print("Nothing to re-request")
-
-        max_iter = max_iter
-        iter_count = 0
+    Returns:
+        List[geneset]: New geneset objects with enrichment dataframes. 
+                       The input genesets are not modified and share their existing dataframes.
 
-        while any([len(geneset.params['re_request']) > 0 for geneset in geneset_list_2]) and iter_count < max_iter :
+    """
+    if backend not in ['enrichr', 'local']:
+        raise ValueError("Invalid 'backend' parameter. Supported values: 'enrichr', 'local'")
 
-            for geneset in geneset_list_2:
-                
-                for database in geneset.params['re_request']:
-                    
-                    _get_multiple_enrichment_data(geneset, 
-                                                  database, 
-                                                  annot_colname, 
-                                                  annot)
+    cache_stats = get_cache().stats()
 
-                    print(f'{geneset.name} with {database} completed!')
+    # Each distinct gene list is uploaded once and its userListId reused for every database
+    uploads = _UploadMemo(upload_genes)
 
-            for geneset in geneset_list_2:
-                
-                len_success = len(geneset.GO)
-                db_successs = [df['Database'].values[0] for df in geneset.GO]
-                retry_db = [db for db in geneset.params['re_request'] if db not in db_successs]
+    tasks = (((i, j), 
+              (geneset.genes, 
+               database, 
+               annot_colname, 
+               annot if annot is not None else geneset.name,
+               backend,
+               library_dir,
+               cache,
+               uploads)) for i, geneset in enumerate(geneset_list) for j, database in enumerate(dblist))
 
-                if len_success < len(geneset.params['database']) :
-                    geneset.params['re_request'] = retry_db
-                else :
-                    geneset.params['re_request'] = []
+    retry_stats = _RetryStats()
 
-            iter_count += 1
+    results = _iter_results(get_enrichment_data, 
+                            tasks, 
+                            n_jobs, 
+                            max_iter if handle_error else 0, 
+                            backoff, 
+                            rate_limit,
+                            stats=retry_stats)
 
-    return geneset_list_2 if handle_error else _geneset_list
+    return _collect_results(results, geneset_list, dblist, annot_colname, annot, handle_error, max_iter, 
+                            cache_stats if cache else None, store, retry_stats)
 
 
 
 
 # Gene Ontology Analysis with background genes
 
+@metrics.timed('query.upload', api='speedrichr')
 def upload_genes_with_background (genes: List[str]) :
     
-    base_url = "https://maayanlab.cloud/speedrichr"
+    base_url = SPEEDRICHR_BASE_URL
 
     genes = genes.copy()
 
     description = "sample gene set with background"
 
-    res = requests.post(
+    res = session.post(
         base_url+'/api/addList',
         files=dict(
         list=(None, '\n'.join(genes)),
         description=(None, description),
         )
     )
-    if res.ok:
-        userlist_response = res.json()
+    if not res.ok:
+        raise EnrichrError('Error analyzing gene list', res.status_code)
+
+    userlist_response = res.json()
         
     return userlist_response['userListId']
 
 
 
 
+@metrics.timed('query.upload_background', api='speedrichr')
 def upload_background_genes(genes: List[str]) :
 
-    base_url = "https://maayanlab.cloud/speedrichr"
+    base_url = SPEEDRICHR_BASE_URL
 
     bggenes = genes.copy()
 
-    res = requests.post(
+    res = session.post(
         base_url+'/api/addbackground',
         data=dict(background='\n'.join(bggenes)),
     )
 
-    if res.ok:
-        background_response = res.json()
+    if not res.ok:
+        raise EnrichrError('Error uploading background genes', res.status_code)
+
+    background_response = res.json()
 
     return background_response['backgroundid']
 
 
 
 
+@metrics.timed('query.enrich', api='speedrichr')
 def get_enrichment_data_with_background(query_genes: List[str],
                                         background_genes: List[str], 
                                         database: str, 
                                         annot_colname: str, 
-                                        annot: Any
+                                        annot: Any,
+                                        cache: bool = True,
+                                        uploads: _UploadMemo = None,
+                                        background_uploads: _UploadMemo = None
                                         ) :
 
     """ Get response from EnrichR website using querying and background gene set
@@ -334,15 +780,29 @@ def get_enrichment_data_with_background(query_genes: List[str],
             background_genes (List) : List of gene want to be set to background
 
             database (str) : Name of database for backgroundType  
+
+            cache (bool, optional) : Reuse results stored in the on-disk cache. Defaults to True.
+
+            uploads (_UploadMemo, optional) : Uploaded query gene lists shared within a batch. Defaults to None.
+
+            background_uploads (_UploadMemo, optional) : Uploaded background shared within a batch. Defaults to None.
     
     """
+
+    if cache:
+        key = get_cache().make_key(query_genes, database, background_genes, 
+                                   source=_source(SPEEDRICHR_BASE_URL, SPEEDRICHR_DEFAULT_URL))
+        cached = get_cache().get(key)
+
+        if cached is not None:
+            return to_dataframe({database: cached}, database, annot_colname, annot)
     
-    UID = upload_genes_with_background(query_genes)
-    BGID = upload_background_genes(background_genes)
+    UID = uploads.get(query_genes) if uploads is not None else upload_genes_with_background(query_genes)
+    BGID = background_uploads.get(background_genes) if background_uploads is not None else upload_background_genes(background_genes)
 
-    base_url = "https://maayanlab.cloud/speedrichr"
+    base_url = SPEEDRICHR_BASE_URL
 
-    res = requests.post(
+    res = session.post(
         base_url+'/api/backgroundenrich',
         data = dict(
             userListId = UID,
@@ -351,10 +811,15 @@ def get_enrichment_data_with_background(query_genes: List[str],
         )
     )
 
-    if res.ok:
-        results = res.json()
+    if not res.ok:
+        raise EnrichrError('Error fetching enrichment results', res.status_code)
+
+    results = res.json()
 
     df = to_dataframe(results, database, annot_colname, annot)
+
+    if cache:
+        get_cache().set(key, results[database], database)
     
     return df
 
@@ -366,7 +831,10 @@ def _get_multiple_enrichment_data_with_background(
     background_geneset: List,
     database: str,
     annot_colname: str,
-    annot: Any = None
+    annot: Any = None,
+    cache: bool = True,
+    uploads: _UploadMemo = None,
+    background_uploads: _UploadMemo = None
 ):
     """
     Get multiple enrichment data with background geneset.
@@ -382,6 +850,12 @@ def _get_multiple_enrichment_data_with_background(
 
         annot (Any, optional): The annotation to use. Defaults to None.
 
+        cache (bool, optional): Whether to use the on-disk result cache. Defaults to True.
+
+        uploads (_UploadMemo, optional): Uploaded query gene lists shared within a batch. Defaults to None.
+
+        background_uploads (_UploadMemo, optional): Uploaded background shared within a batch. Defaults to None.
+
     Returns:
         geneset: The updated geneset object with enrichment data appended to the GO attribute.
     """
@@ -393,7 +867,10 @@ def _get_multiple_enrichment_data_with_background(
             background_geneset,
             database,
             annot_colname,
-            annot
+            annot,
+            cache,
+            uploads,
+            background_uploads
         )
         geneset.GO.append(result_df)
 
@@ -402,7 +879,7 @@ def _get_multiple_enrichment_data_with_background(
 
     except Exception as e:
         
-        print(f"Error processing {geneset.name} for {database}: {str(e)}")
+        _log_failure(geneset.name, database, e)
 
     return geneset
 
@@ -413,8 +890,6 @@ def get_enrichment_dataframes_with_background_spare(geneset_list :List[geneset],
                                     dblist: List, annot_colname: str, 
                                     annot: Any = None):
     
-    print_lock = Lock()
-
     with concurrent.futures.ThreadPoolExecutor() as executor:
         for geneset in geneset_list:
             futures = {executor.submit(_get_multiple_enrichment_data_with_background, 
@@ -424,11 +899,9 @@ def get_enrichment_dataframes_with_background_spare(geneset_list :List[geneset],
                                        annot): database for database in dblist}
             concurrent.futures.wait(futures)
             
-            with print_lock:
-                print(f'{geneset.name} completed!')
+            logger.info('%s completed!', geneset.name)
     
-    with print_lock :    
-        print(f'All process completed!')
+    logger.info('All process completed!')
 
     return geneset_list
 
@@ -442,7 +915,12 @@ def get_enrichment_dataframes_with_background(geneset_list: List[geneset],
                               annot: Any =None, 
                               n_jobs: int = None,
                               handle_error: bool = False,
-                              max_iter: int = 10):
+                              max_iter: int = 10,
+                              cache: bool = True,
+                              persist_background: bool = False,
+                              backoff: float = 1.0,
+                              rate_limit: float = None,
+                              store: ResultStore = None):
     """
     Get enrichment dataframes with background genes.
 
@@ -459,82 +937,184 @@ def get_enrichment_dataframes_with_background(geneset_list: List[geneset],
         
         n_jobs (int, optional): The number of parallel jobs to run. Defaults to None.
 
+        handle_error (bool, optional): Whether to re-request queries that failed with a transient error
+                                       (status 429 or 5xx, connection error or timeout). Defaults to False.
+
+        max_iter (int, optional): The maximum number of re-requests for each query. Defaults to 10.
+
+        cache (bool, optional): Reuse results stored in the on-disk cache (~/.cache/qed by default, see qed.data.cache) 
+                                and store new ones. False skips the cache for this call; set_cache(enabled=False) 
+                                disables it for all calls. Hit/miss counts are logged at INFO level. Defaults to True.
+
+        persist_background (bool, optional): Keep backgroundid in the on-disk cache and reuse it 
+                                             across runs (for one day). Defaults to False.
+
+        backoff (float, optional): Base delay in seconds of jittered exponential backoff between re-requests. 
+                                   Defaults to 1.0.
+
+        rate_limit (float, optional): Maximum requests per second sent to EnrichR during this call. 
+                                      Defaults to None (see qed.data.configure_session).
+
+        store (ResultStore, optional): Also append each result dataframe to this store. 
+                                       'merge_df(store)' then skips the per-call concat. Defaults to None.
+
     Returns:
-        List[geneset]: The list of genesets.
+        List[geneset]: New geneset objects with enrichment dataframes. 
+                       The input genesets are not modified and share their existing dataframes.
     """
 
-    _geneset_list = copy.deepcopy(geneset_list)
-    background_genes = background_geneset.copy()
+    background_genes = list(background_geneset)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers = n_jobs) as executor:
+    cache_stats = get_cache().stats()
 
-        futures = {executor.submit(_get_multiple_enrichment_data_with_background, 
-                                   geneset, 
-                                   background_genes, 
-                                   database, 
-                                   annot_colname, 
-                                   annot): geneset for geneset in _geneset_list for database in dblist}
-        
-        pbar = tqdm(total=len(geneset_list), desc='Processing genesets')
-        
-        for future in as_completed(futures):
-            geneset = futures[future]
-            pbar.update(1)
-        
-    pbar.close()
+    # Each distinct query gene list is uploaded once and its userListId reused for every database
+    uploads = _UploadMemo(upload_genes_with_background)
 
-    # Re-request for geneset that has error
-    if handle_error :
+    # Background is uploaded once and its backgroundid reused for every geneset and database
+    source = _source(SPEEDRICHR_BASE_URL, SPEEDRICHR_DEFAULT_URL)
+    namespace = 'speedrichr_background' if source is None else f'speedrichr_background|{source}'
 
-        print('Trying to re-request...')
+    backgrounds = _UploadMemo(upload_background_genes, 
+                              persist=namespace if persist_background else None)
 
-        geneset_list_2 = copy.deepcopy(_geneset_list)
+    tasks = (((i, j), 
+              (geneset.genes, 
+               background_genes, 
+               database, 
+               annot_colname, 
+               annot if annot is not None else geneset.name,
+               cache,
+               uploads,
+               backgrounds)) for i, geneset in enumerate(geneset_list) for j, database in enumerate(dblist))
 
-        for geneset in geneset_list_2:
-            
-            len_success = len(geneset.GO)
-            db_successs = [df['Database'].values[0] for df in geneset.GO]
-            retry_db = [db for db in geneset.params['database'] if db not in db_successs]
+    retry_stats = _RetryStats()
+
+    results = _iter_results(get_enrichment_data_with_background, 
+                            tasks, 
+                            n_jobs, 
+                            max_iter if handle_error else 0, 
+                            backoff, 
+                            rate_limit,
+                            stats=retry_stats)
+
+    geneset_list = _collect_results(results, geneset_list, dblist, annot_colname, annot, handle_error, max_iter, 
+                                    cache_stats if cache else None, store, retry_stats)
+
+    logger.info('Background uploads: %d, reused: %d, bytes saved: %d', backgrounds.uploaded, backgrounds.reused, backgrounds.bytes_saved,
+                extra={'background_uploads': backgrounds.uploaded, 'background_reused': backgrounds.reused, 
+                       'bytes_saved': backgrounds.bytes_saved})
+
+    return geneset_list
+
+
+
+
+# Streaming results
+
+def iter_enrichment_dataframes(geneset_list: List[geneset],
+                               dblist: List,
+                               annot_colname: str,
+                               annot: Any = None,
+                               background_genes: List = None,
+                               n_jobs: int = None,
+                               handle_error: bool = False,
+                               max_iter: int = 10,
+                               backend: str = 'enrichr',
+                               library_dir: str = None,
+                               cache: bool = True,
+                               backoff: float = 1.0,
+                               rate_limit: float = None,
+                               callback: Callable = None,
+                               max_pending: int = None) -> Iterator:
+    """
+    Yields enrichment dataframes of (geneset, database) pairs as each request completes.
+
+    Results are not attached to the genesets, so they can be written to disk or plotted 
+    while other requests are running. Failed requests are reported and skipped.
+
+    Args:
+        geneset_list (List[geneset]): A list of genesets for enrichment analysis.
+
+        dblist (List): A list of databases to perform enrichment analysis on.
+
+        annot_colname (str): The column name in the database for annotation.
+
+        annot (Any, optional): Additional annotation information. Defaults to None.
+
+        background_genes (List, optional): A list of background genes. If given, genesets are 
+                                           queried with background (speedrichr). Defaults to None.
+
+        n_jobs (int, optional): The number of parallel jobs to run. Defaults to None.
+
+        handle_error (bool, optional): Whether to re-request queries that failed with a transient error
+                                       (status 429 or 5xx, connection error or timeout). Defaults to False.
+
+        max_iter (int, optional): The maximum number of re-requests for each query. Defaults to 10.
+
+        backend (str, optional): 'enrichr' or 'local'. Defaults to 'enrichr'.
+
+        library_dir (str, optional): Directory of GMT files for 'local' backend. Defaults to None.
+
+        cache (bool, optional): Reuse results stored in the on-disk cache (~/.cache/qed by default, see qed.data.cache) 
+                                and store new ones. False skips the cache for this call; set_cache(enabled=False) 
+                                disables it for all calls. Defaults to True.
+
+        backoff (float, optional): Base delay in seconds of jittered exponential backoff between re-requests. 
+                                   Defaults to 1.0.
+
+        rate_limit (float, optional): Maximum requests per second sent to EnrichR. Defaults to None.
+
+        callback (Callable, optional): Called as callback(geneset_name, database, df) for each result 
+                                       before it is yielded. Defaults to None.
+
+        max_pending (int, optional): Maximum number of requests submitted ahead of the consumer. 
+                                     Defaults to 2 * n_jobs.
+
+    Yields:
+        Tuple[str, str, pd.DataFrame]: geneset name, database and enrichment dataframe.
+    """
+
+    if backend not in ['enrichr', 'local']:
+        raise ValueError("Invalid 'backend' parameter. Supported values: 'enrichr', 'local'")
 
-            if len_success < len(geneset.params['database']) :
-                geneset.params['re_request'] = retry_db
-            else :
-                geneset.params['re_request'] = []
+    if background_genes is not None and backend == 'local':
+        raise ValueError("'background_genes' is not supported with 'local' backend")
 
-        if all([len(geneset.params['re_request']) == 0 for geneset in geneset_list_2]):
-            print("Nothing to re-request")
+    if background_genes is None:
+        uploads = _UploadMemo(upload_genes)
 
-        max_iter = max_iter
-        iter_count = 0
+        func = get_enrichment_data
+        tasks = (((gs, database), 
+                  (gs.genes, database, annot_colname, annot if annot is not None else gs.name, 
+                   backend, library_dir, cache, uploads)) for gs in geneset_list for database in dblist)
 
-        while any([len(geneset.params['re_request']) > 0 for geneset in geneset_list_2]) and iter_count < max_iter :
+    else:
+        uploads = _UploadMemo(upload_genes_with_background)
+        backgrounds = _UploadMemo(upload_background_genes)
 
-            for geneset in geneset_list_2:
-                
-                for database in geneset.params['re_request']:
-                    
-                    _get_multiple_enrichment_data_with_background(geneset, 
-                                                                  background_genes,
-                                                                  database, 
-                                                                  annot_colname, 
-                                                                  annot)
+        func = get_enrichment_data_with_background
+        tasks = (((gs, database), 
+                  (gs.genes, background_genes, database, annot_colname, annot if annot is not None else gs.name, 
+                   cache, uploads, backgrounds)) for gs in geneset_list for database in dblist)
 
-                    print(f'{geneset.name} with {database} completed!')
+    results = _iter_results(func, 
+                            tasks, 
+                            n_jobs, 
+                            max_iter if handle_error else 0, 
+                            backoff, 
+                            rate_limit, 
+                            max_pending)
 
-            for geneset in geneset_list_2:
-                
-                len_success = len(geneset.GO)
-                db_successs = [df['Database'].values[0] for df in geneset.GO]
-                retry_db = [db for db in geneset.params['re_request'] if db not in db_successs]
+    for (gs, database), df, error in results:
 
-                if len_success < len(geneset.params['database']) :
-                    geneset.params['re_request'] = retry_db
-                else :
-                    geneset.params['re_request'] = []
+        if error is not None:
+            _log_failure(gs.name, database, error)
+            continue
 
-            iter_count += 1
+        if callback is not None:
+            callback(gs.name, database, df)
 
-    return geneset_list_2 if handle_error else _geneset_list
+        yield gs.name, database, df
 
 
 
@@ -543,11 +1123,11 @@ def get_enrichment_dataframes_with_background(geneset_list: List[geneset],
 
 def find_terms_with_gene(gene: str) :
 
-    ENRICHR_URL = 'https://maayanlab.cloud/Enrichr/genemap'
+    ENRICHR_URL = ENRICHR_BASE_URL + '/genemap'
     query_string = '?json=true&setup=true&gene=%s'
     gene = gene
 
-    response = requests.get(ENRICHR_URL + query_string % gene)
+    response = session.get(ENRICHR_URL + query_string % gene)
     
     if not response.ok:
         raise Exception('Error searching for terms')
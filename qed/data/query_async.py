@@ -0,0 +1,353 @@
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+from .structure import geneset
+from .store import ResultStore
+from .cache import get_cache, hash_genes
+from . import query
+from . import session
+from .. import metrics
+from tqdm import tqdm
+import pandas as pd
+import asyncio
+import time
+import json
+
+
+
+
+# asyncio counterpart of qed.data.query (requires aiohttp)
+
+def _import_aiohttp():
+
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("Async API requires 'aiohttp'. Install it with 'pip install aiohttp' "
+                          "or 'pip install QED[async]'") from e
+
+    return aiohttp
+
+
+
+
+def _multipart(fields: Dict[str, str]):
+
+    aiohttp = _import_aiohttp()
+
+    writer = aiohttp.MultipartWriter('form-data')
+
+    for name, value in fields.items():
+        part = writer.append(value)
+        part.set_content_disposition('form-data', name=name)
+
+    return writer
+
+
+
+
+def _is_transient(error: Exception) -> bool:
+
+    # As query._is_transient, with connection errors and timeouts of aiohttp
+    aiohttp = _import_aiohttp()
+
+    return query._is_transient(error) or isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, 
+                                                            asyncio.TimeoutError))
+
+
+
+
+async def _throttle() :
+
+    # Wait for a token of the client-side rate limiters without blocking the loop
+    delay = session.reserve()
+
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+
+
+class _AsyncUploadMemo:
+
+    """ Upload each distinct gene list once and share the result between tasks """
+
+    def __init__(self, upload):
+
+        self._upload = upload
+        self._tasks = {}
+
+    def __len__(self) :
+
+        return len(self._tasks)
+
+    async def get(self, client, genes: List[str]) :
+
+        key = hash_genes(genes)
+        task = self._tasks.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(self._upload(client, genes))
+            self._tasks[key] = task
+
+        try:
+            return await asyncio.shield(task)
+
+        except Exception:
+            # Failed uploads are not memoized, so they can be retried
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            raise
+
+
+
+
+async def upload_genes_async(client, genes: List[str]) :
+
+    """ Upload gene sets to EnrichR website
+
+         Args
+            client (aiohttp.ClientSession) : Session to send request with
+
+            genes (List) : A list of genes to query to enrichR
+
+    """
+
+    payload = _multipart({'list': '\n'.join(genes), 'description': 'Example gene list'})
+
+    await _throttle()
+
+    with metrics.timer('query.upload', api='enrichr'):
+        async with client.post(query.ENRICHR_BASE_URL + '/addList', data=payload) as response:
+
+            metrics.count('http.requests', endpoint='addList', status=response.status)
+
+            if response.status >= 400:
+                raise query.EnrichrError('Error analyzing gene list', response.status)
+
+            return json.loads(await response.text())
+
+
+
+
+# Blocking parts of a query (SQLite cache, JSON parsing, dataframe), run in the default executor
+
+def _read_cache(genes: List, database: str, annot_colname: str, annot: Any) -> Tuple[str, Optional[pd.DataFrame]]:
+
+    key = get_cache().make_key(genes, database, source=query._source(query.ENRICHR_BASE_URL, query.ENRICHR_DEFAULT_URL))
+    cached = get_cache().get(key)
+
+    return key, (query.to_dataframe({database: cached}, database, annot_colname, annot) if cached is not None else None)
+
+
+def _parse_response(text: str, database: str, annot_colname: str, annot: Any, key: Optional[str]) -> pd.DataFrame:
+
+    res = json.loads(text)
+    df = query.to_dataframe(res, database, annot_colname, annot)
+
+    if key is not None:
+        get_cache().set(key, res[database], database)
+
+    return df
+
+
+
+
+async def get_enrichment_data_async(client,
+                                    genes: List,
+                                    database: str,
+                                    annot_colname: str,
+                                    annot: Any,
+                                    cache: bool = True,
+                                    uploads: _AsyncUploadMemo = None) :
+
+    """ Get response from EnrichR website using querying gene set
+
+         Args
+            client (aiohttp.ClientSession): Session to send requests with.
+
+            genes (List): A list of genes to query for enrichR.
+
+            database (str): Name of database to query for enrichR.
+
+            annot_colname (str): A column name for each gene sets.
+
+            annot (Any): value for column 'annot_colname'.
+
+            cache (bool, optional): Reuse results stored in the on-disk cache. Defaults to True.
+
+            uploads (_AsyncUploadMemo, optional): Uploaded gene lists shared within a batch. Defaults to None.
+
+    """
+
+    loop = asyncio.get_running_loop()
+    key = None
+
+    if cache:
+        key, df = await loop.run_in_executor(None, _read_cache, genes, database, annot_colname, annot)
+
+        if df is not None:
+            return df
+
+    data = await uploads.get(client, genes) if uploads is not None else await upload_genes_async(client, genes)
+
+    params = {'userListId': data['userListId'], 'backgroundType': database}
+
+    await _throttle()
+
+    with metrics.timer('query.enrich', api='enrichr'):
+        async with client.get(query.ENRICHR_BASE_URL + '/enrich', params=params) as response:
+
+            metrics.count('http.requests', endpoint='enrich', status=response.status)
+
+            if response.status >= 400:
+                raise query.EnrichrError(f'Error fetching enrichment results for {database} (status code: {response.status})', 
+                                         response.status)
+
+            text = await response.text()
+
+        metrics.observe('http.response_bytes', len(text), endpoint='enrich')
+
+    return await loop.run_in_executor(None, _parse_response, text, database, annot_colname, annot, key)
+
+
+
+
+async def get_enrichment_dataframes_async(geneset_list: List[geneset],
+                                          dblist: List,
+                                          annot_colname: str,
+                                          annot: Any = None,
+                                          n_jobs: int = None,
+                                          handle_error: bool = False,
+                                          max_iter: int = 10,
+                                          backend: str = 'enrichr',
+                                          library_dir: str = None,
+                                          cache: bool = True,
+                                          backoff: float = 1.0,
+                                          rate_limit: float = None,
+                                          store: ResultStore = None):
+    """
+    Retrieves enrichment dataframes for a list of genesets from multiple databases on the running event loop.
+
+    Awaitable from Jupyter or any running loop: 'aalist = await get_enrichment_dataframes_async(...)'
+
+    Args:
+        geneset_list (List[geneset]): A list of genesets for enrichment analysis.
+
+        dblist (List): A list of databases to perform enrichment analysis on.
+
+        annot_colname (str): The column name in the database for annotation.
+
+        annot (Any, optional): Additional annotation information. Defaults to None.
+
+        n_jobs (int, optional): The maximum number of requests in flight.
+                                Defaults to the pool size of qed.data.session.
+
+        handle_error (bool, optional): Whether to re-request queries that failed with a transient error
+                                       (status 429 or 5xx, connection error or timeout). Defaults to False.
+
+        max_iter (int, optional): The maximum number of re-requests for each query. Defaults to 10.
+
+        backend (str, optional): 'enrichr' or 'local'. 'local' runs in the default executor. Defaults to 'enrichr'.
+
+        library_dir (str, optional): Directory of GMT files for 'local' backend. Defaults to None.
+
+        cache (bool, optional): Reuse results stored in the on-disk cache (~/.cache/qed by default, see qed.data.cache) 
+                                and store new ones. False skips the cache for this call; set_cache(enabled=False) 
+                                disables it for all calls. Hit/miss counts are logged at INFO level. Defaults to True.
+
+        backoff (float, optional): Base delay in seconds of jittered exponential backoff between re-requests. 
+                                   Defaults to 1.0.
+
+        rate_limit (float, optional): Maximum requests per second sent to EnrichR during this call. 
+                                      Defaults to None (see qed.data.configure_session).
+
+        store (ResultStore, optional): Also append each result dataframe to this store. 
+                                       'merge_df(store)' then skips the per-call concat. Defaults to None.
+
+    Returns:
+        List[geneset]: New geneset objects with enrichment dataframes in the order of 'dblist'. 
+                       The input genesets are not modified and share their existing dataframes.
+    """
+
+    if backend not in ['enrichr', 'local']:
+        raise ValueError("Invalid 'backend' parameter. Supported values: 'enrichr', 'local'")
+
+    aiohttp = _import_aiohttp()
+
+    config = session.session_config()
+    n_jobs = n_jobs if n_jobs is not None else config['pool_maxsize']
+
+    # Every request goes to the EnrichR host, so a per-host dict reduces to its entry
+    max_per_host = config['max_per_host']
+    if isinstance(max_per_host, dict):
+        max_per_host = max_per_host.get(urlsplit(query.ENRICHR_BASE_URL).hostname)
+    max_per_host = max_per_host if max_per_host is not None else 0
+
+    connect_timeout, read_timeout = config['timeout'] if isinstance(config['timeout'], tuple) else (config['timeout'], config['timeout'])
+
+    cache_stats = get_cache().stats()
+    semaphore = asyncio.Semaphore(n_jobs)
+    uploads = _AsyncUploadMemo(upload_genes_async)
+    loop = asyncio.get_running_loop()
+    batch = store.new_batch() if store is not None else None
+
+    pbar = tqdm(total=len(geneset_list) * len(dblist), desc='Processing genesets')
+
+    async def run(client, i: int, gs: geneset, j: int, database: str) :
+
+        _annot = annot if annot is not None else gs.name
+        n_retry = max_iter if handle_error else 0
+
+        submitted = time.perf_counter()
+
+        for attempt in range(n_retry + 1):
+            try:
+                async with semaphore:
+                    if attempt == 0:
+                        metrics.observe('query.queue_wait', time.perf_counter() - submitted)
+
+                    if backend == 'local':
+                        df = await loop.run_in_executor(None, query.get_enrichment_data, gs.genes, database,
+                                                        annot_colname, _annot, 'local', library_dir)
+                    else:
+                        df = await get_enrichment_data_async(client, gs.genes, database,
+                                                             annot_colname, _annot, cache, uploads)
+                pbar.update(1)
+
+                # Consolidated by the store in input order
+                if store is not None:
+                    store.append(df, gs.name, database, order=(batch, i, j))
+
+                return df
+
+            except Exception as e:
+                if attempt == n_retry or not _is_transient(e):
+                    query._log_failure(gs.name, database, e)
+                    break
+
+                metrics.count('query.retries')
+                await asyncio.sleep(query._backoff_delay(attempt, backoff))
+
+        pbar.update(1)
+
+        return None
+
+    connector = aiohttp.TCPConnector(limit=n_jobs, limit_per_host=max_per_host)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+    with session.rate_limited(rate_limit):
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as client:
+            results = await asyncio.gather(*[run(client, i, gs, j, database) 
+                                             for i, gs in enumerate(geneset_list) for j, database in enumerate(dblist)])
+
+    pbar.close()
+
+    n_db = len(dblist)
+
+    if cache:
+        query._report_cache(cache_stats)
+
+    # New genesets share genes and existing dataframes with the input genesets
+    return [query._attach_results(gs, [df for df in results[i * n_db:(i + 1) * n_db] if df is not None], 
+                                  dblist, annot_colname, annot) 
+            for i, gs in enumerate(geneset_list)]
@@ -1,7 +1,11 @@
 from .structure import geneset
-from typing import List, Optional, TYPE_CHECKING
+from .local import _open_text
+from .. import metrics
+from typing import List, Optional, Iterator, Iterable, Callable, Union, TYPE_CHECKING
 import pandas as pd
-import time
+import numpy as np
+import itertools
+import warnings
 
 if TYPE_CHECKING:
     from anndata import AnnData
@@ -9,48 +13,200 @@ if TYPE_CHECKING:
 
 
 
-# Wrapper for calculate time
+# Wrapper for calculate time: recorded as timer 'read.{function name}' (see qed.metrics)
 def calc_time(func):
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"Execution time for {func.__name__}: {end_time - start_time} seconds")
-        return result
-    return wrapper
+    return metrics.timed(f'read.{func.__name__}')(func)
+
+
+
+
+def _name_filter(names: Union[Iterable[str], Callable[[str], bool], None]) -> Callable[[str], bool]:
+
+    if names is None:
+        return lambda name: True
+
+    if callable(names):
+        return names
+
+    names = set(names)
+
+    return lambda name: name in names
+
+
+
+
+def _parse_lines(lines: Iterable[str],
+                 sep: str,
+                 format: str,
+                 keep_name: Callable[[str], bool],
+                 min_size: Optional[int],
+                 max_size: Optional[int]) -> Iterator[geneset]:
+
+    for line in lines:
+
+        # Name is split off first, so that filtered out sets are not split further
+        name, _, rest = line.rstrip().partition(sep)
+
+        if not keep_name(name) or (format == 'gmt' and not name):
+            continue
+
+        annotation = None
+
+        if format == 'gmt':
+            annotation, _, rest = rest.partition(sep)
+
+        genes = list(filter(None, rest.split(sep)))
+
+        # EnrichR libraries may store weighted genes as 'GENE,1.0'
+        if format == 'gmt' and ',' in rest:
+            genes = [gene.split(',')[0] for gene in genes]
+
+        if (min_size is not None and len(genes) < min_size) or (max_size is not None and len(genes) > max_size):
+            continue
+
+        yield geneset(name, genes, annotation=annotation)
+
+
+
+
+def iter_genesets(file_path: str,
+                  sep: str = '\t',
+                  format: Optional[str] = 'rowside',
+                  names: Union[Iterable[str], Callable[[str], bool], None] = None,
+                  min_size: Optional[int] = None,
+                  max_size: Optional[int] = None,
+                  chunksize: Optional[int] = None) -> Iterator :
+
+    """ Read gene sets lazily, one line at a time
+
+        Args
+            file_path (str): Path to file. gzip compressed files are detected and read transparently.
+
+            sep (str, optional): Delimiter. Defaults to tab. 'gmt' format is always tab-delimited.
+
+            format (str, optional): 'rowside' (name, genes...), 'gmt' (name, description, genes...)
+                                    or 'colside' (one gene set per column). Defaults to 'rowside'.
+
+            names (Iterable or Callable, optional): Names of gene sets to read, or a function
+                                                    of name returning True for sets to read. Defaults to None (all).
+
+            min_size, max_size (int, optional): Range of number of genes of sets to read. Defaults to None.
+
+            chunksize (int, optional): Yield lists of up to 'chunksize' gene sets instead of single gene sets.
+
+        'colside' files are read at once (each gene set spans all lines), but only columns
+        passing 'names' are parsed.
+    """
+
+    # Not a generator itself, so invalid arguments are raised at the call rather than on the first next()
+    if format not in ['rowside', 'gmt', 'colside']:
+        raise ValueError("Invalid 'format' parameter. Supported values: 'rowside', 'gmt', 'colside'")
+
+    if chunksize is not None and chunksize < 1:
+        raise ValueError("'chunksize' should be positive")
+
+    keep_name = _name_filter(names)
+
+    if format == 'colside':
+        genesets = _read_colside(file_path, sep, keep_name, min_size, max_size)
+    else:
+        genesets = _iter_lines(file_path, '\t' if format == 'gmt' else sep, format, keep_name, min_size, max_size)
+
+    return genesets if chunksize is None else _iter_chunks(genesets, chunksize)
+
+
+
+
+def _iter_chunks(genesets: Iterator[geneset], chunksize: int) -> Iterator[List[geneset]]:
+
+    while True:
+        chunk = list(itertools.islice(genesets, chunksize))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+
+
+def _iter_lines(file_path: str, sep: str, format: str, keep_name, min_size, max_size) -> Iterator[geneset]:
+
+    with _open_text(file_path) as f:
+        yield from _parse_lines(f, sep, format, keep_name, min_size, max_size)
+
+
+
+
+def _read_colside(file_path: str, sep: str, keep_name, min_size, max_size) -> Iterator[geneset]:
+
+    with _open_text(file_path) as f:
+        df = pd.read_csv(f, sep=sep, usecols=lambda col: keep_name(col))
+
+    for col in df.columns:
+        genes = df[col].dropna().tolist()
+
+        if (min_size is not None and len(genes) < min_size) or (max_size is not None and len(genes) > max_size):
+            continue
+
+        yield geneset(col, genes)
 
 
 
 
 @calc_time
 def readtxt(file_path: str, sep: str, format: Optional[str] = 'rowside') -> List[geneset] :
-    
-    setlist = []
 
-    if format == 'rowside' :
-        with open(file_path, 'r') as f :
-            lines = [line.rstrip() for line in f]
+    """ Read gene sets from 'rowside', 'colside' or 'gmt' text file. See iter_genesets for a lazy reader with filters. """
 
-        for line in lines :
-            name = line.split(sep)[0]
-            genes = list(filter(None, line.split(sep)[1:]))
-            Gene_Set = geneset(name, genes)
-            setlist.append(Gene_Set)
-    
-    elif format == 'colside' :
-        df = pd.read_csv(file_path, sep=sep)
-        colnames = df.columns
+    if format not in ['rowside', 'colside', 'gmt'] :
+        raise ValueError("Invalid 'format' parameter. Supported values: 'rowside', 'colside', 'gmt'")
 
-        for col in colnames :
-             name = col
-             genes = df[col].dropna().tolist()
-             Gene_Set = geneset(name, genes)
-             setlist.append(Gene_Set)
+    return list(iter_genesets(file_path, sep, format))
+
+
+
+
+@calc_time
+def read_gmt(file_path: str,
+             names: Union[Iterable[str], Callable[[str], bool], None] = None,
+             min_size: Optional[int] = None,
+             max_size: Optional[int] = None) -> List[geneset] :
+
+    """ Read GMT file (MSigDB, EnrichR libraries) into geneset objects. Description is kept as 'annotation'. """
+
+    return list(iter_genesets(file_path, '\t', 'gmt', names, min_size, max_size))
+
+
+# Columns of Seurat FindAllMarkers output used by readseurat
+SEURAT_COLUMNS = ['p_val_adj', 'avg_log2FC', 'pct.1', 'cluster', 'gene']
+
+
+
+
+def _read_markers(file_path: str,
+                  sep: str,
+                  keep: Callable[[pd.DataFrame], pd.Series],
+                  chunksize: int,
+                  args: tuple,
+                  kwargs: dict):
+
+    # Rows passing 'keep' of each chunk, and dtype kinds parsed for 'cluster'/'gene' in each chunk
+    kept = []
+    kinds = {'cluster': set(), 'gene': set()}
+
+    for chunk in pd.read_csv(file_path, sep=sep, *args, chunksize=chunksize, **kwargs):
+
+        for col in kinds:
+            kinds[col].add(chunk[col].dtype.kind)
+
+        kept.append(chunk.loc[keep(chunk), ['cluster', 'gene']])
+
+    df = pd.concat(kept) if kept else pd.DataFrame(columns=['cluster', 'gene'])
+
+    return df, kinds
 
-    else :
-        raise ValueError("Invalid 'format' parameter. Supported values: 'rowside', 'colside'")
 
-    return setlist
 
 
 @calc_time
@@ -58,13 +214,47 @@ def readseurat(file_path: str, sep: str,
                adj_pval_cutoff: float = 0.05,
                lfc_cutoff: float = 0.5,
                pct_cutoff: float = 0.05, 
-               *args, **kwargs) -> List[geneset] :
-    
+               *args,
+               chunksize: int = 1000000,
+               **kwargs) -> List[geneset] :
+
+    """ Read gene sets from Seurat FindAllMarkers output
+
+        Only the columns in SEURAT_COLUMNS are parsed, and cutoffs are applied to chunks of 'chunksize' rows,
+        so memory is bounded by the markers passing cutoffs. Other arguments are passed to pd.read_csv.
+
+        The index is not used, so 'index_col' is ignored (with a warning) unless 'usecols' is also given.
+    """
+
+    if 'usecols' not in kwargs:
+        kwargs['usecols'] = lambda col: col in SEURAT_COLUMNS
+
+        # With 'usecols', 'index_col' would point into the selected columns
+        if kwargs.get('index_col') is not None and kwargs['index_col'] is not False:
+            warnings.warn(f"readseurat ignores 'index_col={kwargs['index_col']!r}': only {SEURAT_COLUMNS} are read", 
+                          stacklevel=3)
+
+        if kwargs.get('index_col') is not False:
+            kwargs.pop('index_col', None)
+
+    def keep(df: pd.DataFrame) -> pd.Series:
+        return (df['p_val_adj'] <= adj_pval_cutoff) & (df['avg_log2FC'] >= lfc_cutoff) & (df['pct.1'] >= pct_cutoff)
+
+    df, kinds = _read_markers(file_path, sep, keep, chunksize, args, kwargs)
+
+    # Chunks can be parsed to different dtypes. Match parsing the whole file at once:
+    # int and float chunks give float, any non-numeric chunk gives the values as text.
+    mixed = [col for col, kind in kinds.items() if len(kind) > 1 and not kind <= {'i', 'u', 'f'}]
+
+    if mixed:
+        df, _ = _read_markers(file_path, sep, keep, chunksize, args, dict(kwargs, dtype={col: str for col in mixed}))
+
+    for col, kind in kinds.items():
+        if len(kind) > 1 and kind <= {'i', 'u', 'f'}:
+            df[col] = df[col].astype(float)
+
     setlist = []
-    
-    df = pd.read_csv(file_path, sep=sep, *args, **kwargs)
-    df = df[(df['p_val_adj'] <= adj_pval_cutoff) & (df['avg_log2FC'] >= lfc_cutoff) & (df['pct.1'] >= pct_cutoff)]
-    
+
     tmp_group = df.groupby('cluster')['gene']
     
     for name, group in tmp_group:
@@ -88,53 +278,45 @@ def readscanpy(adata: 'AnnData',
     if 'rank_genes_groups' not in adata.uns:
         raise ValueError("Run scanpy.tl.rank_genes_groups first.")
     
-    setlist = []
-
     result = adata.uns['rank_genes_groups']
     groups = result['names'].dtype.names
+    n_genes = len(result['names'])
+
+    # Record arrays (one field per group) as flat columns, group after group
+    def column(key: str) -> np.ndarray:
+        return np.concatenate([np.asarray(result[key][group]) for group in groups]) if groups else np.array([])
+
+    names = column('names')
+    cluster = np.repeat(np.arange(len(groups)), n_genes)
+
+    keep = (column('logfoldchanges') > lfc_cutoff) & (column('pvals_adj') < adj_pval_cutoff)
 
-    new_df = pd.DataFrame()
-
-    for group in groups:
-        
-        temp_df = pd.DataFrame()
-        temp_df['cluster_names'] = pd.Series([group]*len(result['names'][group]))
-        temp_df['names'] = result['names'][group]
-        temp_df['scores'] = result['scores'][group]
-        temp_df['pvals'] = result['pvals'][group]
-        temp_df['pvals_adj'] = result['pvals_adj'][group]
-        temp_df['logfoldchanges'] = result['logfoldchanges'][group]
-        
-        new_df = pd.concat([new_df, temp_df])
-
-    new_df.reset_index(drop=True, inplace=True)
-
-    new_df = new_df[(new_df['logfoldchanges'] > lfc_cutoff) &
-                    (new_df['pvals_adj'] < adj_pval_cutoff)
-                   ]
-    
     if select_top_n is not None :
-        
-        top_df = new_df.groupby('cluster_names').apply(lambda x: x.nlargest(select_top_n, select_order)).reset_index(drop=True)
-        tmp_group = top_df.groupby('cluster_names')['names']
 
-        for name, group in tmp_group:
-            
-            genes = group.tolist()
-            gs = geneset(name=name, genes=genes)
-            setlist.append(gs)
+        values = column(select_order)
+        missing = np.isnan(values)
+
+        rows = np.flatnonzero(keep)
+
+        # Descending 'select_order' within each group, ties in rank order, then NaN in rank order (as nlargest)
+        rows = rows[np.lexsort((rows, -np.where(missing, 0, values)[rows], missing[rows], cluster[rows]))]
+
+        starts = np.searchsorted(cluster[rows], cluster[rows], side='left')
+        rows = rows[np.arange(len(rows)) - starts < select_top_n]
 
-    
     else :
-        
-        tmp_group = new_df.groupby('cluster_names')['names']
-
-        for name, group in tmp_group:
-            
-            genes = group.tolist()
-            gs = geneset(name=name, genes=genes)
-            setlist.append(gs)
-     
-    return setlist
 
+        rows = np.flatnonzero(keep)
+
+    # Groups in sorted order, as groupby
+    bounds = np.searchsorted(cluster[rows], np.arange(len(groups) + 1))
+    setlist = []
+
+    for i in sorted(range(len(groups)), key=lambda i: groups[i]):
 
+        genes = names[rows[bounds[i]:bounds[i + 1]]].tolist()
+
+        if genes:
+            setlist.append(geneset(name=groups[i], genes=genes))
+
+    return setlist
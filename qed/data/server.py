@@ -0,0 +1,502 @@
+from typing import Dict, List, Optional, Tuple, Union
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from collections import Counter
+from threading import Lock, Thread
+from email.parser import BytesParser
+from email import policy
+from .local import GeneSetLibrary, load_library, check_library_name, restrict_library, enrich, default_library_dir, _open_text
+import argparse
+import logging
+import random
+import uuid
+import json
+import time
+import os
+
+
+
+
+# Local EnrichR-compatible server answering from GMT libraries, for offline and load testing
+#
+# Example
+#     from qed.data import set_base_url
+#     from qed.data.server import EnrichrServer
+#
+#     with EnrichrServer('./libraries', latency=0.05, error_rate=0.01, rate_limit=50) as server:
+#         set_base_url(server.enrichr_url, server.speedrichr_url)
+#         aalist = get_enrichment_dataframes(alist, dblist, 'Celltype')
+#         print(server.stats())
+#     set_base_url()
+#
+# or from a shell: python -m qed.data.server --library-dir ./libraries --port 8000 --latency 0.05
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_EXTENSIONS = ['.gmt', '.gmt.gz', '.txt', '.txt.gz']
+
+
+
+
+class _Throttle:
+
+    """ Token bucket rejecting requests above 'rate' per second (bursts up to 'burst') """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+
+            return True
+
+
+
+
+class _HTTPError(Exception):
+
+    def __init__(self, status: int, message: str):
+
+        super().__init__(message)
+        self.status = status
+
+
+
+
+def _parse_form(content_type: str, body: bytes) -> Dict[str, str]:
+
+    # multipart/form-data (requests 'files=', aiohttp MultipartWriter) or urlencoded (requests 'data=')
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=policy.HTTP).parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+
+        return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode()
+                for part in message.iter_parts()}
+
+    return {key: values[0] for key, values in parse_qs(body.decode(), keep_blank_values=True).items()}
+
+
+
+
+def _genes(text: str) -> List[str]:
+
+    return [gene.strip() for gene in text.splitlines() if gene.strip()]
+
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    # Keep-alive, as EnrichR
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = {
+        ('POST', '/Enrichr/addList'): 'add_list',
+        ('GET', '/Enrichr/enrich'): 'enrich',
+        ('GET', '/Enrichr/genemap'): 'genemap',
+        ('GET', '/Enrichr/geneSetLibrary'): 'gene_set_library',
+        ('POST', '/speedrichr/api/addList'): 'add_list',
+        ('POST', '/speedrichr/api/addbackground'): 'add_background',
+        ('POST', '/speedrichr/api/backgroundenrich'): 'background_enrich',
+    }
+
+    def log_message(self, format: str, *args) :
+
+        logger.debug(format, *args)
+
+    def do_GET(self) :
+
+        self._dispatch('GET')
+
+    def do_POST(self) :
+
+        self._dispatch('POST')
+
+    def _send(self, status: int, body: Union[bytes, str, dict], content_type: str = 'application/json', headers: Dict = None) :
+
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method: str) :
+
+        server: EnrichrServer = self.server.enrichr
+
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        # Body is always read, so the connection can be reused after an error response
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        route = self.ROUTES.get((method, url.path.rstrip('/')))
+        endpoint = route if route is not None else url.path
+
+        status, response, content_type, headers = server._handle(route, params, self.headers.get('Content-Type', ''), body)
+        server._count(endpoint, status)
+
+        self._send(status, response, content_type, headers)
+
+
+
+
+class EnrichrServer:
+
+    """ Threaded HTTP server implementing EnrichR and speedrichr APIs from local GMT libraries
+
+        Endpoints: EnrichR 'addList', 'enrich', 'genemap', 'geneSetLibrary' under '/Enrichr',
+        and speedrichr 'addList', 'addbackground', 'backgroundenrich' under '/speedrichr/api'.
+        Statistics are computed as in the 'local' backend (qed.data.local.enrich).
+
+        Args
+            library_dir (str, optional): Directory of GMT files named '{database}.gmt' (or .gmt.gz, .txt).
+                                         Defaults to ~/.cache/qed/libraries
+
+            host (str, optional): Address to bind. Defaults to '127.0.0.1'.
+
+            port (int, optional): Port to bind. Defaults to 0 (a free port, see 'url').
+
+            latency (float or Tuple, optional): Seconds added to each response, or (min, max) of a uniform delay.
+                                                Defaults to 0.
+
+            error_rate (float, optional): Fraction of requests answered with status 500. Defaults to 0.
+
+            rate_limit (float, optional): Requests per second accepted. Requests above it are answered
+                                          with status 429 and a 'Retry-After' header. Defaults to None (no limit).
+
+            burst (float, optional): Size of token bucket of 'rate_limit'. Defaults to max(1, rate_limit).
+
+            seed (int, optional): Seed of injected latency and errors. Defaults to None.
+    """
+
+    def __init__(self,
+                 library_dir: Optional[str] = None,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency: Union[float, Tuple[float, float]] = 0.0,
+                 error_rate: float = 0.0,
+                 rate_limit: Optional[float] = None,
+                 burst: Optional[float] = None,
+                 seed: Optional[int] = None):
+
+        self.library_dir = library_dir if library_dir is not None else default_library_dir()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+
+        self._throttle = _Throttle(rate_limit, burst) if rate_limit is not None else None
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+        self._lists: Dict[int, List[str]] = {}
+        self._backgrounds: Dict[str, List[str]] = {}
+        self._restricted: Dict[Tuple[str, str], GeneSetLibrary] = {}
+        self._stats = Counter()
+
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.enrichr = self
+        self._thread: Optional[Thread] = None
+
+    def __repr__(self) :
+
+        return f"EnrichrServer object [url: {self.url}, library_dir: {self.library_dir}]"
+
+    def __enter__(self) :
+
+        return self.start()
+
+    def __exit__(self, *args) :
+
+        self.stop()
+
+    @property
+    def url(self) -> str:
+
+        host, port = self._httpd.server_address[:2]
+
+        return f'http://{host}:{port}'
+
+    @property
+    def enrichr_url(self) -> str:
+
+        return self.url + '/Enrichr'
+
+    @property
+    def speedrichr_url(self) -> str:
+
+        return self.url + '/speedrichr'
+
+    def start(self) :
+
+        """ Serve in a background thread """
+
+        if self._thread is None:
+            self._thread = Thread(target=self._httpd.serve_forever, name='EnrichrServer', daemon=True)
+            self._thread.start()
+
+        return self
+
+    def stop(self) :
+
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+
+        self._httpd.server_close()
+
+    def serve_forever(self) :
+
+        self._httpd.serve_forever()
+
+    def stats(self) -> Dict[str, int]:
+
+        """ Number of responses by endpoint and status, e.g. {'enrich 200': 120, 'enrich 429': 3} """
+
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, endpoint: str, status: int) :
+
+        with self._lock:
+            self._stats[f'{endpoint} {status}'] += 1
+
+    def _delay(self) -> float:
+
+        if isinstance(self.latency, (tuple, list)):
+            with self._lock:
+                return self._random.uniform(*self.latency)
+
+        return self.latency
+
+    def _fail(self) -> bool:
+
+        if not self.error_rate:
+            return False
+
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _handle(self, route: Optional[str], params: Dict, content_type: str, body: bytes) :
+
+        if route is None:
+            return 404, {'error': 'Not found'}, 'application/json', None
+
+        if self._throttle is not None and not self._throttle.allow():
+            return 429, {'error': 'Too many requests'}, 'application/json', {'Retry-After': '1'}
+
+        delay = self._delay()
+        if delay > 0:
+            time.sleep(delay)
+
+        if self._fail():
+            return 500, {'error': 'Injected error'}, 'application/json', None
+
+        try:
+            if route == 'gene_set_library':
+                return 200, self._gene_set_library(params), 'text/plain', None
+
+            form = _parse_form(content_type, body) if body else {}
+
+            return 200, getattr(self, '_' + route)(params, form), 'application/json', None
+
+        except _HTTPError as e:
+            return e.status, {'error': str(e)}, 'application/json', None
+
+        except Exception as e:
+            logger.exception('Error handling %s', route)
+            return 500, {'error': str(e)}, 'application/json', None
+
+    # Endpoints
+
+    def _library(self, database: Optional[str]) -> GeneSetLibrary:
+
+        if not database:
+            raise _HTTPError(400, "Missing 'backgroundType'")
+
+        try:
+            return load_library(database, self.library_dir, download=False)
+        except ValueError as e:
+            raise _HTTPError(400, str(e)) from e
+        except FileNotFoundError as e:
+            raise _HTTPError(404, str(e)) from e
+
+    def _library_names(self) -> List[str]:
+
+        names = []
+
+        for file_name in sorted(os.listdir(self.library_dir)) if os.path.isdir(self.library_dir) else []:
+            for ext in LIBRARY_EXTENSIONS:
+                if file_name.endswith(ext):
+                    names.append(file_name[:-len(ext)])
+                    break
+
+        return names
+
+    def _user_list(self, user_list_id) -> List[str]:
+
+        with self._lock:
+            genes = self._lists.get(int(user_list_id)) if str(user_list_id).isdigit() else None
+
+        if genes is None:
+            raise _HTTPError(404, f'Unknown userListId {user_list_id}')
+
+        return genes
+
+    def _add_list(self, params: Dict, form: Dict) -> Dict:
+
+        if 'list' not in form:
+            raise _HTTPError(400, "Missing 'list'")
+
+        with self._lock:
+            user_list_id = len(self._lists) + 1
+            self._lists[user_list_id] = _genes(form['list'])
+
+        return {'userListId': user_list_id, 'shortId': format(user_list_id, 'x')}
+
+    def _enrich(self, params: Dict, form: Dict) -> Dict:
+
+        genes = self._user_list(params.get('userListId'))
+
+        return enrich(genes, self._library(params.get('backgroundType')))
+
+    def _genemap(self, params: Dict, form: Dict) -> Dict:
+
+        gene = params.get('gene', '').upper()
+        found = {}
+
+        for name in self._library_names():
+            library = self._library(name)
+
+            if gene in library.gene_index:
+                rows = library.membership[:, library.gene_index[gene]].nonzero()[0]
+                found[name] = library.terms[rows].tolist()
+
+        return {'gene': found, 'descriptions': []}
+
+    def _gene_set_library(self, params: Dict) -> str:
+
+        name = params.get('libraryName', '')
+
+        try:
+            check_library_name(name)
+        except ValueError as e:
+            raise _HTTPError(400, str(e)) from e
+
+        for ext in LIBRARY_EXTENSIONS:
+            file_path = os.path.join(self.library_dir, name + ext)
+
+            if os.path.exists(file_path):
+                with _open_text(file_path) as f:
+                    return f.read()
+
+        raise _HTTPError(404, f'Gene set library {name} not found')
+
+    def _add_background(self, params: Dict, form: Dict) -> Dict:
+
+        if 'background' not in form:
+            raise _HTTPError(400, "Missing 'background'")
+
+        background_id = uuid.uuid4().hex
+
+        with self._lock:
+            self._backgrounds[background_id] = _genes(form['background'])
+
+        return {'backgroundid': background_id}
+
+    def _background_enrich(self, params: Dict, form: Dict) -> Dict:
+
+        genes = self._user_list(form.get('userListId'))
+        database = form.get('backgroundType')
+
+        with self._lock:
+            background = self._backgrounds.get(form.get('backgroundid'))
+
+        if background is None:
+            raise _HTTPError(404, f"Unknown backgroundid {form.get('backgroundid')}")
+
+        key = (database, form['backgroundid'])
+
+        with self._lock:
+            library = self._restricted.get(key)
+
+        if library is None:
+            library = restrict_library(self._library(database), background)
+
+            with self._lock:
+                self._restricted[key] = library
+
+        # Query genes outside the background are ignored, as speedrichr
+        universe = {gene.upper() for gene in background}
+
+        return enrich([gene for gene in genes if gene.upper() in universe], library, background_size=len(universe))
+
+
+
+
+def main(argv: Optional[List[str]] = None) :
+
+    parser = argparse.ArgumentParser(description='Local EnrichR-compatible server answering from GMT libraries')
+    parser.add_argument('--library-dir', default=None, help='Directory of GMT files (Defaults to ~/.cache/qed/libraries)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.0], metavar='SECONDS',
+                        help='Delay of each response, or min and max of a uniform delay')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with status 500')
+    parser.add_argument('--rate-limit', type=float, default=None, help='Requests per second before answering 429')
+    parser.add_argument('--burst', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    server = EnrichrServer(args.library_dir,
+                           host=args.host,
+                           port=args.port,
+                           latency=args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2]),
+                           error_rate=args.error_rate,
+                           rate_limit=args.rate_limit,
+                           burst=args.burst,
+                           seed=args.seed)
+
+    logger.info('Serving %s from %s', server.url, server.library_dir)
+    logger.info("Use qed.data.set_base_url('%s', '%s')", server.enrichr_url, server.speedrichr_url)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+
+
+if __name__ == '__main__':
+    main()
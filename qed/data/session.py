@@ -0,0 +1,337 @@
+from typing import Dict, List, Optional, Tuple, Union
+from threading import Lock, BoundedSemaphore
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, Context, copy_context
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from .. import metrics
+import requests
+import time
+import os
+
+
+
+
+# Shared HTTP session for all EnrichR requests
+
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (10, 120)
+
+# Same default as concurrent.futures.ThreadPoolExecutor
+DEFAULT_POOL_SIZE = min(32, (os.cpu_count() or 1) + 4)
+
+
+_CONFIG = {
+    'pool_maxsize': DEFAULT_POOL_SIZE,
+    'timeout': DEFAULT_TIMEOUT,
+    'max_per_host': None,
+    'rate_limit': None,
+}
+
+_SESSION: Optional[requests.Session] = None
+_HOST_LIMITS: Dict[str, BoundedSemaphore] = {}
+_LOCK = Lock()
+
+
+
+
+class RateLimiter:
+
+    """ Token bucket allowing 'rate' requests per second with bursts of up to 'burst' requests """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+
+        if rate <= 0:
+            raise ValueError("'rate' should be positive")
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def __repr__(self) :
+
+        return f"RateLimiter object [rate: {self.rate}/s, burst: {self.burst}]"
+
+    def reserve(self) -> float:
+
+        """ Take one token and return the delay in seconds before it may be used """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) :
+
+        delay = self.reserve()
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Session-wide limiter (see configure_session)
+_LIMITER: Optional[RateLimiter] = None
+
+# Limiter of the running batch (see rate_limited). A context variable, so concurrent batches
+# in other threads or asyncio tasks keep their own.
+_CALL_LIMITER: ContextVar[Optional[RateLimiter]] = ContextVar('qed_rate_limiter', default=None)
+
+
+
+
+def configure_session(pool_maxsize: int = DEFAULT_POOL_SIZE,
+                      timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+                      max_per_host: Union[int, Dict[str, int], None] = None,
+                      rate_limit: Optional[float] = None,
+                      burst: Optional[float] = None) :
+
+    """ Configure the shared session used by qed.data.query
+
+        Args
+            pool_maxsize (int, optional): Number of keep-alive connections kept per host.
+                                          Grown automatically to 'n_jobs' of batch functions.
+
+            timeout (float or Tuple, optional): Default (connect, read) timeout in seconds. Defaults to (10, 120).
+
+            max_per_host (int or Dict, optional): Maximum number of in-flight requests per host.
+                                                  A dict maps host name to its limit. Defaults to None (no limit).
+
+            rate_limit (float, optional): Maximum requests per second (client-side token bucket). 
+                                          Defaults to None (no limit).
+
+            burst (float, optional): Size of token bucket. Defaults to max(1, rate_limit).
+    """
+
+    global _SESSION, _LIMITER
+
+    with _LOCK:
+        _CONFIG.update(pool_maxsize=pool_maxsize, timeout=timeout, max_per_host=max_per_host, rate_limit=rate_limit)
+        _HOST_LIMITS.clear()
+        _LIMITER = RateLimiter(rate_limit, burst) if rate_limit is not None else None
+
+        if _SESSION is not None:
+            _SESSION.close()
+            _SESSION = None
+
+
+
+
+def session_config() -> Dict:
+
+    """ Current pool size, timeout and per-host limits """
+
+    with _LOCK:
+        return dict(_CONFIG)
+
+
+
+
+def _mount(session: requests.Session, pool_maxsize: int) :
+
+    # Replaced adapters are closed, so their pooled connections are released now rather than at GC
+    previous = {session.adapters.get(prefix) for prefix in ['https://', 'http://']}
+
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    for old in previous:
+        if old is not None:
+            old.close()
+
+
+
+
+def get_session() -> requests.Session:
+
+    """ Return the shared keep-alive session, creating it on first use """
+
+    global _SESSION
+
+    with _LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            _mount(session, _CONFIG['pool_maxsize'])
+            _SESSION = session
+
+        return _SESSION
+
+
+
+
+def ensure_pool_size(n_jobs: Optional[int]) :
+
+    """ Grow connection pool so that 'n_jobs' threads do not open extra connections """
+
+    n_jobs = n_jobs if n_jobs is not None else DEFAULT_POOL_SIZE
+    session = get_session()
+
+    with _LOCK:
+        if n_jobs > _CONFIG['pool_maxsize']:
+            _CONFIG['pool_maxsize'] = n_jobs
+            _mount(session, n_jobs)
+
+
+
+
+def get_rate_limiters() -> List[RateLimiter]:
+
+    """ Limiters applying to requests sent from the current context: the batch one, then the session-wide one """
+
+    return [limiter for limiter in (_CALL_LIMITER.get(), _LIMITER) if limiter is not None]
+
+
+
+
+def reserve() -> float:
+
+    """ Take one token of each limiter and return the delay in seconds before sending a request """
+
+    return max([limiter.reserve() for limiter in get_rate_limiters()], default=0.0)
+
+
+
+
+@contextmanager
+def rate_limited(rate_limit: Optional[float], burst: Optional[float] = None) :
+
+    """ Limit requests sent from the block to 'rate_limit' per second. No-op for None
+
+        The session-wide limit of configure_session still applies. Worker threads do not inherit the
+        limiter; run them in a copy of 'limited_context' instead.
+    """
+
+    if rate_limit is None:
+        yield
+        return
+
+    token = _CALL_LIMITER.set(RateLimiter(rate_limit, burst))
+
+    try:
+        yield
+
+    finally:
+        _CALL_LIMITER.reset(token)
+
+
+
+
+def limited_context(rate_limit: Optional[float], burst: Optional[float] = None) -> Context:
+
+    """ Copy of the current context where requests are limited to 'rate_limit' per second (see rate_limited)
+
+        Tasks of one batch share the limiter by running in copies of the returned context:
+            context = limited_context(rate_limit)
+            executor.submit(context.copy().run, func, *args)
+    """
+
+    context = copy_context()
+
+    if rate_limit is not None:
+        context.run(_CALL_LIMITER.set, RateLimiter(rate_limit, burst))
+
+    return context
+
+
+
+
+def _host_limit(url: str) :
+
+    limit = _CONFIG['max_per_host']
+
+    if limit is None:
+        return nullcontext()
+
+    host = urlsplit(url).hostname
+
+    if isinstance(limit, dict):
+        if host not in limit:
+            return nullcontext()
+        limit = limit[host]
+
+    with _LOCK:
+        if host not in _HOST_LIMITS:
+            _HOST_LIMITS[host] = BoundedSemaphore(limit)
+
+        return _HOST_LIMITS[host]
+
+
+
+
+def _body_size(body) -> int:
+
+    if body is None:
+        return 0
+
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+
+
+def _record_response(endpoint: str, response: requests.Response, elapsed: float, stream: bool) :
+
+    tags = {'endpoint': endpoint, 'status': response.status_code}
+
+    metrics.count('http.requests', **tags)
+    metrics.observe('http.latency', elapsed, **tags)
+    metrics.observe('http.request_bytes', _body_size(response.request.body), endpoint=endpoint)
+
+    # Body of streamed responses is read later by the caller
+    size = response.headers.get('Content-Length') if stream else len(response.content)
+
+    if size is not None:
+        metrics.observe('http.response_bytes', int(size), endpoint=endpoint)
+
+
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+
+    kwargs.setdefault('timeout', _CONFIG['timeout'])
+
+    if not metrics.is_enabled():
+        delay = reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+        with _host_limit(url):
+            return get_session().request(method, url, **kwargs)
+
+    endpoint = urlsplit(url).path.rsplit('/', 1)[-1]
+    start = time.perf_counter()
+
+    delay = reserve()
+    if delay > 0:
+        time.sleep(delay)
+
+    with _host_limit(url):
+        # Time spent waiting for the rate limiter and per-host limit
+        metrics.observe('http.queue_wait', time.perf_counter() - start, endpoint=endpoint)
+
+        start = time.perf_counter()
+
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except Exception as e:
+            metrics.count('http.errors', endpoint=endpoint, error=type(e).__name__)
+            raise
+
+    _record_response(endpoint, response, time.perf_counter() - start, kwargs.get('stream', False))
+
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+
+    return request('POST', url, **kwargs)
@@ -0,0 +1,331 @@
+from typing import List, Dict, Tuple, Optional, Iterable
+from threading import Lock
+from pandas.api.types import union_categoricals
+from .overlap import GeneVocabulary, OverlappingGenes
+import pandas as pd
+import numpy as np
+
+
+
+
+OVERLAP_COLUMN = 'Overlapping genes'
+
+
+# Compact schema of enrichment result frames.
+# Repeated strings are categorical; p-values and scores stay float64.
+RESULT_DTYPES = {
+    'Rank': 'int32',
+    'Term': 'category',
+    'Term ID': 'category',
+    'P-value': 'float64',
+    'Odds ratio': 'float64',
+    'Combined score': 'float64',
+    'Adjusted p-value': 'float64',
+    'Old p-value': 'float64',
+    'Old adjusted p-value': 'float64',
+    'Database': 'category',
+}
+
+
+
+
+def compact_results(df: pd.DataFrame, annot_colname: Optional[str] = None) -> pd.DataFrame:
+
+    """ Convert enrichment result frame to compact dtypes (see RESULT_DTYPES).
+        'annot_colname' column is also made categorical.
+    """
+
+    dtypes = {col: dtype for col, dtype in RESULT_DTYPES.items() if col in df.columns}
+
+    if annot_colname is not None:
+        dtypes[annot_colname] = 'category'
+
+    return df.astype(dtypes)
+
+
+
+
+def concat_results(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+
+    """ Concatenate result frames keeping categorical columns categorical.
+
+        pd.concat falls back to object dtype when categories differ, so categorical
+        columns are combined separately with the union of their (sorted) categories.
+    """
+
+    columns = dfs[0].columns
+    categorical = [col for col in columns 
+                   if all(col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) for df in dfs)]
+
+    if not categorical or len(dfs) == 1:
+        return pd.concat(dfs, axis=0, ignore_index=True)
+
+    merged = pd.concat([df.drop(columns=categorical) for df in dfs], axis=0, ignore_index=True)
+
+    for col in categorical:
+        merged[col] = union_categoricals([df[col] for df in dfs], sort_categories=True)
+
+    return merged[list(columns) + [col for col in merged.columns if col not in columns]]
+
+
+
+
+def memory_footprint(df: pd.DataFrame, annot_colname: Optional[str] = None) -> pd.DataFrame:
+
+    """ Memory usage in bytes of each column with object/int64 dtypes ('before') and compact dtypes ('after') """
+
+    before = df.astype({col: object if isinstance(dtype, pd.CategoricalDtype) else 'int64' 
+                        for col, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype) or dtype == 'int32'})
+    after = compact_results(df, annot_colname)
+
+    report = pd.DataFrame({'before': before.memory_usage(index=False, deep=True),
+                           'after': after.memory_usage(index=False, deep=True)})
+    report.loc['Total'] = report.sum()
+
+    return report
+
+
+
+
+# Append-only store of enrichment results
+
+class ResultStore:
+
+    """ Append-only store of enrichment results of many (geneset, database) pairs
+
+        Query functions append each result dataframe as a chunk. The first read consolidates
+        chunks into one frame with a single concat, and later reads reuse that frame,
+        concatenating only chunks appended since. 'select' reads the rows of matching
+        genesets/databases without materializing the whole table.
+
+        Rows are indexed by their position among the rows of their geneset, as in merge_df of a geneset list.
+
+        'Overlapping genes' is kept as integer IDs of a shared gene vocabulary (see 'overlaps').
+        Its list view is decoded on the first read that asks for it, and only rows appended
+        since are decoded on later reads. The lists are shared between returned frames.
+
+        Example
+            store = ResultStore()
+            aalist = get_enrichment_dataframes(alist, dblist, 'Celltype', store=store)
+            df = merge_df(store)
+            df_kegg = store.select(databases=['KEGG_2021_Human'])
+            rows = store.overlaps.rows_with_gene('INS')
+    """
+
+    def __init__(self, vocabulary: Optional[GeneVocabulary] = None):
+
+        self._lock = Lock()
+        self._frame: Optional[pd.DataFrame] = None
+        self._columns: List[str] = []
+        self._overlaps: Optional[OverlappingGenes] = None
+        self._lists: Optional[np.ndarray] = None
+        self._ranges: Dict[Tuple, List[Tuple[int, int]]] = {}
+        self._pending: List[Tuple[Optional[Tuple], Tuple, pd.DataFrame]] = []
+        self._geneset_rows: Dict = {}
+        self._n_rows = 0
+        self._n_batches = 0
+
+        self.vocabulary = vocabulary if vocabulary is not None else GeneVocabulary()
+
+    def __repr__(self) :
+
+        return f"ResultStore object [number of genesets: {len(self.genesets)}, number of databases: {len(self.databases)}, number of rows: {len(self)}]"
+
+    def __len__(self) :
+
+        return self._n_rows
+
+    def append(self, df: pd.DataFrame, geneset: str, database: str, order: Optional[Tuple] = None) :
+
+        """ Add result dataframe of one (geneset, database) pair
+
+            Args
+                order (Tuple, optional): Sort key of the chunk. If every chunk appended since the last read has one,
+                                         they are consolidated in that order instead of the order of appends.
+                                         Query functions pass (new_batch(), geneset index, database index), so results
+                                         appended as requests complete keep the order of their inputs, and
+                                         results of successive calls are not interleaved.
+        """
+
+        with self._lock:
+            self._pending.append((order, (geneset, database), df))
+            self._n_rows += len(df)
+
+    def new_batch(self) -> int:
+
+        """ Sequence number of a new batch of appends, to lead their 'order' keys """
+
+        with self._lock:
+            self._n_batches += 1
+
+            return self._n_batches
+
+    @property
+    def keys(self) -> List[Tuple]:
+
+        with self._lock:
+            return list(dict.fromkeys(list(self._ranges) + [key for _, key, _ in self._pending]))
+
+    @property
+    def genesets(self) -> List:
+
+        return list(dict.fromkeys(key[0] for key in self.keys))
+
+    @property
+    def databases(self) -> List:
+
+        return list(dict.fromkeys(key[1] for key in self.keys))
+
+    @property
+    def overlaps(self) -> OverlappingGenes:
+
+        """ Overlapping genes of all rows, aligned with 'to_frame()' """
+
+        with self._lock:
+            self._consolidate()
+
+            return self._overlaps if self._overlaps is not None else OverlappingGenes.from_lists([], self.vocabulary)
+
+    def _consolidate(self) :
+
+        if not self._pending:
+            return
+
+        frames = [self._frame] if self._frame is not None else []
+        overlaps = [self._overlaps] if self._overlaps is not None else []
+        start = len(self._frame) if self._frame is not None else 0
+
+        pending = self._pending
+
+        if all(order is not None for order, _, _ in pending):
+            pending = sorted(pending, key=lambda item: item[0])
+
+        if not self._columns:
+            self._columns = list(pending[0][2].columns)
+
+        index = [self._frame.index.to_numpy()] if self._frame is not None else []
+
+        for _, key, df in pending:
+            self._ranges.setdefault(key, []).append((start, start + len(df)))
+            start += len(df)
+
+            # Position of each row among rows of its geneset
+            first = self._geneset_rows.get(key[0], 0)
+            index.append(np.arange(first, first + len(df)))
+            self._geneset_rows[key[0]] = first + len(df)
+
+            genes = df[OVERLAP_COLUMN] if OVERLAP_COLUMN in df.columns else [[]] * len(df)
+            overlaps.append(OverlappingGenes.from_lists(genes, self.vocabulary))
+            frames.append(df.drop(columns=[OVERLAP_COLUMN], errors='ignore'))
+
+        self._frame = concat_results(frames)
+        self._frame.index = np.concatenate(index)
+        self._overlaps = OverlappingGenes.concat(overlaps)
+        self._pending = []
+
+    def _overlap_lists(self) -> np.ndarray:
+
+        # List view of all rows as object array, decoding only rows added since the last call
+        decoded = len(self._lists) if self._lists is not None else 0
+
+        if decoded < len(self._overlaps):
+            new = self._overlaps.take(np.arange(decoded, len(self._overlaps)))
+            lists = np.fromiter(new.to_lists(), dtype=object, count=len(new))
+
+            self._lists = lists if self._lists is None else np.concatenate([self._lists, lists])
+
+        return self._lists
+
+    def _with_overlaps(self, df: pd.DataFrame, rows=slice(None)) -> pd.DataFrame:
+
+        df = df.copy(deep=False)
+
+        if OVERLAP_COLUMN not in self._columns:
+            return df
+
+        df.insert(min(self._columns.index(OVERLAP_COLUMN), len(df.columns)), OVERLAP_COLUMN, self._overlap_lists()[rows])
+
+        return df
+
+    def to_frame(self, overlapping_genes: bool = True) -> pd.DataFrame:
+
+        """ All results as one dataframe. Other columns are not copied on repeated calls.
+
+            Args
+                overlapping_genes (bool, optional): Include list view of 'Overlapping genes'. Defaults to True.
+        """
+
+        with self._lock:
+            self._consolidate()
+
+            if self._frame is None:
+                return pd.DataFrame()
+
+            return self._with_overlaps(self._frame) if overlapping_genes else self._frame
+
+    def select(self,
+               genesets: Optional[Iterable] = None,
+               databases: Optional[Iterable] = None,
+               overlapping_genes: bool = True) -> pd.DataFrame:
+
+        """ Rows of given genesets and/or databases. None selects all.
+
+            A contiguous block of rows is returned as a slice; otherwise only selected rows are gathered.
+        """
+
+        genesets = set(genesets) if genesets is not None else None
+        databases = set(databases) if databases is not None else None
+
+        def match(key) :
+            return (genesets is None or key[0] in genesets) and (databases is None or key[1] in databases)
+
+        with self._lock:
+            self._consolidate()
+
+            if self._frame is None:
+                return pd.DataFrame()
+
+            ranges = _merge_ranges(sorted(r for key, rs in self._ranges.items() if match(key) for r in rs))
+
+            if len(ranges) == 1:
+                rows = slice(*ranges[0])
+                df = self._frame.iloc[rows]
+            else:
+                rows = np.concatenate([np.arange(start, stop) for start, stop in ranges]) if ranges else np.array([], dtype=np.int64)
+                df = self._frame.take(rows)
+
+            df = df.reset_index(drop=True)
+
+            if not overlapping_genes:
+                return df
+
+            return self._with_overlaps(df, rows)
+
+    def clear(self) :
+
+        """ Remove all results. The gene vocabulary is kept. """
+
+        with self._lock:
+            self._frame = None
+            self._columns = []
+            self._overlaps = None
+            self._lists = None
+            self._ranges = {}
+            self._pending = []
+            self._geneset_rows = {}
+            self._n_rows = 0
+
+
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+
+    merged = []
+
+    for start, stop in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], stop)
+        else:
+            merged.append((start, stop))
+
+    return merged
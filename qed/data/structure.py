@@ -1,7 +1,15 @@
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field, replace
 import pandas as pd
+import numpy as np
 import importlib.resources as resources
-from typing import List, Dict
+from typing import List, Dict, Union, Tuple, Optional, Iterable
+from threading import Lock
+import warnings
+import bisect
+import csv
+import re
+from .store import ResultStore, concat_results
+from .. import metrics
 
 
 @dataclass
@@ -23,49 +31,76 @@ class geneset:
         self.GO = []
         
         return self
+
+    def with_GO(self, GO: List[pd.DataFrame], **params) :
+
+        """ Return a new geneset with 'GO' dataframes appended and 'params' updated.
+            Genes and existing dataframes are shared with this geneset, not copied.
+        """
+
+        return replace(self, GO=self.GO + list(GO), params={**self.params, **params})
     
 
 
 
-def merge_df(geneset_list: List[geneset], term_suffix: bool = True) :
+# Ontology IDs at the end of EnrichR terms: Gene Ontology '(GO:000)', Reactome 'R-HSA-000', WikiPathway 'WP000',
+# MGI Mammalian Phenotype 'MP:000', Human Phenotype Ontology '(HP:000)', GEO 'GSE000'/'GSD000',
+# Tabula Muris 'CL:000' and Azimuth Celltype 2021 'CL000'
+TERM_ID_PATTERN = re.compile(r'\(GO:\d+\)$|\bR-HSA-\d+\b|\bWP\d+\b|MP:\d+$|\(HP:\d+\)$|GSE\d+$|GSD\d+$|CL:\d+$|CL\d+$')
 
-    merged_dfs = []
 
-    for geneset in geneset_list:
-        merged_df = pd.concat(geneset.GO, axis=0, ignore_index=True)
-        merged_dfs.append(merged_df)
+def split_term_id(term: str) -> Tuple[str, Optional[str]]:
 
-    df = pd.concat(merged_dfs, axis=0)
+    """ Split EnrichR term into name and ontology ID, e.g. 'insulin secretion (GO:0030073)' -> ('insulin secretion', 'GO:0030073')
+        Several IDs are joined by ';'. ID is None if term has no ID.
+    """
 
-    if term_suffix == False :
-        # Remove (GO:000) patterns at the end of the 'Term' column for Gene Ontology
-        df['Term'] = df['Term'].str.replace(r'\(GO:\d+\)$', '', regex=True)
+    if not isinstance(term, str):
+        return term, None
 
-        # Remove R-HSA-000 patterns at the end of the 'Term' column for Reactome
-        df['Term'] = df['Term'].str.replace(r'\bR-HSA-\d+\b', '', regex=True)
+    ids = []
 
-        # Remove WP000 patterns at the end of the 'Term' column for WikiPathway
-        df['Term'] = df['Term'].str.replace(r'\bWP\d+\b', '', regex=True)
+    def remove(match) :
+        ids.append(match.group(0).strip('()'))
+        return ''
 
-        # Remove MP:0000 at the end of the 'Term' column for MGI Mammalian Phenotype Level 4
-        df['Term'] = df['Term'].str.replace(r'MP:\d+$', '', regex=True)
+    name = TERM_ID_PATTERN.sub(remove, term).strip()
 
-        # Remove (HP:0000) at the end of the 'Term' column for Human phenotype Ontology
-        df['Term'] = df['Term'].str.replace(r'\(HP:\d+\)$', '', regex=True)
+    return name, ';'.join(ids) if ids else None
 
-        # Remove GSE000 at the end of the 'Term' column for several database
-        df['Term'] = df['Term'].str.replace(r'GSE\d+$', '', regex=True)
 
-        # Remove GSD000 at the end of the 'Term' column for several database
-        df['Term'] = df['Term'].str.replace(r'GSD\d+$', '', regex=True)
 
-        # Remove CL:000 at the end of the 'Term' column for Tabula Muris
-        df['Term'] = df['Term'].str.replace(r'CL:\d+$', '', regex=True)
 
-        # Remove CL000 at the end of the 'Term' column for Azimuth Celltype 2021
-        df['Term'] = df['Term'].str.replace(r'CL\d+$', '', regex=True)
-        
-        df['Term'] = df['Term'].str.strip()
+@metrics.timed('merge.merge_df')
+def merge_df(geneset_list: Union[List[geneset], ResultStore], term_suffix: bool = True) :
+
+    if isinstance(geneset_list, ResultStore):
+        # Consolidated once by the store; no concat on repeated calls.
+        # Returns a new frame, so removing term suffixes does not modify the store
+        df = geneset_list.to_frame()
+
+    else:
+        # Single concat. Index restarts at 0 for each geneset as before.
+        dfs = [go for geneset in geneset_list for go in geneset.GO]
+        df = concat_results(dfs)
+        df.index = np.concatenate([np.arange(sum(len(go) for go in geneset.GO)) for geneset in geneset_list])
+
+    if term_suffix == False :
+        # Normalize each unique term once and map back through codes
+        codes, uniques = pd.factorize(df['Term'], use_na_sentinel=False)
+        split = [split_term_id(term) for term in uniques]
+
+        names = np.array([name for name, _ in split], dtype=object)
+        ids = np.array([term_id for _, term_id in split], dtype=object)
+
+        if isinstance(df['Term'].dtype, pd.CategoricalDtype):
+            # Categoricals of unique terms, expanded by codes without hashing every row
+            names, ids = pd.Categorical(names), pd.Categorical(ids)
+            df['Term'] = pd.Categorical.from_codes(names.codes[codes], names.categories)
+            df.insert(df.columns.get_loc('Term') + 1, 'Term ID', pd.Categorical.from_codes(ids.codes[codes], ids.categories))
+        else:
+            df['Term'] = names[codes]
+            df.insert(df.columns.get_loc('Term') + 1, 'Term ID', ids[codes])
 
     return df 
 
@@ -74,80 +109,298 @@ def merge_df(geneset_list: List[geneset], term_suffix: bool = True) :
 
 # DB list
 
-@dataclass
+# file contains EnrichR database information
+DB_FILE = 'DB/EnrichR_DB_list.csv'
+
+
+
+
+class EnrichR_DB_info :
+
+    """ One EnrichR library of the registry
+
+        'db' is deprecated: entries are no longer added to a registry when created. Use EnrichR_DB.add_info.
+    """
+
+    __slots__ = ('name', 'category', 'description', 'number_of_terms', 'gene_coverage', 'genes_per_term', 'is_latest')
+
+    def __init__(self,
+                 name: str,
+                 category: str,
+                 description: Optional[str],
+                 number_of_terms: int,
+                 gene_coverage: int,
+                 genes_per_term: int,
+                 is_latest: bool,
+                 db: Optional['EnrichR_DB'] = None):
+
+        self.name = name
+        self.category = category
+        self.description = description
+        self.number_of_terms = number_of_terms
+        self.gene_coverage = gene_coverage
+        self.genes_per_term = genes_per_term
+        self.is_latest = is_latest
+
+        if db is not None:
+            warnings.warn("'db' of EnrichR_DB_info is deprecated, use db.add_info(info)", DeprecationWarning, stacklevel=2)
+            db.add_info(self)
+
+    def __repr__(self) :
+        
+        return f"name: {self.name} / category: {self.category}\n"
+
+    def __eq__(self, other) :
+
+        if not isinstance(other, EnrichR_DB_info):
+            return NotImplemented
+
+        return all(getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
+
+    def __hash__(self) :
+
+        return hash(self.name)
+
+    def to_dict(self) -> Dict:
+
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+
+
+
 class EnrichR_DB:
 
-    db: list = field(default_factory=list)
+    """ Registry of EnrichR libraries. ENRICHR_DB holds the libraries of DB_FILE, read on first access.
+
+        Libraries are indexed by category and by lowercase name. Search results keep the order of entries.
+
+        Example
+            ENRICHR_DB.search_DB(category='Pathways', by_name='kegg')
+            ENRICHR_DB.search_DB(prefix='GO_', min_terms=1000, min_gene_coverage=10000)
+            ENRICHR_DB['KEGG_2021_Human'].number_of_terms
+
+        'db' (list of EnrichR_DB_info) is the deprecated name of 'infos'.
+    """
+
+    def __init__(self, infos: Optional[Iterable[EnrichR_DB_info]] = None, db: Optional[List[EnrichR_DB_info]] = None):
+
+        if db is not None:
+            warnings.warn("'db' of EnrichR_DB is deprecated, use 'infos'", DeprecationWarning, stacklevel=2)
+            infos = db if infos is None else list(infos) + list(db)
+
+        self._lock = Lock()
+        self._infos: Optional[List[EnrichR_DB_info]] = list(infos) if infos is not None else []
+        self._index = None
+
+    @classmethod
+    def _from_db_file(cls) :
 
-    def add_info(self, info):
-        self.db.append(info)
+        # Entries of DB_FILE, read by '_load' on first access
+        registry = cls()
+        registry._infos = None
+
+        return registry
 
     def __repr__(self) :
         
-        return f"ENRICHR DATABASE\n[number of databases: {len(self.db)}]"
-    
+        return f"ENRICHR DATABASE\n[number of databases: {len(self)}]"
+
+    def __len__(self) :
+
+        return len(self.db)
+
+    def __iter__(self) :
+
+        return iter(self.db)
+
+    def __contains__(self, name: str) :
+
+        return self.get(name) is not None
+
+    def __getitem__(self, name: str) -> EnrichR_DB_info:
+
+        info = self.get(name)
+
+        if info is None:
+            raise KeyError(name)
+
+        return info
+
+    def _load(self) -> '_DBIndex':
+
+        # Read and indexed once, on first access
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    if self._infos is None:
+                        self._infos = _read_db_file()
+                    self._index = _DBIndex(self._infos)
+
+        return self._index
+
+    @property
+    def db(self) -> List[EnrichR_DB_info]:
+
+        self._load()
+
+        return self._infos
+
+    def add_info(self, info: EnrichR_DB_info) :
+
+        self._load()
+
+        with self._lock:
+            self._infos.append(info)
+            self._index = _DBIndex(self._infos)
+
     @property
-    def categories(self):
-        return list(set(info.category for info in self.db))
+    def categories(self) -> List[str]:
+
+        return list(self._load().by_category)
+
+    @property
+    def names(self) -> List[str]:
+
+        return [info.name for info in self.db]
+
+    def get(self, name: str) -> Optional[EnrichR_DB_info]:
+
+        """ Library by name, case-insensitive. None if not found """
+
+        return self._load().by_name.get(name.lower())
 
     def search_DB(self, 
-                  category: List[str] = None, 
+                  category: Union[str, List[str], None] = None, 
                   is_latest: bool = True,
-                  by_name: str = None):
-        
-        if is_latest == True:
-            db_list = [db for db in self.db if db.category in category and db.is_latest == True]
-            
-            if by_name is not None:
-                db_list = [db for db in db_list if by_name.lower() in db.name.lower()]
+                  by_name: Optional[str] = None,
+                  prefix: Optional[str] = None,
+                  min_terms: Optional[int] = None,
+                  max_terms: Optional[int] = None,
+                  min_gene_coverage: Optional[int] = None,
+                  max_gene_coverage: Optional[int] = None,
+                  min_genes_per_term: Optional[int] = None,
+                  max_genes_per_term: Optional[int] = None) -> List[EnrichR_DB_info]:
 
-        else:
-            db_list = [db for db in self.db if db.category in category]
-            
-            if by_name is not None:
-                db_list = [db for db in db_list if by_name.lower() in db.name.lower()]
+        """ Search libraries. Conditions are combined with AND.
 
-        return db_list 
+            Args
+                category (str or List, optional): Categories to include (see 'categories'). Defaults to None (all).
 
+                is_latest (bool, optional): Only the latest version of each library. Defaults to True.
 
+                by_name (str, optional): Case-insensitive substring of the name. Defaults to None.
 
+                prefix (str, optional): Case-insensitive prefix of the name. Defaults to None.
 
-@dataclass
-class EnrichR_DB_info :
-    
-    name: str
-    category: str
-    description: str
-    number_of_terms: int
-    gene_coverage: int
-    genes_per_term: int
-    is_latest: bool 
-    
-    db: EnrichR_DB = field(default_factory=EnrichR_DB)
+                min_terms, max_terms (int, optional): Range of number of terms (inclusive).
 
-    def __post_init__(self):
-        self.db.add_info(self)
+                min_gene_coverage, max_gene_coverage (int, optional): Range of gene coverage (inclusive).
 
-    def __repr__(self) :
-        
-        return f"name: {self.name} / category: {self.category}\n"
+                min_genes_per_term, max_genes_per_term (int, optional): Range of genes per term (inclusive).
+        """
 
+        index = self._load()
+        mask = np.ones(len(index.infos), dtype=bool)
 
-ENRICHR_DB = EnrichR_DB()
+        if category is not None:
+            category = [category] if isinstance(category, str) else category
+            selected = np.zeros(len(index.infos), dtype=bool)
+            for cat in category:
+                selected[index.by_category.get(cat, [])] = True
+            mask &= selected
 
-# file contains EnrichR database information
-file_path = resources.files('qed.data').joinpath('DB/EnrichR_DB_list.csv')
-DB_DF = pd.read_csv(file_path)
-
-for _, row in DB_DF.iterrows():
-    EnrichR_DB_info(
-        name = row['DB'],
-        category = row['Category'],
-        description =  row['Description'],
-        number_of_terms = row['Terms'],
-        gene_coverage=row['Gene coverage'],
-        genes_per_term=row['Genes per term'],
-        is_latest=row['is_latest'],
-        db=ENRICHR_DB
-    )
+        if is_latest:
+            mask &= index.is_latest
+
+        if prefix is not None:
+            mask &= index.has_prefix(prefix.lower())
+
+        if by_name is not None:
+            needle = by_name.lower()
+            mask &= np.fromiter((needle in name for name in index.lower_names), dtype=bool, count=len(index.infos))
+
+        for values, low, high in [(index.number_of_terms, min_terms, max_terms),
+                                  (index.gene_coverage, min_gene_coverage, max_gene_coverage),
+                                  (index.genes_per_term, min_genes_per_term, max_genes_per_term)]:
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+
+        return [index.infos[i] for i in np.flatnonzero(mask)]
+
+    def to_frame(self) -> pd.DataFrame:
+
+        return pd.DataFrame([info.to_dict() for info in self.db], columns=list(EnrichR_DB_info.__slots__))
+
+
+
+
+class _DBIndex:
+
+    """ Category, name and metadata indexes of a list of EnrichR_DB_info """
+
+    def __init__(self, infos: List[EnrichR_DB_info]):
+
+        self.infos = list(infos)
+        self.lower_names = [info.name.lower() for info in self.infos]
+
+        self.by_name = {}
+        self.by_category: Dict[str, List[int]] = {}
+
+        for i, (info, lower) in enumerate(zip(self.infos, self.lower_names)):
+            self.by_name.setdefault(lower, info)
+            self.by_category.setdefault(info.category, []).append(i)
+
+        self.is_latest = np.array([bool(info.is_latest) for info in self.infos], dtype=bool)
+        self.number_of_terms = np.array([info.number_of_terms for info in self.infos], dtype=np.int64)
+        self.gene_coverage = np.array([info.gene_coverage for info in self.infos], dtype=np.int64)
+        self.genes_per_term = np.array([info.genes_per_term for info in self.infos], dtype=np.int64)
+
+        # Sorted lowercase names for prefix search
+        self._order = np.argsort(np.array(self.lower_names, dtype=object), kind='stable')
+        self._sorted_names = [self.lower_names[i] for i in self._order]
+
+    def has_prefix(self, prefix: str) -> np.ndarray:
+
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        stop = start
+
+        while stop < len(self._sorted_names) and self._sorted_names[stop].startswith(prefix):
+            stop += 1
+
+        mask = np.zeros(len(self.infos), dtype=bool)
+        mask[self._order[start:stop]] = True
+
+        return mask
+
+
+
+
+def _read_db_file() -> List[EnrichR_DB_info]:
+
+    with resources.files('qed.data').joinpath(DB_FILE).open('r', encoding='utf-8-sig', newline='') as f:
+        return [EnrichR_DB_info(name=row['DB'],
+                                category=row['Category'],
+                                description=row['Description'] or None,
+                                number_of_terms=int(row['Terms']),
+                                gene_coverage=int(row['Gene coverage']),
+                                genes_per_term=int(row['Genes per term']),
+                                is_latest=row['is_latest'].strip().upper() == 'TRUE')
+                for row in csv.DictReader(f)]
+
+
+ENRICHR_DB = EnrichR_DB._from_db_file()
+
+
+
+
+def __getattr__(name: str) :
+
+    # DB_DF (DB_FILE as a dataframe) is read on first access instead of at import
+    if name == 'DB_DF':
+        value = pd.read_csv(resources.files('qed.data').joinpath(DB_FILE))
+        globals()[name] = value
+        return value
 
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,385 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from contextvars import ContextVar
+from collections import deque
+from threading import Lock
+import functools
+import logging
+import json
+import time
+import os
+
+
+
+
+# Metrics and tracing of requests, parsing, merging and plotting
+#
+# Off by default. While disabled, 'timer' returns a shared no-op context manager and
+# 'count'/'observe' return after one flag check, so instrumented code pays nothing measurable.
+#
+# Example
+#     from qed import metrics
+#     metrics.enable()
+#     metrics.add_exporter(metrics.JSONLinesExporter('events.jsonl'))
+#     ...
+#     metrics.write_summary('run_summary.json')
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per histogram for quantiles (most recent ones)
+MAX_SAMPLES = 10000
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+_ENABLED = False
+_LOCK = Lock()
+
+_COUNTERS: Dict[Tuple, float] = {}
+_HISTOGRAMS: Dict[Tuple, 'Histogram'] = {}
+_TIMERS: Dict[Tuple, 'Histogram'] = {}
+_EXPORTERS: List[Callable[[Dict], Any]] = []
+
+# Name of the innermost running timer, reported as 'parent' of nested events
+_SPAN: ContextVar[Optional[str]] = ContextVar('qed_metrics_span', default=None)
+
+_STARTED: Optional[float] = None
+
+
+
+
+class Histogram:
+
+    """ Count, sum, min and max of all observations, and quantiles of the last MAX_SAMPLES """
+
+    def __init__(self):
+
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def __repr__(self) :
+
+        return f"Histogram object [count: {self.count}, sum: {self.sum}]"
+
+    def add(self, value: float) :
+
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self) -> Dict:
+
+        if self.count == 0:
+            return {'count': 0}
+
+        samples = sorted(self.samples)
+        quantiles = {f'p{int(q * 100)}': samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+        return dict({'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count,
+                     'min': self.min, 'max': self.max}, **quantiles)
+
+
+
+
+class _Timer:
+
+    __slots__ = ('name', 'tags', '_start', '_token')
+
+    def __init__(self, name: str, tags: Dict):
+
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self) :
+
+        self._token = _SPAN.set(self.name)
+        self._start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb) :
+
+        elapsed = time.perf_counter() - self._start
+        _SPAN.reset(self._token)
+
+        tags = self.tags if exc_type is None else dict(self.tags, error=exc_type.__name__)
+        _record('timer', self.name, elapsed, tags)
+
+        logger.debug('%s took %.3f seconds', self.name, elapsed, extra={'metric': self.name, 'seconds': elapsed})
+
+        return False
+
+
+class _NullTimer:
+
+    __slots__ = ()
+
+    def __enter__(self) :
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb) :
+
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+
+
+def enable(exporters: Optional[List[Callable[[Dict], Any]]] = None, reset: bool = True) :
+
+    """ Start recording metrics
+
+        Args
+            exporters (List[Callable], optional): Also add these exporters (see add_exporter). Defaults to None.
+
+            reset (bool, optional): Drop metrics recorded before. Defaults to True.
+    """
+
+    global _ENABLED, _STARTED
+
+    if reset:
+        clear()
+
+    for exporter in exporters or []:
+        add_exporter(exporter)
+
+    with _LOCK:
+        _STARTED = _STARTED if _STARTED is not None else time.time()
+        _ENABLED = True
+
+
+
+
+def disable() :
+
+    """ Stop recording metrics. Recorded metrics are kept until 'clear' """
+
+    global _ENABLED
+
+    _ENABLED = False
+
+
+
+
+def is_enabled() -> bool:
+
+    return _ENABLED
+
+
+
+
+def clear() :
+
+    """ Drop recorded metrics. Exporters are kept """
+
+    global _STARTED
+
+    with _LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+        _TIMERS.clear()
+        _STARTED = time.time() if _ENABLED else None
+
+
+
+
+def add_exporter(exporter: Callable[[Dict], Any]) :
+
+    """ Call 'exporter(event)' for each recorded value
+
+        'event' is a dict with keys 'type' ('counter', 'histogram' or 'timer'), 'name', 'value',
+        'tags', 'parent' (name of the enclosing timer or None) and 'time' (UNIX time).
+        Exporters run in the recording thread and their errors are logged, not raised.
+    """
+
+    with _LOCK:
+        if exporter not in _EXPORTERS:
+            _EXPORTERS.append(exporter)
+
+
+
+
+def remove_exporter(exporter: Callable[[Dict], Any]) :
+
+    with _LOCK:
+        if exporter in _EXPORTERS:
+            _EXPORTERS.remove(exporter)
+
+
+
+
+def _record(kind: str, name: str, value: float, tags: Dict) :
+
+    key = (name, tuple(sorted(tags.items())))
+
+    with _LOCK:
+        if kind == 'counter':
+            _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+        else:
+            histograms = _TIMERS if kind == 'timer' else _HISTOGRAMS
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].add(value)
+
+        exporters = list(_EXPORTERS)
+
+    if not exporters:
+        return
+
+    event = {'type': kind, 'name': name, 'value': value, 'tags': tags, 'parent': _SPAN.get(), 'time': time.time()}
+
+    for exporter in exporters:
+        try:
+            exporter(event)
+        except Exception:
+            logger.exception('Metrics exporter %r failed', exporter)
+
+
+
+
+def count(name: str, value: float = 1, **tags) :
+
+    """ Add 'value' to counter 'name' """
+
+    if _ENABLED:
+        _record('counter', name, value, tags)
+
+
+
+
+def observe(name: str, value: float, **tags) :
+
+    """ Add 'value' (e.g. bytes of a payload) to histogram 'name' """
+
+    if _ENABLED:
+        _record('histogram', name, value, tags)
+
+
+
+
+def timer(name: str, **tags) :
+
+    """ Context manager recording the seconds spent in the block to timer 'name'
+
+        Timers nest: events recorded inside the block have 'parent' set to 'name'.
+        A block raising an exception is recorded with tag 'error' set to the exception type.
+    """
+
+    if not _ENABLED:
+        return _NULL_TIMER
+
+    return _Timer(name, tags)
+
+
+
+
+def timed(name: str, **tags) :
+
+    """ Decorator recording the seconds spent in each call to timer 'name' """
+
+    def decorator(func: Callable) :
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) :
+
+            if not _ENABLED:
+                return func(*args, **kwargs)
+
+            with _Timer(name, tags):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+
+
+def _format_key(key: Tuple) -> str:
+
+    name, tags = key
+
+    if not tags:
+        return name
+
+    return name + '{' + ','.join(f'{tag}={value}' for tag, value in tags) + '}'
+
+
+
+
+def summary() -> Dict:
+
+    """ Recorded counters, and count/sum/mean/min/max/quantiles of histograms and timers (in seconds)
+
+        Keys are metric names followed by their tags, e.g. 'http.request{endpoint=enrich,status=200}'.
+    """
+
+    with _LOCK:
+        counters = {_format_key(key): value for key, value in _COUNTERS.items()}
+        histograms = {_format_key(key): histogram.summary() for key, histogram in _HISTOGRAMS.items()}
+        timers = {_format_key(key): histogram.summary() for key, histogram in _TIMERS.items()}
+        started = _STARTED
+
+    return {'started': started,
+            'elapsed': time.time() - started if started is not None else 0.0,
+            'counters': dict(sorted(counters.items())),
+            'histograms': dict(sorted(histograms.items())),
+            'timers': dict(sorted(timers.items()))}
+
+
+
+
+def write_summary(path: str) -> Dict:
+
+    """ Write 'summary()' to 'path' as JSON and return it """
+
+    result = summary()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    return result
+
+
+
+
+class JSONLinesExporter:
+
+    """ Exporter appending each event to a file as one JSON line
+
+        Args
+            path (str): File to append to.
+    """
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, 'a')
+
+    def __repr__(self) :
+
+        return f"JSONLinesExporter object [path: {self.path}]"
+
+    def __call__(self, event: Dict) :
+
+        line = json.dumps(event, default=str)
+
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self) :
+
+        with self._lock:
+            self._file.close()
@@ -1,3 +1,53 @@
-from .plot import heatmap
-from .organize import select_top_n
-from .utils import generate_cmap
\ No newline at end of file
+from typing import TYPE_CHECKING
+import importlib
+
+
+
+
+# Public API, imported from its submodule on first access (PEP 562).
+# 'import qed.pl' loads neither matplotlib nor scipy; pyplot is only loaded by 'heatmap' without 'ax'.
+
+_EXPORTS = {
+    'heatmap': 'plot',
+    'save_heatmaps': 'batch',
+    'select_top_n': 'organize',
+    'generate_cmap': 'utils',
+    'clear_linkage_cache': 'cluster',
+}
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .plot import heatmap
+    from .batch import save_heatmaps
+    from .organize import select_top_n
+    from .utils import generate_cmap
+    from .cluster import clear_linkage_cache
+
+
+
+
+def __getattr__(name: str) :
+
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    else:
+        # Submodules were attributes of the package when it imported them eagerly ('qed.data.query')
+        try:
+            value = importlib.import_module(f'.{name}', __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f'{__name__}.{name}':
+                raise
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+    # Later lookups find the name in the module namespace and skip __getattr__
+    globals()[name] = value
+
+    return value
+
+
+
+
+def __dir__() :
+
+    return sorted(set(globals()) | set(__all__))
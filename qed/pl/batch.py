@@ -0,0 +1,176 @@
+from typing import Dict, List, Tuple, Any
+from tqdm import tqdm
+import concurrent.futures
+import pandas as pd
+import re
+import os
+from .plot import heatmap
+from .. import metrics
+import logging
+
+
+
+
+# Batch rendering of heatmaps, one file per facet (e.g. per database)
+
+logger = logging.getLogger(__name__)
+
+def _file_name(value: Any, format: str) -> str:
+
+    return re.sub(r'[^\w.-]+', '_', str(value)).strip('_') + '.' + format
+
+
+
+
+def _file_names(values: List, format: str) -> Dict[Any, str]:
+
+    """ File name of each value. Values sanitized to the same name (e.g. 'a/b' and 'a_b') get suffixes '_2', '_3' ... """
+
+    names = {}
+    used = set()
+
+    for value in values:
+        name = _file_name(value, format)
+        stem = name[:-len(format) - 1]
+        suffix = 1
+
+        # Case-insensitive file systems would also overwrite names differing in case only
+        while name.lower() in used:
+            suffix += 1
+            name = f'{stem}_{suffix}.{format}'
+
+        used.add(name.lower())
+        names[value] = name
+
+    return names
+
+
+
+
+def _log_failure(value: Any, error: Exception) :
+
+    logger.error('Error drawing %s: %s', value, error, extra={'facet': value, 'error': type(error).__name__})
+
+    metrics.count('plot.failures')
+
+
+
+
+def _init_worker() :
+
+    import matplotlib
+
+    # Non-interactive backend in workers
+    matplotlib.use('Agg', force=True)
+
+    # Metrics recorded in workers are not collected, and exporters of the parent are not shared
+    metrics.disable()
+
+
+
+
+def _render_heatmap(df: pd.DataFrame,
+                    title: str,
+                    file_path: str,
+                    figsize: Tuple,
+                    dpi: int,
+                    kwargs: Dict) -> str:
+
+    # Figure without pyplot: no global state and no GUI backend, safe in worker processes
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+
+    heatmap(df, ax=ax, **kwargs)
+    ax.set_title(title)
+
+    fig.savefig(file_path, dpi=dpi, bbox_inches='tight')
+
+    return file_path
+
+
+
+
+@metrics.timed('plot.save_heatmaps')
+def save_heatmaps(df: pd.DataFrame,
+                  out_dir: str,
+                  n: int,
+                  group_by: str,
+                  facet_by: str = 'Database',
+                  format: str = 'png',
+                  figsize: Tuple = (5, 10),
+                  dpi: int = 150,
+                  rasterized: bool = True,
+                  n_jobs: int = None,
+                  **kwargs) -> Dict[Any, str]:
+
+    """ Draw one heatmap per value of 'facet_by' and save them to 'out_dir' in parallel processes
+
+        Args:
+            df (pd.DataFrame): Dataframe that contains EnrichR Query result (e.g. merge_df output)
+
+            out_dir (str): Directory to write figures. Files are named after facet values, with a suffix
+                           ('_2', '_3' ...) for values that map to the same file name.
+
+            n (int): Number of terms for each 'group_by'
+
+            group_by (str): A column from Dataframe for x axis
+
+            facet_by (str, optional): Column to split figures by. Defaults to 'Database'.
+
+            format (str, optional): File format passed to savefig ('png', 'pdf', 'svg' ...). Defaults to 'png'.
+
+            figsize (Tuple, optional): Size of each figure. Defaults to (5, 10).
+
+            dpi (int, optional): Resolution of raster outputs and rasterized cells. Defaults to 150.
+
+            rasterized (bool, optional): Rasterize heatmap cells to keep vector files small. Defaults to True.
+
+            n_jobs (int, optional): Number of worker processes. 1 draws in this process.
+                                    Defaults to None (number of CPUs).
+
+            **kwargs: Other arguments of qed.pl.heatmap (order_by, cmap, vmin, vmax, cbar_kws ...)
+
+        Returns:
+            Dict: File path of each facet value. Facets that failed are left out.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    kwargs = dict(kwargs, n=n, group_by=group_by, rasterized=rasterized)
+
+    facets = dict(list(df.groupby(facet_by, observed=True, sort=True)))
+    names = _file_names(list(facets), format)
+
+    tasks = {value: (facet_df, str(value), os.path.join(out_dir, names[value]), figsize, dpi, kwargs)
+             for value, facet_df in facets.items()}
+
+    paths = {}
+    pbar = tqdm(total=len(tasks), desc='Drawing heatmaps')
+
+    if n_jobs == 1:
+        for value, args in tasks.items():
+            try:
+                paths[value] = _render_heatmap(*args)
+            except Exception as e:
+                _log_failure(value, e)
+            pbar.update(1)
+
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker) as executor:
+            futures = {executor.submit(_render_heatmap, *args): value for value, args in tasks.items()}
+
+            for future in concurrent.futures.as_completed(futures):
+                value = futures[future]
+                try:
+                    paths[value] = future.result()
+                except Exception as e:
+                    _log_failure(value, e)
+                pbar.update(1)
+
+    pbar.close()
+
+    metrics.count('plot.figures', len(paths))
+
+    return {value: paths[value] for value in tasks if value in paths}
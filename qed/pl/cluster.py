@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from threading import Lock
+from .. import metrics
+import numpy as np
+import hashlib
+
+
+
+
+# Leaf order of hierarchical clustering, cached by matrix content, method and metric
+
+# Above this number of rows, only this many representative rows are clustered (see 'leaf_order')
+LARGE_MATRIX_ROWS = 2000
+
+# Rows whose distances to the representatives are computed at once
+ASSIGN_CHUNK_ROWS = 1000
+
+CACHE_SIZE = 64
+
+_CACHE: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_CACHE_LOCK = Lock()
+
+
+
+
+def _matrix_key(matrix: np.ndarray) -> tuple:
+
+    digest = hashlib.blake2b(np.ascontiguousarray(matrix).tobytes(), digest_size=16).hexdigest()
+
+    return (digest, matrix.shape, matrix.dtype.str)
+
+
+
+
+def _leaves(matrix: np.ndarray, method: str, metric: str, optimal_ordering: bool) -> np.ndarray:
+
+    if len(matrix) < 2:
+        return np.arange(len(matrix))
+
+    from scipy.cluster import hierarchy
+
+    linkage = hierarchy.linkage(matrix, method=method, metric=metric, optimal_ordering=optimal_ordering)
+
+    return hierarchy.leaves_list(linkage)
+
+
+
+
+def _leaves_sampled(matrix: np.ndarray, method: str, metric: str, optimal_ordering: bool) -> np.ndarray:
+
+    # Linkage is quadratic in rows, so only LARGE_MATRIX_ROWS rows are clustered.
+    # Identical rows are merged first. If more distinct rows remain, a seeded random sample is clustered
+    # and every other row is placed after its nearest sampled row, closest first.
+    unique, inverse = np.unique(matrix, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    if len(unique) <= LARGE_MATRIX_ROWS:
+        unique_order = _leaves(unique, method, metric, optimal_ordering)
+
+        position = np.empty(len(unique), dtype=np.int64)
+        position[unique_order] = np.arange(len(unique))
+
+        return np.argsort(position[inverse], kind='stable')
+
+    from scipy.spatial.distance import cdist
+
+    # Same sample for the same matrix, so orders are reproducible
+    sample = np.sort(np.random.default_rng(0).choice(len(unique), LARGE_MATRIX_ROWS, replace=False))
+    sample_order = _leaves(unique[sample], method, metric, optimal_ordering)
+
+    position = np.empty(len(sample), dtype=np.int64)
+    position[sample_order] = np.arange(len(sample))
+
+    # Nearest sampled row of each distinct row, with the metric of the linkage ('ward' and others use euclidean)
+    distance_metric = metric if method in ['single', 'complete', 'average', 'weighted'] else 'euclidean'
+    nearest = np.empty(len(unique), dtype=np.int64)
+    distance = np.empty(len(unique))
+
+    for start in range(0, len(unique), ASSIGN_CHUNK_ROWS):
+        distances = cdist(unique[start:start + ASSIGN_CHUNK_ROWS], unique[sample], metric=distance_metric)
+        nearest[start:start + ASSIGN_CHUNK_ROWS] = distances.argmin(axis=1)
+        distance[start:start + ASSIGN_CHUNK_ROWS] = distances.min(axis=1)
+
+    # Sampled rows are at distance 0 of themselves and come first in their group
+    unique_order = np.lexsort((distance, position[nearest]))
+
+    unique_position = np.empty(len(unique), dtype=np.int64)
+    unique_position[unique_order] = np.arange(len(unique))
+
+    return np.argsort(unique_position[inverse], kind='stable')
+
+
+
+
+def leaf_order(matrix: np.ndarray,
+               method: str = 'average',
+               metric: str = 'euclidean',
+               optimal_ordering: bool = False,
+               cache: bool = True) -> np.ndarray:
+
+    """ Order of rows of 'matrix' given by hierarchical clustering
+
+        Args
+            matrix (np.ndarray): Observations x features.
+
+            method (str, optional): Method of scipy.cluster.hierarchy.linkage. Defaults to 'average'.
+
+            metric (str, optional): Metric of scipy.cluster.hierarchy.linkage. Defaults to 'euclidean'.
+
+            optimal_ordering (bool, optional): Reorder leaves so that distance between successive leaves is minimal.
+                                               Slower. Defaults to False.
+
+            cache (bool, optional): Reuse order computed for the same matrix, method and metric. Defaults to True.
+
+        For matrices with more than LARGE_MATRIX_ROWS rows, identical rows are merged and at most LARGE_MATRIX_ROWS
+        distinct rows (a seeded random sample) are clustered. Other rows follow their nearest sampled row.
+    """
+
+    matrix = np.asarray(matrix, dtype=float)
+    key = (_matrix_key(matrix), method, metric, optimal_ordering)
+
+    if cache:
+        with _CACHE_LOCK:
+            if key in _CACHE:
+                _CACHE.move_to_end(key)
+                metrics.count('linkage.cache_hits')
+                return _CACHE[key]
+
+        metrics.count('linkage.cache_misses')
+
+    with metrics.timer('plot.linkage', method=method):
+        if len(matrix) > LARGE_MATRIX_ROWS:
+            order = _leaves_sampled(matrix, method, metric, optimal_ordering)
+        else:
+            order = _leaves(matrix, method, metric, optimal_ordering)
+
+    # Shared between callers through the cache
+    order.setflags(write=False)
+
+    if cache:
+        with _CACHE_LOCK:
+            _CACHE[key] = order
+
+            while len(_CACHE) > CACHE_SIZE:
+                _CACHE.popitem(last=False)
+
+    return order
+
+
+
+
+def clear_linkage_cache() :
+
+    with _CACHE_LOCK:
+        _CACHE.clear()
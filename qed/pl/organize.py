@@ -1,19 +1,26 @@
+from .. import metrics
 import pandas as pd
+import numpy as np
+import logging
 
 
+logger = logging.getLogger(__name__)
 
 
-def select_top_n(df: pd.DataFrame, 
+
+
+@metrics.timed('plot.select_top_n')
+def select_top_n(df: pd.DataFrame,
                  n: int,
                  group_by: str,
-                 order_by: str = 'Adjusted p-value', 
+                 order_by: str = 'Adjusted p-value',
                  allow_duplicate: bool = False):
-    
+
     # Check if 'Term' is in dataframe
 
     if 'Term' not in df.columns :
         raise ValueError("The 'Term' column is not present in the input DataFrame.")
-    
+
     # Check 'order_by' is valid one.
 
     if order_by in ['Adjusted p-value', 'P-value'] :
@@ -22,69 +29,99 @@ def select_top_n(df: pd.DataFrame,
         ascending = False
     else :
         raise ValueError("'Order_by' should be one of 'Adjusted p-value', 'P-value', 'Odds ratio', and 'Combined score'.")
-    
-    df_copy = df.copy(deep=True)
-    df_copy = df_copy.sort_values([group_by, order_by], ascending=ascending)
-    df_top_n = df_copy.groupby(group_by).head(n)
-    
 
-    if not allow_duplicate :
+    # Rank rows by 'order_by' (best first). Ties keep the order of rows in 'df'.
+
+    groups, _ = pd.factorize(df[group_by], sort=True)
+    terms, _ = pd.factorize(df['Term'], use_na_sentinel=False)
+    values = df[order_by].to_numpy(dtype=float)
+    positions = np.arange(len(df))
+
+    # Rows without group are dropped, as in groupby
+    valid = np.flatnonzero(groups >= 0)
+
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[valid[np.lexsort((positions[valid], groups[valid], values[valid] if ascending else -values[valid]))]] = np.arange(len(valid))
+
+    # Rows of each group in rank order
+    by_group = valid[np.lexsort((rank[valid], groups[valid]))]
+    n_groups = groups.max() + 1 if len(valid) else 0
+    group_sizes = np.bincount(groups[valid], minlength=n_groups)
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]]).astype(np.int64)
+
+    selected = _propose_and_accept(by_group, group_starts, group_sizes, groups, terms, rank, n, allow_duplicate, df['Term'])
+
+    # Sort selected rows by group and 'order_by'
+    selected = selected[np.lexsort((positions[selected], values[selected], groups[selected]))]
+
+    # All rows of 'df' with the 'Term' and 'Database' of each selected row, in one join
+
+    keys = df[['Term', 'Database']].iloc[selected].reset_index(drop=True)
+    keys['_order'] = np.arange(len(keys))
+
+    rows = df[['Term', 'Database']].reset_index(drop=True)
+    rows['_row'] = positions
+
+    joined = keys.merge(rows, on=['Term', 'Database'], how='inner', sort=False)
+    joined = joined.iloc[np.lexsort((joined['_row'].to_numpy(), joined['_order'].to_numpy()))]
+
+    df_subset = df.iloc[joined['_row'].to_numpy()].reset_index(drop=True)
+
+    # Keep categorical columns, with categories of selected rows only
+    for col in df_subset.select_dtypes('category').columns:
+        df_subset[col] = df_subset[col].cat.remove_unused_categories()
+
+    return df_subset
+
 
-        if 'Overlapping genes' in df_copy.columns:
 
-            df_copy = df_copy.copy()
-            df_copy['Overlapping genes'] = df_copy['Overlapping genes'].apply(tuple)
-            df_top_n = df_top_n.copy()
-            df_top_n['Overlapping genes'] = df_top_n['Overlapping genes'].apply(tuple)
 
-        while df_top_n['Term'].duplicated().any():
-            
-            # Delete rows in df_copy that presents in df_top_n
-            
-            duplicates = df_top_n['Term'][df_top_n['Term'].duplicated()].unique()
-            print(f'***Duplicated Terms***\n{duplicates}')
+def _propose_and_accept(by_group: np.ndarray,
+                        group_starts: np.ndarray,
+                        group_sizes: np.ndarray,
+                        groups: np.ndarray,
+                        terms: np.ndarray,
+                        rank: np.ndarray,
+                        n: int,
+                        allow_duplicate: bool,
+                        term_names: pd.Series) -> np.ndarray:
 
-            df_copy = pd.merge(df_copy, df_top_n, indicator=True, how='outer').query('_merge=="left_only"').drop('_merge', axis=1)
+    """ Top 'n' rows of each group, each term kept only once across groups
 
-            # Find and remove duplicates
-            
-            df_top_n = df_top_n.sort_values(order_by, ascending=ascending)
-            mask = df_top_n.duplicated(subset='Term', keep='first')
-            
-            deleted_rows = {}
-            for celltype in df_top_n.loc[mask, group_by].unique():
-                deleted_rows[celltype] = (mask & (df_top_n[group_by] == celltype)).sum()
-                
-            df_top_n = df_top_n[~mask]
+        Each group proposes its next best rows to fill 'n' slots. A term proposed by several rows
+        keeps its best-ranked row and the others are dropped for good, then groups refill.
+        The result is the same as taking rows in global rank order while skipping full groups and taken terms.
+    """
 
-            # Refill df_top_n
-            
-            for celltype, count in deleted_rows.items():
-                next_terms = df_copy[df_copy[group_by] == celltype].nsmallest(count, order_by)
-                df_top_n = pd.concat([df_top_n, next_terms])
-                
-    df_top_n = df_top_n.sort_values([group_by, order_by])
+    taken = np.zeros(len(group_sizes), dtype=np.int64)
+    held = np.array([], dtype=np.int64)
 
-    # Return 'Overlapping genes' to list    
+    while True:
 
-    if 'Overlapping genes' in df_top_n.columns :
-        df_top_n['Overlapping genes'] = df_top_n['Overlapping genes'].apply(list)
+        need = n - np.bincount(groups[held], minlength=len(group_sizes))
+        count = np.minimum(need, group_sizes - taken)
 
-    # Subset original df using 'Term' and 'Database'
+        if count.sum() <= 0:
+            break
 
-    df_subset = pd.DataFrame()
+        # Next 'count' rows of each group
+        offsets = np.concatenate([[0], np.cumsum(count)])
+        proposals = by_group[np.repeat(group_starts + taken - offsets[:-1], count) + np.arange(offsets[-1])]
+        taken += count
 
-    for _, row in df_top_n.iterrows():
+        candidates = np.concatenate([held, proposals])
 
-        # Extract 'Term' and 'Database' 
+        if allow_duplicate:
+            held = candidates
+            break
 
-        term = row['Term']
-        database = row['Database']
+        candidates = candidates[np.argsort(rank[candidates], kind='stable')]
+        _, first = np.unique(terms[candidates], return_index=True)
 
-        df_row_subset = df[(df['Term'] == term) & (df['Database'] == database)]
-        
-        df_subset = pd.concat([df_subset, df_row_subset])
+        if len(first) < len(candidates):
+            duplicated = np.setdiff1d(np.arange(len(candidates)), first)
+            logger.info('Duplicated terms: %s', pd.unique(term_names.to_numpy()[candidates[duplicated]]).tolist())
 
-    df_subset = df_subset.reset_index(drop=True)
+        held = candidates[np.sort(first)]
 
-    return df_subset
\ No newline at end of file
+    return held
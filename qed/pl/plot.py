@@ -1,13 +1,17 @@
-import matplotlib.pyplot as plt
-from typing import Dict, Tuple
-from scipy.cluster import hierarchy
+from typing import Dict, Tuple, TYPE_CHECKING
 import numpy as np
 import pandas as pd
 from .organize import select_top_n
+from .cluster import leaf_order
+from .. import metrics
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
 
 
 
+
+@metrics.timed('plot.heatmap')
 def heatmap(df: pd.DataFrame,
             n: int,
             group_by: str,
@@ -22,7 +26,10 @@ def heatmap(df: pd.DataFrame,
             vmax: float = None,
             cbar_kws: Dict = None,
             cluster_rows: bool = True,
-            cluster_columns: bool = True) :
+            cluster_columns: bool = True,
+            optimal_ordering: bool = False,
+            rasterized: bool = False,
+            ax: 'Axes' = None) :
         
         """Draw heatmap with merged DataFrame
 
@@ -59,6 +66,18 @@ def heatmap(df: pd.DataFrame,
             
             cluster_columns (bool, optional): wheter to cluster columns                              
 
+            optimal_ordering (bool, optional): Reorder leaves so that distance between successive leaves is minimal.
+                                               Slower. Defaults to False.
+
+            Leaf orders are cached by matrix, method and metric, so re-drawing with other styles
+            (cmap, vmin, vmax, figsize ...) does not cluster again.
+
+            rasterized (bool, optional): Rasterize heatmap cells so that vector outputs (PDF, SVG) stay small.
+                                         Labels are kept as vector. Defaults to False.
+
+            ax (matplotlib.axes.Axes, optional): Axes to draw on. 'figsize' is ignored. 
+                                                 Defaults to None (new figure with pyplot).
+
         Returns:
             matplotlib.axes class: You can manage plot with matplotlib package
         """
@@ -67,7 +86,12 @@ def heatmap(df: pd.DataFrame,
              raise ValueError("'Order_by' should be one of 'Adjusted p-value', 'P-value', 'Odds ratio', and 'Combined score'.")
 
 
-        fig, ax = plt.subplots(figsize=figsize)
+        if ax is None :
+            # pyplot (and its GUI backend) is only loaded when no Axes is given
+            import matplotlib.pyplot as plt
+            fig, ax = plt.subplots(figsize=figsize)
+        else :
+            fig = ax.figure
         
         subset_df = select_top_n(df, 
                                  n, 
@@ -83,39 +107,30 @@ def heatmap(df: pd.DataFrame,
         elif order_by in ['Odds ratio', 'Combined score'] :
             pivot_df = subset_df.pivot(index = "Term", columns = group_by, values = order_by).rename_axis(None, axis=1)
 
-        row_linkage = hierarchy.linkage(pivot_df.values, method=method, metric=metric)
-        row_order = hierarchy.leaves_list(row_linkage)
+        # Matrix for heatmap. Linkage is computed only for clustered axes.
 
-        col_linkage = hierarchy.linkage(pivot_df.values.T, method=method, metric=metric)
-        col_order = hierarchy.leaves_list(col_linkage)
+        row_order = leaf_order(pivot_df.values, method, metric, optimal_ordering) if cluster_rows is True else slice(None)
+        col_order = leaf_order(pivot_df.values.T, method, metric, optimal_ordering) if cluster_columns is True else slice(None)
 
-        # Matrix for heatmap
-        
-        if cluster_rows is True and cluster_columns is True :
-             clustered_data = pivot_df.iloc[row_order, col_order]
-
-        elif cluster_rows is True and cluster_columns is False :
-             clustered_data = pivot_df.iloc[row_order, :]
-
-        elif cluster_rows is False and cluster_columns is True :
-             clustered_data = pivot_df.iloc[:, col_order]
-
-        else :
-             clustered_data = pivot_df
+        clustered_data = pivot_df.iloc[row_order, col_order]
 
         quadmesh = ax.pcolormesh(clustered_data, 
                                  cmap=cmap, 
                                  vmin=vmin, 
-                                 vmax=vmax)
-
-        plt.xticks(np.arange(len(clustered_data.columns)) + 0.5, clustered_data.columns, rotation=xlabel_rotation, ha='center')
-        plt.yticks(np.arange(len(clustered_data.index)) + 0.5, clustered_data.index)
+                                 vmax=vmax,
+                                 rasterized=rasterized)
+
+        # Axes methods instead of pyplot state, so that figures can be drawn without pyplot
+        ax.set_xticks(np.arange(len(clustered_data.columns)) + 0.5)
+        ax.set_xticklabels(clustered_data.columns, rotation=xlabel_rotation, ha='center')
+        ax.set_yticks(np.arange(len(clustered_data.index)) + 0.5)
+        ax.set_yticklabels(clustered_data.index)
         
         if cbar_kws is None :
             cbar = fig.colorbar(quadmesh, ax=ax, label=f'-log10{order_by}', shrink = 0.5)
         else :
             cbar = fig.colorbar(quadmesh, ax=ax, **cbar_kws)
         
-        plt.gca().invert_yaxis()
+        ax.invert_yaxis()
 
         return fig, ax, cbar
\ No newline at end of file
@@ -1,5 +1,3 @@
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
 from typing import List
 import numpy as np
 
@@ -7,6 +5,8 @@ import numpy as np
 
 
 def generate_cmap(color_boundary: List = None, colors: List = None) :
+
+    from matplotlib.colors import Normalize, LinearSegmentedColormap
     
     if color_boundary is None :
         boundaries = [0, -np.log10(0.05), 10]
@@ -18,7 +18,7 @@ def generate_cmap(color_boundary: List = None, colors: List = None) :
     else :
         colors = colors
     
-    norm=plt.Normalize(min(boundaries),max(boundaries))
+    norm=Normalize(min(boundaries),max(boundaries))
     tuples = list(zip(map(norm,boundaries), colors))
     cmap = LinearSegmentedColormap.from_list("", tuples)
 
@@ -14,5 +14,9 @@ setup(
         'requests',
         'scipy',
         'dataclasses;python_version<"3.7"'],
-    packages=find_packages(),
+    extras_require={
+        'async': ['aiohttp'],
+        'parquet': ['pyarrow'],
+    },
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
 )
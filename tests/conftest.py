@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from qed.data import query, EnrichrServer, set_base_url
+from qed.data import cache as cache_module
+from qed.data.structure import geneset
+
+
+
+
+# Shared fixtures of the test suite. Generators are seeded, so tests are reproducible.
+
+def _response(database, n_rows, seed) :
+
+    """ EnrichR 'enrich' response of 'n_rows' terms of 'database' """
+
+    rng = np.random.default_rng(seed)
+    genes = np.array([f'GENE{i}' for i in range(2000)], dtype=object)
+
+    terms = rng.choice(2 * n_rows, n_rows, replace=False)
+    pvalues = np.sort(rng.random(n_rows) ** 4)
+    odds = rng.gamma(2.0, 2.0, n_rows)
+    overlaps = rng.integers(1, 20, n_rows)
+
+    rows = [[rank + 1,
+             f'{database} term {term} (GO:{term:07d})',
+             float(p),
+             float(o),
+             float(-np.log(p) * o),
+             genes[rng.choice(len(genes), k, replace=False)].tolist(),
+             float(min(p * n_rows / (rank + 1), 1.0)),
+             0,
+             0] for rank, (term, p, o, k) in enumerate(zip(terms, pvalues, odds, overlaps))]
+
+    return {database: rows}
+
+
+@pytest.fixture
+def make_results():
+
+    """ Factory of genesets with 'n_libraries' result dataframes of 'n_rows' rows each, as returned by get_enrichment_dataframes """
+
+    def make(n_genesets, n_libraries, n_rows, seed=0) :
+
+        rng = np.random.default_rng(seed)
+        genes = [f'GENE{i}' for i in range(20000)]
+        setlist = []
+
+        for i in range(n_genesets):
+            gs = geneset(name=f'Set{i}', genes=[genes[k] for k in rng.choice(len(genes), 200, replace=False)])
+            dblist = [f'Library{j}' for j in range(n_libraries)]
+            dfs = [query.to_dataframe(_response(database, n_rows, seed + i * n_libraries + j), database, 'Celltype', gs.name)
+                   for j, database in enumerate(dblist)]
+
+            setlist.append(gs.with_GO(dfs, database=dblist, annot_colname='Celltype', annot=gs.name))
+
+        return setlist
+
+    return make
+
+
+
+
+@pytest.fixture
+def library_dir(tmp_path):
+
+    """ Directory of two GMT libraries, 'LibA' and 'LibB', of 50 terms of 30 genes among G0..G499 """
+
+    rng = np.random.default_rng(0)
+    genes = [f'G{i}' for i in range(500)]
+
+    for library in ['LibA', 'LibB']:
+        with open(tmp_path / f'{library}.gmt', 'w') as f:
+            for t in range(50):
+                f.write(f'{library}_term{t}\t\t' + '\t'.join(rng.choice(genes, 30, replace=False)) + '\n')
+
+    return str(tmp_path)
+
+
+@pytest.fixture
+def genesets():
+
+    rng = np.random.default_rng(1)
+    genes = [f'G{i}' for i in range(500)]
+
+    return [geneset(name=f'Set{i}', genes=list(rng.choice(genes, 50, replace=False))) for i in range(4)]
+
+
+@pytest.fixture
+def enrichr(library_dir):
+
+    """ Start a local EnrichR server on 'library_dir' with the given options and point queries at it """
+
+    def start(**kwargs) :
+        server = EnrichrServer(library_dir, **kwargs).start()
+        set_base_url(server.enrichr_url, server.speedrichr_url)
+        servers.append(server)
+        return server
+
+    servers = []
+
+    yield start
+
+    set_base_url()
+
+    for server in servers:
+        server.stop()
+
+
+
+
+class _Clock:
+
+    def __init__(self):
+
+        self.now = 1000.0
+
+    def time(self) :
+
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    """ Clock of qed.data.cache, moved forward by adding to 'now' """
+
+    clock = _Clock()
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(time=clock.time))
+
+    return clock
@@ -0,0 +1,29 @@
+import os
+
+import pandas as pd
+
+from qed.data import merge_df
+from qed.pl import save_heatmaps
+from qed.pl.batch import _file_names
+
+
+
+
+def test_file_names_are_unique():
+
+    names = _file_names(['a/b', 'a_b', 'A_B', 'a b', 'KEGG'], 'png')
+
+    assert names == {'a/b': 'a_b.png', 'a_b': 'a_b_2.png', 'A_B': 'A_B_3.png', 'a b': 'a_b_4.png', 'KEGG': 'KEGG.png'}
+
+
+
+
+def test_colliding_facets_are_all_saved(tmp_path, make_results):
+
+    df = merge_df(make_results(3, 1, 30))
+    df = pd.concat([df.assign(Database='Lib/A'), df.assign(Database='Lib_A')], ignore_index=True)
+
+    paths = save_heatmaps(df, str(tmp_path), 5, 'Celltype', n_jobs=1)
+
+    assert len(set(paths.values())) == 2
+    assert all(os.path.exists(path) for path in paths.values())
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from qed.data.cache import EnrichrCache
+
+
+
+
+@pytest.fixture
+def cache(tmp_path):
+
+    return EnrichrCache(str(tmp_path / 'cache.sqlite'))
+
+
+def _rows(seed, n=50) :
+
+    # Random strings, so entries compress to about the same size
+    rng = np.random.default_rng(seed)
+
+    return [[i, ''.join(rng.choice(list('ACGT'), 40)), float(rng.random())] for i in range(n)]
+
+
+
+
+def test_key_is_stable():
+
+    # Keys of existing cache files: changing them would drop every entry
+    assert EnrichrCache.make_key(['B', 'A'], 'KEGG_2021_Human') == \
+        'b2f06d92cbc0b326bc42c7762b947c7ca7c2f6caf0f210354d47da4cb176a18c'
+    assert EnrichrCache.make_key(['B', 'A'], 'KEGG_2021_Human', ['C', 'A', 'B']) == \
+        '3e7c4f0a86379dfbd2ddf011cbff7b448702d57ec6f608463415f803633cd504'
+
+    # Gene order does not matter, database, background and source do
+    key = EnrichrCache.make_key(['A', 'B'], 'KEGG_2021_Human')
+
+    assert EnrichrCache.make_key(['B', 'A'], 'KEGG_2021_Human', source=None) == key
+    assert len({key,
+                EnrichrCache.make_key(['A', 'B'], 'GO_Biological_Process_2023'),
+                EnrichrCache.make_key(['A', 'B'], 'KEGG_2021_Human', ['A', 'B']),
+                EnrichrCache.make_key(['A', 'B'], 'KEGG_2021_Human', source='http://127.0.0.1:8000'),
+                EnrichrCache.make_key(['A', 'B'], 'KEGG_2021_Human', source='http://127.0.0.1:8001')}) == 5
+
+
+def test_get_set_and_hit_miss_counts(cache):
+
+    key = cache.make_key(['A'], 'Lib')
+
+    assert cache.get(key) is None
+
+    cache.set(key, _rows(0), 'Lib')
+
+    assert cache.get(key) == _rows(0)
+    assert cache.get(key) == _rows(0)
+    assert cache.stats() == {'hits': 2, 'misses': 1}
+    assert cache.info()['entries'] == 1
+
+
+def test_disabled_cache_stores_nothing(cache):
+
+    cache.enabled = False
+    key = cache.make_key(['A'], 'Lib')
+
+    cache.set(key, _rows(0), 'Lib')
+
+    assert cache.get(key) is None
+    assert cache.stats() == {'hits': 0, 'misses': 0}
+
+    cache.enabled = True
+
+    assert cache.get(key) is None
+
+
+def test_ttl_expiry(cache, clock):
+
+    cache.ttl = 60
+    key = cache.make_key(['A'], 'Lib')
+    cache.set(key, _rows(0), 'Lib')
+
+    clock.now += 59
+    assert cache.get(key) == _rows(0)
+
+    clock.now += 2
+    assert cache.get(key) is None
+    assert cache.info()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(cache, clock):
+
+    keys = [cache.make_key([gene], 'Lib') for gene in 'ABC']
+
+    cache.set(keys[0], _rows(0), 'Lib')
+    size = cache.info()['size_bytes']
+
+    # Room for two entries
+    cache.max_bytes = int(2.5 * size)
+
+    clock.now += 1
+    cache.set(keys[1], _rows(1), 'Lib')
+
+    # 'A' is now used more recently than 'B'
+    clock.now += 1
+    cache.get(keys[0])
+
+    clock.now += 1
+    cache.set(keys[2], _rows(2), 'Lib')
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+    assert cache.info()['size_bytes'] <= cache.max_bytes
+
+
+def test_clear_database(cache):
+
+    for database in ['LibA', 'LibB']:
+        for gene in 'AB':
+            cache.set(cache.make_key([gene], database), _rows(0), database)
+
+    cache.set_upload('background', 'id')
+    cache.get(cache.make_key(['A'], 'LibA'))
+
+    cache.clear('LibA')
+
+    assert cache.info()['databases'] == {'LibB': 2}
+    assert cache.get(cache.make_key(['A'], 'LibA')) is None
+    assert cache.get(cache.make_key(['A'], 'LibB')) is not None
+    assert cache.get_upload('background') == 'id'
+
+    # Counts restart at clear
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+    cache.clear()
+
+    assert cache.info()['entries'] == 0
+    assert cache.get_upload('background') is None
@@ -0,0 +1,145 @@
+import matplotlib
+import numpy as np
+import pytest
+
+from qed.data import merge_df
+from qed.pl import heatmap, clear_linkage_cache
+from qed.pl import cluster
+from qed.pl.cluster import leaf_order
+
+
+matplotlib.use('Agg')
+
+
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+
+    clear_linkage_cache()
+    yield
+    clear_linkage_cache()
+
+
+@pytest.fixture
+def linkages(monkeypatch):
+
+    """ Number of rows of each matrix given to scipy's linkage """
+
+    from scipy.cluster import hierarchy
+
+    calls = []
+    linkage = hierarchy.linkage
+
+    def record(matrix, *args, **kwargs) :
+        calls.append(len(matrix))
+        return linkage(matrix, *args, **kwargs)
+
+    monkeypatch.setattr(hierarchy, 'linkage', record)
+
+    return calls
+
+
+def _clusters(n_per_cluster, n_features=5, seed=0) :
+
+    # Three well separated groups of rows, labelled 0, 1, 2
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0.0] * n_features, [10.0] * n_features, [-10.0] * n_features])
+    labels = rng.permutation(np.repeat([0, 1, 2], n_per_cluster))
+
+    return centers[labels] + rng.normal(size=(len(labels), n_features)), labels
+
+
+
+
+def test_cache_hits_and_misses(linkages):
+
+    matrix = np.random.default_rng(0).random((20, 4))
+
+    order = leaf_order(matrix)
+
+    assert leaf_order(matrix.copy()) is order
+    assert linkages == [20]
+
+    # Other content, method or metric
+    leaf_order(matrix + 1)
+    leaf_order(matrix, method='complete')
+    leaf_order(matrix, metric='cityblock')
+
+    assert len(linkages) == 4
+
+    # Not cached
+    assert np.array_equal(leaf_order(matrix, cache=False), order)
+    leaf_order(matrix, cache=False)
+
+    assert len(linkages) == 6
+
+
+def test_least_recently_used_orders_are_evicted(linkages, monkeypatch):
+
+    monkeypatch.setattr(cluster, 'CACHE_SIZE', 2)
+    matrices = [np.random.default_rng(seed).random((10, 3)) for seed in range(3)]
+
+    leaf_order(matrices[0])
+    leaf_order(matrices[1])
+    leaf_order(matrices[0])
+    leaf_order(matrices[2])
+
+    assert len(linkages) == 3
+
+    # matrices[1] was evicted, matrices[0] was used more recently
+    leaf_order(matrices[0])
+    assert len(linkages) == 3
+
+    leaf_order(matrices[1])
+    assert len(linkages) == 4
+
+
+@pytest.mark.parametrize('cluster_rows, cluster_columns, n_linkages', [
+    (True, True, 2), (True, False, 1), (False, True, 1), (False, False, 0)])
+def test_heatmap_computes_linkage_of_clustered_axes_only(linkages, make_results, cluster_rows, cluster_columns, n_linkages):
+
+    import matplotlib.pyplot as plt
+
+    df = merge_df(make_results(3, 1, 30))
+    fig, ax = plt.subplots()
+
+    heatmap(df, 5, 'Celltype', cluster_rows=cluster_rows, cluster_columns=cluster_columns, ax=ax)
+    plt.close(fig)
+
+    assert len(linkages) == n_linkages
+
+
+def test_large_matrix_clusters_a_sample(linkages, monkeypatch):
+
+    monkeypatch.setattr(cluster, 'LARGE_MATRIX_ROWS', 50)
+    monkeypatch.setattr(cluster, 'ASSIGN_CHUNK_ROWS', 7)
+
+    matrix, labels = _clusters(100)
+
+    order = leaf_order(matrix, cache=False)
+
+    assert sorted(order.tolist()) == list(range(len(matrix)))
+    assert linkages == [50]
+
+    # Each group is contiguous in the order
+    assert (np.diff(labels[order]) != 0).sum() == 2
+
+    # Same sample, same order
+    assert np.array_equal(leaf_order(matrix, cache=False), order)
+
+
+def test_large_matrix_of_few_distinct_rows(linkages, monkeypatch):
+
+    monkeypatch.setattr(cluster, 'LARGE_MATRIX_ROWS', 50)
+
+    distinct, labels = _clusters(10)
+    rows = np.random.default_rng(1).integers(0, len(distinct), 200)
+
+    order = leaf_order(distinct[rows], cache=False)
+
+    # Identical rows are merged before clustering, and stay together
+    assert linkages == [30]
+    assert sorted(order.tolist()) == list(range(200))
+    assert (np.diff(rows[order]) != 0).sum() == len(np.unique(rows)) - 1
+    assert (np.diff(labels[rows[order]]) != 0).sum() == 2
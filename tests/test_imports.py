@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+import pytest
+
+import qed.data
+import qed.pl
+
+
+
+
+def test_submodules_are_attributes_of_the_package():
+
+    from qed.data import structure, query
+    from qed.pl import plot
+
+    assert qed.data.structure is structure
+    assert qed.data.query is query
+    assert qed.pl.plot is plot
+
+
+def test_submodule_attribute_after_plain_import():
+
+    # Fresh interpreter, so no submodule is already in sys.modules
+    code = 'import qed.data, qed.pl; qed.data.structure.merge_df; qed.data.query.get_enrichment_dataframes; qed.pl.plot.heatmap'
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def test_unknown_attribute_raises_attribute_error():
+
+    with pytest.raises(AttributeError):
+        qed.data.no_such_name
+
+    with pytest.raises(AttributeError):
+        qed.pl.no_such_name
@@ -0,0 +1,107 @@
+import gzip
+
+import numpy as np
+import pytest
+from scipy.stats import fisher_exact
+
+from qed.data.local import read_gmt_library, enrich
+
+
+GMT = ('TermA\t\tG1\tG2\tG3\tG4\tG5\tG6\n'
+       'TermB\tdescription\tG1\tG2\tG7\tG8\tG9\tG10\tG11\tG12\n'
+       'TermC\t\tg3,1.0\tG13\tG14\tG15\n'
+       'TermD\t\tG16\tG17\tG18\n'
+       'TermE\t\tG1\tG2\tG3\tG13\tG20\n')
+
+QUERY = ['G1', 'G2', 'g3', 'G13', 'G99']
+
+N = 100
+
+
+
+
+@pytest.fixture
+def library(tmp_path):
+
+    file_path = tmp_path / 'Lib.gmt'
+    file_path.write_text(GMT)
+
+    return read_gmt_library(str(file_path))
+
+
+def _reference(library, query, N) :
+
+    """ Statistics of each term of 'library' with at least one query gene, computed term by term """
+
+    query = {gene.upper() for gene in query}
+    rows = {}
+
+    for i, term in enumerate(library.terms):
+        members = set(library.genes[library.membership[i].indices])
+        k = len(members & query)
+
+        if k == 0:
+            continue
+
+        table = [[k, len(members) - k], [len(query) - k, N - len(members) - len(query) + k]]
+        odds_ratio, pvalue = fisher_exact(table, alternative='greater')
+        rows[term] = {'P-value': pvalue, 'Odds ratio': odds_ratio, 'Overlap': members & query}
+
+    # Benjamini-Hochberg, from its definition
+    pvalues = {term: row['P-value'] for term, row in rows.items()}
+    ranked = sorted(pvalues, key=pvalues.get)
+
+    for term in rows:
+        rows[term]['Adjusted p-value'] = min(1, min(pvalues[other] * len(ranked) / (r + 1)
+                                                    for r, other in enumerate(ranked) if r >= ranked.index(term)))
+
+    return rows
+
+
+
+
+def test_read_gmt_library(library, tmp_path):
+
+    assert library.name == 'Lib'
+    assert library.terms.tolist() == ['TermA', 'TermB', 'TermC', 'TermD', 'TermE']
+
+    # Weights are dropped and genes upper-cased
+    assert set(library.genes[library.membership[2].indices]) == {'G3', 'G13', 'G14', 'G15'}
+    assert library.term_sizes.tolist() == [6, 8, 4, 3, 5]
+
+    with gzip.open(tmp_path / 'Lib.gmt.gz', 'wt') as f:
+        f.write(GMT)
+
+    gzipped = read_gmt_library(str(tmp_path / 'Lib.gmt.gz'), name='Other')
+
+    assert gzipped.name == 'Other'
+    assert (gzipped.membership != library.membership).nnz == 0
+
+
+def test_enrich_matches_fisher_exact(library):
+
+    rows = enrich(QUERY, library, background_size=N)['Lib']
+    reference = _reference(library, QUERY, N)
+
+    # TermD has no query gene
+    assert sorted(row[1] for row in rows) == sorted(reference) == ['TermA', 'TermB', 'TermC', 'TermE']
+
+    for rank, term, pvalue, odds_ratio, combined_score, overlapping, adjusted, _, _ in rows:
+        expected = reference[term]
+
+        assert pvalue == pytest.approx(expected['P-value'], rel=1e-9)
+        assert odds_ratio == pytest.approx(expected['Odds ratio'], rel=1e-9)
+        assert combined_score == pytest.approx(-np.log(expected['P-value']) * expected['Odds ratio'], rel=1e-9)
+        assert adjusted == pytest.approx(expected['Adjusted p-value'], rel=1e-9)
+        assert set(overlapping) == expected['Overlap']
+
+    # Ranked by increasing p-value
+    assert [row[0] for row in rows] == [1, 2, 3, 4]
+    assert [row[2] for row in rows] == sorted(row[2] for row in rows)
+    assert rows[0][1] == 'TermE'
+
+
+def test_enrich_without_overlap(library):
+
+    assert enrich(['G98', 'G99'], library, background_size=N) == {'Lib': []}
+    assert enrich([], library, background_size=N) == {'Lib': []}
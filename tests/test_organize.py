@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from qed.pl import select_top_n
+
+
+# Randomized frames per case
+N_FRAMES = 25
+
+
+
+
+# Implementation before vectorization, kept as reference.
+# 'refill_by_order' fixes its refill of 'Odds ratio'/'Combined score', which always took the smallest values.
+
+def _select_top_n_baseline(df: pd.DataFrame,
+                           n: int,
+                           group_by: str,
+                           order_by: str = 'Adjusted p-value',
+                           allow_duplicate: bool = False,
+                           refill_by_order: bool = False):
+
+    ascending = order_by in ['Adjusted p-value', 'P-value']
+
+    df_copy = df.drop(columns=['Overlapping genes'], errors='ignore')
+    df_copy = df_copy.sort_values([group_by, order_by], ascending=ascending)
+    df_top_n = df_copy.groupby(group_by).head(n)
+
+    if not allow_duplicate :
+
+        while df_top_n['Term'].duplicated().any():
+
+            df_copy = pd.merge(df_copy, df_top_n, indicator=True, how='outer').query('_merge=="left_only"').drop('_merge', axis=1)
+
+            df_top_n = df_top_n.sort_values(order_by, ascending=ascending)
+            mask = df_top_n.duplicated(subset='Term', keep='first')
+
+            deleted_rows = {}
+            for celltype in df_top_n.loc[mask, group_by].unique():
+                deleted_rows[celltype] = (mask & (df_top_n[group_by] == celltype)).sum()
+
+            df_top_n = df_top_n[~mask]
+
+            for celltype, count in deleted_rows.items():
+                candidates = df_copy[df_copy[group_by] == celltype]
+                if refill_by_order and not ascending:
+                    next_terms = candidates.nlargest(count, order_by)
+                else:
+                    next_terms = candidates.nsmallest(count, order_by)
+                df_top_n = pd.concat([df_top_n, next_terms])
+
+    df_top_n = df_top_n.sort_values([group_by, order_by])
+
+    df_subset = pd.DataFrame()
+
+    for _, row in df_top_n.iterrows():
+        df_row_subset = df[(df['Term'] == row['Term']) & (df['Database'] == row['Database'])]
+        df_subset = pd.concat([df_subset, df_row_subset])
+
+    return df_subset.reset_index(drop=True)
+
+
+
+
+def _select_top_n_greedy(df: pd.DataFrame, n: int, group_by: str, order_by: str, allow_duplicate: bool) :
+
+    """ Documented rule: rows in rank order (ties by group, then row), skipping full groups and taken terms """
+
+    ascending = order_by in ['Adjusted p-value', 'P-value']
+
+    ranked = df.reset_index(drop=True).sort_values([order_by, group_by], ascending=[ascending, True], kind='stable')
+
+    selected, counts, terms = [], {}, set()
+
+    for i, row in ranked.iterrows():
+        if counts.get(row[group_by], 0) < n and (allow_duplicate or row['Term'] not in terms):
+            selected.append(i)
+            counts[row[group_by]] = counts.get(row[group_by], 0) + 1
+            terms.add(row['Term'])
+
+    top = df.reset_index(drop=True).loc[selected].sort_values([group_by, order_by], kind='stable')
+
+    return pd.concat([df[(df['Term'] == row['Term']) & (df['Database'] == row['Database'])] for _, row in top.iterrows()],
+                     ignore_index=True)
+
+
+
+
+def _random_frame(seed: int, ties: bool) -> pd.DataFrame:
+
+    """ merge_df-like frame: groups share terms from a common pool, each term belongs to one database """
+
+    rng = np.random.default_rng(seed)
+    n_terms = int(rng.integers(10, 60))
+    databases = rng.choice(['LibA', 'LibB'], n_terms)
+
+    frames = []
+
+    for group in range(int(rng.integers(2, 6))):
+        terms = rng.choice(n_terms, int(rng.integers(3, n_terms)), replace=False)
+        values = rng.integers(0, 4, (len(terms), 4)) / 4 if ties else rng.random((len(terms), 4))
+
+        frames.append(pd.DataFrame({'Term': [f'term{t}' for t in terms],
+                                    'P-value': values[:, 0] / 10,
+                                    'Adjusted p-value': values[:, 1],
+                                    'Odds ratio': values[:, 2] * 100,
+                                    'Combined score': values[:, 3] * 1000,
+                                    'Overlapping genes': [[f'G{t}', f'G{t + 1}'] for t in terms],
+                                    'Database': databases[terms],
+                                    'Celltype': f'Group{group}'}))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+
+
+def _rows(df: pd.DataFrame) -> list:
+
+    return sorted(map(tuple, df.drop(columns=['Overlapping genes']).to_numpy().tolist()))
+
+
+
+
+@pytest.mark.parametrize('allow_duplicate', [False, True])
+@pytest.mark.parametrize('order_by', ['Adjusted p-value', 'P-value', 'Odds ratio', 'Combined score'])
+def test_same_as_baseline(order_by, allow_duplicate):
+
+    # Baseline refill of descending orders differs by design, see test_refill_of_descending_order
+    refill_by_order = order_by in ['Odds ratio', 'Combined score']
+
+    for seed in range(N_FRAMES):
+        df = _random_frame(seed, ties=False)
+        n = int(np.random.default_rng(seed).integers(1, 8))
+
+        expected = _select_top_n_baseline(df, n, 'Celltype', order_by, allow_duplicate, refill_by_order)
+        result = select_top_n(df, n, 'Celltype', order_by, allow_duplicate)
+
+        pd.testing.assert_frame_equal(result, expected)
+
+
+
+
+@pytest.mark.parametrize('order_by', ['Adjusted p-value', 'P-value', 'Odds ratio', 'Combined score'])
+def test_same_rows_as_baseline_with_ties(order_by):
+
+    # Without deduplication the baseline is deterministic with ties, but the order of tied rows
+    # within a group depended on its sort, so only selected rows are compared
+    for seed in range(N_FRAMES):
+        df = _random_frame(seed, ties=True)
+        n = int(np.random.default_rng(seed).integers(1, 8))
+
+        expected = _select_top_n_baseline(df, n, 'Celltype', order_by, allow_duplicate=True)
+        result = select_top_n(df, n, 'Celltype', order_by, allow_duplicate=True)
+
+        assert _rows(result) == _rows(expected)
+
+
+
+
+@pytest.mark.parametrize('allow_duplicate', [False, True])
+@pytest.mark.parametrize('order_by', ['Adjusted p-value', 'P-value', 'Odds ratio', 'Combined score'])
+def test_ties_follow_rank_order(order_by, allow_duplicate):
+
+    # With deduplication, the baseline kept an arbitrary one of tied duplicates (unstable sort).
+    # Ties are now broken by group, then by row, as in a greedy pass over rows in rank order.
+    for seed in range(N_FRAMES):
+        df = _random_frame(seed, ties=True)
+        n = int(np.random.default_rng(seed).integers(1, 8))
+
+        expected = _select_top_n_greedy(df, n, 'Celltype', order_by, allow_duplicate)
+        result = select_top_n(df, n, 'Celltype', order_by, allow_duplicate)
+
+        pd.testing.assert_frame_equal(result, expected)
+
+
+
+
+def test_refill_of_descending_order():
+
+    # 'shared' is top of both groups and kept by Group0 (higher score). Group1 refills with its next highest term.
+    df = pd.DataFrame({'Term': ['shared', 'a', 'shared', 'high', 'low'],
+                       'Odds ratio': [10.0, 5.0, 9.0, 8.0, 1.0],
+                       'Database': 'LibA',
+                       'Celltype': ['Group0', 'Group0', 'Group1', 'Group1', 'Group1']})
+
+    # All rows of selected terms are returned, so 'shared' also comes with its Group1 row
+    result = select_top_n(df, 1, 'Celltype', 'Odds ratio')
+    assert result['Term'].tolist() == ['shared', 'shared', 'high']
+
+    # Baseline refilled with the smallest value
+    baseline = _select_top_n_baseline(df, 1, 'Celltype', 'Odds ratio')
+    assert baseline['Term'].tolist() == ['shared', 'shared', 'low']
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from qed.data import OverlappingGenes, GeneVocabulary
+
+
+LISTS = [['INS', 'GCG'], [], ['SST', 'INS', 'PPY'], ['GCG'], []]
+
+
+
+
+@pytest.fixture
+def overlaps():
+
+    return OverlappingGenes.from_lists(LISTS)
+
+
+
+
+def test_vocabulary_encode_decode():
+
+    vocabulary = GeneVocabulary(['A', 'B'])
+
+    ids = vocabulary.encode(np.array(['C', 'A', 'C', 'D'], dtype=object))
+
+    assert ids.tolist() == [2, 0, 2, 3]
+    assert vocabulary.decode(ids).tolist() == ['C', 'A', 'C', 'D']
+    assert vocabulary.genes.tolist() == ['A', 'B', 'C', 'D']
+    assert 'D' in vocabulary and 'E' not in vocabulary
+    assert vocabulary.get('E') == -1
+
+
+def test_round_trip(overlaps):
+
+    assert len(overlaps) == len(LISTS)
+    assert overlaps.to_lists() == LISTS
+    assert [overlaps[i] for i in range(len(LISTS))] == LISTS
+    assert overlaps.counts.tolist() == [2, 0, 3, 1, 0]
+    assert overlaps.matrix.sum(axis=1).ravel().tolist() == [[2, 0, 3, 1, 0]]
+
+
+def test_round_trip_of_empty_inputs():
+
+    empty = OverlappingGenes.from_lists([])
+
+    assert len(empty) == 0
+    assert len(empty.vocabulary) == 0
+    assert empty.to_lists() == []
+    assert empty.rows_with_gene('INS').tolist() == []
+    assert empty.restrict(['INS']).to_lists() == []
+
+    # Rows without genes, empty vocabulary
+    blank = OverlappingGenes.from_lists([[], []])
+
+    assert len(blank.vocabulary) == 0
+    assert blank.to_lists() == [[], []]
+    assert blank.overlap_counts(['INS']).tolist() == [0, 0]
+    assert blank.take([1, 0, 1]).to_lists() == [[], [], []]
+
+
+def test_shared_vocabulary():
+
+    vocabulary = GeneVocabulary()
+    first = OverlappingGenes.from_lists([['A', 'B']], vocabulary)
+    second = OverlappingGenes.from_lists([['B', 'C']], vocabulary)
+
+    assert vocabulary.genes.tolist() == ['A', 'B', 'C']
+    assert second.indices.tolist() == [1, 2]
+    assert first.vocabulary is second.vocabulary
+
+
+def test_take(overlaps):
+
+    rows = [2, 0, 1, 2, 4]
+
+    assert overlaps.take(rows).to_lists() == [LISTS[i] for i in rows]
+    assert overlaps.take([]).to_lists() == []
+    assert overlaps.take(np.array([3])).to_lists() == [['GCG']]
+
+
+def test_restrict_and_overlap_counts(overlaps):
+
+    # Unknown genes are ignored, order of each row is kept
+    restricted = overlaps.restrict(['PPY', 'INS', 'UNKNOWN'])
+
+    assert restricted.to_lists() == [['INS'], [], ['INS', 'PPY'], [], []]
+    assert restricted.vocabulary is overlaps.vocabulary
+
+    assert overlaps.overlap_counts(['GCG']).tolist() == [1, 0, 0, 1, 0]
+    assert overlaps.overlap_counts([]).tolist() == [0, 0, 0, 0, 0]
+
+
+def test_rows_with_gene(overlaps):
+
+    assert overlaps.rows_with_gene('INS').tolist() == [0, 2]
+    assert overlaps.rows_with_gene('GCG').tolist() == [0, 3]
+    assert overlaps.rows_with_gene('UNKNOWN').tolist() == []
+
+
+def test_concat(overlaps):
+
+    other = OverlappingGenes.from_lists([[], ['PPY', 'NEW']], overlaps.vocabulary)
+    empty = OverlappingGenes.from_lists([], overlaps.vocabulary)
+
+    merged = OverlappingGenes.concat([overlaps, empty, other])
+
+    assert merged.to_lists() == LISTS + [[], ['PPY', 'NEW']]
+    assert merged.rows_with_gene('PPY').tolist() == [2, 6]
+
+    with pytest.raises(ValueError):
+        OverlappingGenes.concat([overlaps, OverlappingGenes.from_lists([['INS']])])
@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from qed.data import merge_df, save_results, load_results
+
+
+pytest.importorskip('pyarrow')
+
+
+
+
+@pytest.mark.parametrize('term_suffix', [True, False])
+@pytest.mark.parametrize('format', ['parquet', 'feather'])
+def test_round_trip(tmp_path, make_results, term_suffix, format):
+
+    df = merge_df(make_results(3, 2, 20), term_suffix=term_suffix)
+
+    save_results(df, str(tmp_path / 'results'), format=format)
+    loaded = load_results(str(tmp_path / 'results'))
+
+    assert list(loaded.columns) == list(df.columns)
+    assert ('Term ID' in loaded.columns) != term_suffix
+
+    # Partitions come back grouped by Database, then geneset
+    key = ['Database', 'Celltype', 'Rank']
+    expected = df.astype({'Term': str}).sort_values(key).reset_index(drop=True)
+    loaded = loaded.astype({'Term': str}).sort_values(key).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(loaded, expected, check_dtype=False, check_categorical=False)
@@ -0,0 +1,243 @@
+import logging
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+from qed.data import ResultStore, get_enrichment_dataframes, get_enrichment_dataframes_with_background, merge_df
+from qed.data import iter_enrichment_dataframes
+from qed.data import cache as cache_module
+from qed.data.cache import EnrichrCache, DEFAULT_UPLOAD_TTL
+from qed.data.query import EnrichrError, _UploadMemo, _call_with_retry
+from qed.data.structure import geneset
+
+
+
+
+def test_recovered_failures_are_not_logged_as_errors(enrichr, genesets, caplog):
+
+    server = enrichr(error_rate=0.3, seed=0)
+
+    with caplog.at_level(logging.DEBUG, logger='qed.data.query'):
+        results = get_enrichment_dataframes(genesets, ['LibA', 'LibB'], 'Celltype', 
+                                            handle_error=True, max_iter=20, backoff=0.001, cache=False)
+
+    assert all(len(gs.GO) == 2 for gs in results)
+    assert sum(count for key, count in server.stats().items() if key.endswith('500')) > 0
+
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    assert 'Nothing to re-request' not in caplog.text
+    assert 'recovered' in caplog.text
+
+
+
+
+def test_final_failures_are_logged_as_errors(enrichr, genesets, caplog):
+
+    enrichr(error_rate=1.0)
+
+    with caplog.at_level(logging.INFO, logger='qed.data.query'):
+        results = get_enrichment_dataframes(genesets, ['LibA'], 'Celltype', 
+                                            handle_error=True, max_iter=1, backoff=0.001, cache=False)
+
+    assert all(len(gs.GO) == 0 for gs in results)
+    assert len([record for record in caplog.records if record.levelno == logging.ERROR]) == len(genesets)
+    assert f'{len(genesets)} requests failed after up to 1 re-requests' in caplog.text
+
+
+
+
+def test_store_is_filled_as_requests_complete(enrichr, genesets):
+
+    # Random latency, so requests complete out of order
+    enrichr(latency=(0, 0.02), seed=0)
+    store = ResultStore()
+
+    results = get_enrichment_dataframes(genesets, ['LibA', 'LibB'], 'Celltype', n_jobs=8, cache=False, store=store)
+
+    assert len(store) == sum(len(go) for gs in results for go in gs.GO)
+    pd.testing.assert_frame_equal(merge_df(store), merge_df(results))
+
+
+
+
+def test_permanent_failures_are_not_retried(enrichr, genesets, caplog):
+
+    server = enrichr()
+    start = time.perf_counter()
+
+    with caplog.at_level(logging.ERROR, logger='qed.data.query'):
+        results = get_enrichment_dataframes(genesets[:1], ['NoSuchLibrary'], 'Celltype', 
+                                            handle_error=True, max_iter=10, backoff=10, cache=False)
+
+    # Unknown library is answered with 404 once, without backoff
+    assert time.perf_counter() - start < 5
+    assert server.stats()['enrich 404'] == 1
+    assert results[0].GO == []
+    assert 'NoSuchLibrary' in caplog.text
+
+
+def test_call_with_retry_retries_transient_errors_only():
+
+    def fail(errors) :
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return 'ok'
+
+    transient = [EnrichrError('rate limited', 429), EnrichrError('unavailable', 503), 
+                 requests.ConnectionError('reset'), requests.Timeout('timeout')]
+    calls = []
+
+    assert _call_with_retry(fail, (transient,), max_retry=10, backoff=0) == 'ok'
+    assert len(calls) == 5
+
+    for error in [EnrichrError('not found', 404), ValueError('invalid library name'), KeyError('userListId')]:
+        calls = []
+
+        with pytest.raises(type(error)):
+            _call_with_retry(fail, ([error],), max_retry=10, backoff=0)
+
+        assert len(calls) == 1
+
+
+
+
+def test_identical_gene_lists_share_one_upload(enrichr, genesets):
+
+    server = enrichr()
+
+    # Same genes in another order under another name
+    copies = [geneset(name=f'Copy{i}', genes=gs.genes[::-1]) for i, gs in enumerate(genesets[:2])]
+
+    results = get_enrichment_dataframes(genesets[:2] + copies, ['LibA', 'LibB'], 'Celltype', n_jobs=8, cache=False)
+
+    assert all(len(gs.GO) == 2 for gs in results)
+    assert server.stats()['add_list 200'] == 2
+    assert server.stats()['enrich 200'] == 8
+
+
+def test_failed_upload_is_not_memoized():
+
+    calls = []
+
+    def upload(genes) :
+        calls.append(genes)
+        if len(calls) == 1:
+            raise EnrichrError('unavailable', 503)
+        return {'userListId': len(calls)}
+
+    uploads = _UploadMemo(upload)
+
+    with pytest.raises(EnrichrError):
+        uploads.get(['A', 'B'])
+
+    assert len(uploads) == 0
+    assert uploads.get(['B', 'A']) == {'userListId': 2}
+    assert uploads.get(['A', 'B']) == {'userListId': 2}
+    assert len(calls) == 2
+
+
+def test_failed_upload_is_retried(enrichr, genesets):
+
+    server = enrichr(error_rate=0.5, seed=1)
+
+    # One distinct list: every task waits on the same upload
+    same = [geneset(name=f'Same{i}', genes=genesets[0].genes) for i in range(4)]
+
+    results = get_enrichment_dataframes(same, ['LibA'], 'Celltype', n_jobs=1, cache=False,
+                                        handle_error=True, max_iter=20, backoff=0.001)
+
+    assert all(len(gs.GO) == 1 for gs in results)
+    assert server.stats()['add_list 500'] > 0
+    assert server.stats()['add_list 200'] == 1
+
+
+
+
+@pytest.fixture
+def background():
+
+    return [f'G{i}' for i in range(400)]
+
+
+def test_background_is_uploaded_once_per_batch(enrichr, genesets, background):
+
+    server = enrichr()
+
+    for _ in range(2):
+        results = get_enrichment_dataframes_with_background(genesets, background, ['LibA', 'LibB'], 'Celltype', 
+                                                            n_jobs=8, cache=False)
+
+        assert all(len(gs.GO) == 2 for gs in results)
+
+    # Not persisted: once per call
+    assert server.stats()['add_background 200'] == 2
+    assert server.stats()['background_enrich 200'] == 2 * len(genesets) * 2
+
+
+def test_persisted_background_is_reused_across_runs(enrichr, genesets, background, tmp_path, clock, monkeypatch):
+
+    monkeypatch.setattr(cache_module, '_CACHE', EnrichrCache(str(tmp_path / 'cache.sqlite')))
+    server = enrichr()
+
+    def run() :
+        results = get_enrichment_dataframes_with_background(genesets, background, ['LibA'], 'Celltype', 
+                                                            cache=False, persist_background=True)
+        assert all(len(gs.GO) == 1 for gs in results)
+
+        return server.stats()['add_background 200']
+
+    assert run() == 1
+
+    clock.now += 60 * 60
+    assert run() == 1
+
+    # EnrichR keeps backgrounds for a day
+    clock.now += DEFAULT_UPLOAD_TTL
+    assert run() == 2
+    assert run() == 2
+
+
+
+
+def test_iter_calls_callback_before_each_result(enrichr, genesets):
+
+    enrichr()
+    seen = []
+
+    results = list(iter_enrichment_dataframes(genesets, ['LibA', 'LibB'], 'Celltype', cache=False,
+                                              callback=lambda name, database, df: seen.append((name, database, len(df)))))
+
+    assert seen == [(name, database, len(df)) for name, database, df in results]
+    assert sorted((name, database) for name, database, _ in results) == \
+        sorted((gs.name, database) for gs in genesets for database in ['LibA', 'LibB'])
+
+
+def test_iter_holds_back_requests_for_a_slow_consumer(enrichr, genesets):
+
+    server = enrichr()
+    results = iter_enrichment_dataframes(genesets, ['LibA', 'LibB'], 'Celltype', n_jobs=2, max_pending=2, cache=False)
+
+    next(results)
+    time.sleep(0.3)
+
+    # Nothing new is submitted until the consumer asks for the next result
+    assert server.stats()['enrich 200'] == 2
+
+    assert len(list(results)) == 2 * len(genesets) - 1
+    assert server.stats()['enrich 200'] == 2 * len(genesets)
+
+
+def test_iter_cancels_pending_requests_when_stopped_early(enrichr, genesets):
+
+    server = enrichr(latency=0.1)
+    results = iter_enrichment_dataframes(genesets, ['LibA', 'LibB'], 'Celltype', n_jobs=1, max_pending=4, cache=False)
+
+    next(results)
+    results.close()
+    time.sleep(0.5)
+
+    # The request running at close completes, queued ones are cancelled
+    assert server.stats()['enrich 200'] <= 2
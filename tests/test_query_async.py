@@ -0,0 +1,71 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from qed.data import ResultStore, configure_session, merge_df
+from qed.data import get_enrichment_dataframes, get_enrichment_dataframes_async
+
+
+aiohttp = pytest.importorskip('aiohttp')
+
+
+
+
+@pytest.fixture
+def server(enrichr):
+
+    return enrichr(latency=(0, 0.02), seed=0)
+
+
+
+
+def test_same_results_as_thread_pool(server, genesets):
+
+    store = ResultStore()
+
+    expected = get_enrichment_dataframes(genesets, ['LibA', 'LibB'], 'Celltype', cache=False)
+    results = asyncio.run(get_enrichment_dataframes_async(genesets, ['LibA', 'LibB'], 'Celltype', cache=False, store=store))
+
+    pd.testing.assert_frame_equal(merge_df(results), merge_df(expected))
+    pd.testing.assert_frame_equal(merge_df(store), merge_df(expected))
+
+
+
+
+def test_max_per_host_dict(server, genesets, monkeypatch):
+
+    limits = []
+    connector = aiohttp.TCPConnector
+
+    def record(**kwargs) :
+        limits.append(kwargs['limit_per_host'])
+        return connector(**kwargs)
+
+    monkeypatch.setattr(aiohttp, 'TCPConnector', record)
+
+    try:
+        for max_per_host in [{'127.0.0.1': 2}, {'example.org': 2}, 3]:
+            configure_session(max_per_host=max_per_host)
+            asyncio.run(get_enrichment_dataframes_async(genesets[:1], ['LibA'], 'Celltype', cache=False))
+
+    finally:
+        configure_session()
+
+    # 0 is no limit in aiohttp
+    assert limits == [2, 0, 3]
+
+
+
+
+def test_only_transient_failures_are_retried(enrichr, genesets):
+
+    server = enrichr(error_rate=0.3, seed=0)
+
+    results = asyncio.run(get_enrichment_dataframes_async(genesets, ['LibA', 'NoSuchLibrary'], 'Celltype', cache=False,
+                                                          handle_error=True, max_iter=20, backoff=0.001))
+
+    # Status 500 responses are re-requested, the unknown library is requested once per geneset
+    assert all(len(gs.GO) == 1 for gs in results)
+    assert sum(count for key, count in server.stats().items() if key.endswith('500')) > 0
+    assert server.stats()['enrich 404'] == len(genesets)
@@ -0,0 +1,233 @@
+from types import SimpleNamespace
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qed.data import readscanpy, readseurat, iter_genesets, read_gmt
+
+
+
+
+def _adata(groups, n_genes, seed=0) :
+
+    """ Object with 'uns' of scanpy.tl.rank_genes_groups: record arrays with one field per group """
+
+    rng = np.random.default_rng(seed)
+
+    def records(values, dtype) :
+        return np.rec.fromarrays(values, dtype=[(group, dtype) for group in groups])
+
+    names = [rng.permutation([f'GENE{i}' for i in range(n_genes)]).astype(object) for _ in groups]
+
+    # Few distinct values, so groups have ties, and some NaN scores
+    scores = [np.round(rng.normal(size=n_genes), 1) for _ in groups]
+    for values in scores:
+        values[rng.random(n_genes) < 0.2] = np.nan
+
+    result = {'names': records(names, object),
+              'scores': records(scores, float),
+              'pvals': records([rng.random(n_genes) for _ in groups], float),
+              'pvals_adj': records([rng.random(n_genes) ** 3 for _ in groups], float),
+              'logfoldchanges': records([np.round(rng.normal(1, 1, n_genes), 1) for _ in groups], float)}
+
+    return SimpleNamespace(uns={'rank_genes_groups': result})
+
+
+def _reference(adata, adj_pval_cutoff=0.05, lfc_cutoff=0.5, select_top_n=None, select_order='scores') :
+
+    """ Gene lists of the per-group pandas implementation readscanpy replaced """
+
+    result = adata.uns['rank_genes_groups']
+    lists = {}
+
+    for group in result['names'].dtype.names:
+        df = pd.DataFrame({key: result[key][group] for key in ['names', 'scores', 'pvals', 'pvals_adj', 'logfoldchanges']})
+        df = df[(df['logfoldchanges'] > lfc_cutoff) & (df['pvals_adj'] < adj_pval_cutoff)]
+
+        if select_top_n is not None:
+            df = df.nlargest(select_top_n, select_order)
+
+        if len(df):
+            lists[group] = df['names'].tolist()
+
+    return dict(sorted(lists.items()))
+
+
+
+
+@pytest.mark.parametrize('select_top_n', [None, 1, 5, 20, 200])
+@pytest.mark.parametrize('select_order', ['scores', 'logfoldchanges'])
+def test_readscanpy_matches_nlargest(select_top_n, select_order):
+
+    adata = _adata(['b', 'a', 'c', 'd'], 100)
+
+    setlist = readscanpy(adata, adj_pval_cutoff=0.3, select_top_n=select_top_n, select_order=select_order)
+
+    assert {gs.name: gs.genes for gs in setlist} == _reference(adata, 0.3, 0.5, select_top_n, select_order)
+    assert [gs.name for gs in setlist] == sorted(gs.name for gs in setlist)
+
+
+def test_readscanpy_keeps_nan_scores_as_nlargest():
+
+    adata = _adata(['a'], 4)
+    result = adata.uns['rank_genes_groups']
+
+    result['names']['a'] = ['G0', 'G1', 'G2', 'G3']
+    result['scores']['a'] = [np.nan, 2.0, np.nan, 2.0]
+    result['pvals_adj']['a'] = 0.0
+    result['logfoldchanges']['a'] = 1.0
+
+    # Ties in rank order, then NaN in rank order
+    assert readscanpy(adata, select_top_n=3)[0].genes == ['G1', 'G3', 'G0']
+    assert readscanpy(adata, select_top_n=10)[0].genes == ['G1', 'G3', 'G0', 'G2']
+    assert readscanpy(adata)[0].genes == ['G0', 'G1', 'G2', 'G3']
+
+
+
+
+def _write_markers(file_path, clusters, seed=0) :
+
+    """ FindAllMarkers output written by R's write.csv: row names in a first unnamed column """
+
+    rng = np.random.default_rng(seed)
+    n = len(clusters)
+
+    df = pd.DataFrame({'p_val': rng.random(n),
+                       'avg_log2FC': np.round(rng.normal(0.5, 1, n), 2),
+                       'pct.1': np.round(rng.random(n), 2),
+                       'pct.2': np.round(rng.random(n), 2),
+                       'p_val_adj': rng.random(n) ** 3,
+                       'cluster': clusters,
+                       'gene': [f'GENE{i % 300}' for i in range(n)]},
+                      index=[f'GENE{i % 300}.{i // 300}' for i in range(n)])
+
+    df.to_csv(file_path)
+
+
+def _reference_seurat(file_path, **kwargs) :
+
+    """ Gene lists of reading the whole file at once, as readseurat did before chunked reads """
+
+    df = pd.read_csv(file_path, sep=',', **kwargs)
+    df = df[(df['p_val_adj'] <= 0.05) & (df['avg_log2FC'] >= 0.5) & (df['pct.1'] >= 0.05)]
+
+    return {name: group.tolist() for name, group in df.groupby('cluster')['gene']}
+
+
+
+
+@pytest.mark.parametrize('clusters', [
+    np.repeat(np.arange(10), 100),                                            # int in every chunk
+    np.repeat(np.arange(10), 100).astype(object).tolist()[:900] + ['B'] * 100,  # text in the last chunk only
+    [0] * 250 + [1] * 250 + [2.5] * 250 + [3] * 250,                          # int and float chunks
+], ids=['numeric', 'mixed', 'int-float'])
+def test_readseurat_chunks_match_whole_file(tmp_path, clusters):
+
+    file_path = str(tmp_path / 'markers.csv')
+    _write_markers(file_path, clusters)
+
+    expected = _reference_seurat(file_path)
+
+    for chunksize in [7, 100, 10 ** 6]:
+        setlist = readseurat(file_path, ',', chunksize=chunksize)
+
+        assert {gs.name: gs.genes for gs in setlist} == expected
+        assert [type(gs.name) for gs in setlist] == [type(name) for name in expected]
+
+
+def test_readseurat_ignores_index_col_with_warning(tmp_path):
+
+    file_path = str(tmp_path / 'markers.csv')
+    _write_markers(file_path, np.repeat(np.arange(5), 40))
+
+    with pytest.warns(UserWarning, match='index_col'):
+        setlist = readseurat(file_path, ',', index_col=0, chunksize=9)
+
+    assert {gs.name: gs.genes for gs in setlist} == _reference_seurat(file_path, index_col=0)
+
+
+
+
+GMT = ('SetA\tdescription A\tG1\tG2\tG3\n'
+       'SetB\t\tG4,1.0\tG5,0.5\n'
+       '\tno name\tG6\n'
+       'SetC\thttp://example.org\tG1\tG2\tG3\tG4\tG5\tG6\n'
+       'SetD\t\tG7\t\n')
+
+
+@pytest.fixture
+def gmt(tmp_path):
+
+    file_path = tmp_path / 'library.gmt'
+    file_path.write_text(GMT)
+
+    return str(file_path)
+
+
+
+
+def test_iter_genesets_gmt(gmt):
+
+    genesets = list(iter_genesets(gmt, format='gmt'))
+
+    # Sets without name are skipped, weights dropped, description kept as annotation
+    assert [(gs.name, gs.genes, gs.annotation) for gs in genesets] == [
+        ('SetA', ['G1', 'G2', 'G3'], 'description A'),
+        ('SetB', ['G4', 'G5'], ''),
+        ('SetC', ['G1', 'G2', 'G3', 'G4', 'G5', 'G6'], 'http://example.org'),
+        ('SetD', ['G7'], '')]
+
+    assert [gs.genes for gs in read_gmt(gmt)] == [gs.genes for gs in genesets]
+
+
+def test_iter_genesets_detects_gzip(gmt, tmp_path):
+
+    # Compressed content is detected, whatever the file name
+    for name in ['library.gmt.gz', 'library.txt']:
+        with gzip.open(tmp_path / name, 'wt') as f:
+            f.write(GMT)
+
+        assert [gs.genes for gs in iter_genesets(str(tmp_path / name), format='gmt')] == \
+            [gs.genes for gs in iter_genesets(gmt, format='gmt')]
+
+
+def test_iter_genesets_filters(gmt):
+
+    def names(**kwargs) :
+        return [gs.name for gs in iter_genesets(gmt, format='gmt', **kwargs)]
+
+    assert names(names=['SetC', 'SetA', 'Missing']) == ['SetA', 'SetC']
+    assert names(names=lambda name: name.endswith('B')) == ['SetB']
+    assert names(min_size=2) == ['SetA', 'SetB', 'SetC']
+    assert names(max_size=3) == ['SetA', 'SetB', 'SetD']
+    assert names(min_size=2, max_size=3, names=['SetA', 'SetC']) == ['SetA']
+
+
+def test_iter_genesets_rowside_and_colside(tmp_path):
+
+    (tmp_path / 'rowside.csv').write_text('SetA,G1,G2\nSetB,G3\n')
+    (tmp_path / 'colside.csv').write_text('SetA,SetB\nG1,G3\nG2,\n')
+
+    for format in ['rowside', 'colside']:
+        genesets = iter_genesets(str(tmp_path / f'{format}.csv'), ',', format, names=['SetA'])
+
+        assert [(gs.name, gs.genes) for gs in genesets] == [('SetA', ['G1', 'G2'])]
+
+
+def test_iter_genesets_chunksize(gmt):
+
+    chunks = list(iter_genesets(gmt, format='gmt', chunksize=3))
+
+    assert [[gs.name for gs in chunk] for chunk in chunks] == [['SetA', 'SetB', 'SetC'], ['SetD']]
+    assert list(iter_genesets(gmt, format='gmt', names=[], chunksize=3)) == []
+
+
+def test_iter_genesets_checks_arguments_at_call(gmt):
+
+    with pytest.raises(ValueError):
+        iter_genesets(gmt, format='csv')
+
+    with pytest.raises(ValueError):
+        iter_genesets(gmt, format='gmt', chunksize=0)
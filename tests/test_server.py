@@ -0,0 +1,50 @@
+import pytest
+import requests
+
+from qed.data import EnrichrServer
+from qed.data.local import check_library_name
+
+
+
+
+@pytest.fixture
+def server(tmp_path):
+
+    library_dir = tmp_path / 'libraries'
+    library_dir.mkdir()
+
+    (library_dir / 'LibA.gmt').write_text('TermA\t\tG1\tG2\tG3\n')
+
+    # Outside the library directory, must not be served
+    (tmp_path / 'Secret.gmt').write_text('SecretTerm\t\tG1\tG2\n')
+
+    with EnrichrServer(str(library_dir)) as server:
+        yield server
+
+
+
+
+def test_check_library_name():
+
+    assert check_library_name('GO_Biological_Process_2023') == 'GO_Biological_Process_2023'
+
+    for name in ['', '../Secret', '..', 'a/b', 'a\\b', '/etc/passwd']:
+        with pytest.raises(ValueError):
+            check_library_name(name)
+
+
+
+
+def test_library_names_outside_library_dir_are_rejected(server):
+
+    user_list_id = requests.post(server.enrichr_url + '/addList', files={'list': (None, 'G1\nG2')}).json()['userListId']
+
+    response = requests.get(server.enrichr_url + '/enrich', params={'userListId': user_list_id, 'backgroundType': 'LibA'})
+    assert response.status_code == 200 and response.json()['LibA']
+
+    for name in ['../Secret', '..%2FSecret']:
+        response = requests.get(server.enrichr_url + '/enrich', params={'userListId': user_list_id, 'backgroundType': name})
+        assert response.status_code == 400
+
+        response = requests.get(server.enrichr_url + '/geneSetLibrary', params={'mode': 'text', 'libraryName': name})
+        assert response.status_code == 400
@@ -0,0 +1,70 @@
+import concurrent.futures
+import threading
+
+from qed.data import session
+
+
+
+
+def test_rate_limited_is_per_context():
+
+    session.configure_session(rate_limit=100)
+    configured = session.get_rate_limiters()
+
+    barrier = threading.Barrier(2)
+
+    def batch(rate) :
+        with session.rate_limited(rate):
+            # Both batches are inside their block at the same time
+            barrier.wait()
+            return [limiter.rate for limiter in session.get_rate_limiters()]
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            assert list(executor.map(batch, [1, 2])) == [[1, 100], [2, 100]]
+
+        # Session-wide limiter is left as configured
+        assert session.get_rate_limiters() == configured
+
+    finally:
+        session.configure_session()
+
+
+
+
+def test_limited_context_is_shared_by_tasks():
+
+    context = session.limited_context(5)
+
+    def limiters() :
+        return session.get_rate_limiters()
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        seen = list(executor.map(lambda _: context.copy().run(limiters), range(8)))
+
+    assert all(len(limiter) == 1 and limiter[0] is seen[0][0] for limiter in seen)
+    assert seen[0][0].rate == 5
+    assert session.get_rate_limiters() == []
+
+
+
+
+def test_growing_pool_closes_replaced_adapter(monkeypatch):
+
+    session.configure_session(pool_maxsize=2)
+
+    try:
+        shared = session.get_session()
+        previous = shared.get_adapter('https://example.org')
+
+        closed = []
+        monkeypatch.setattr(previous, 'close', lambda: closed.append(previous))
+
+        session.ensure_pool_size(8)
+
+        assert shared.get_adapter('https://example.org') is not previous
+        assert shared.get_adapter('https://example.org')._pool_maxsize == 8
+        assert closed == [previous]
+
+    finally:
+        session.configure_session()
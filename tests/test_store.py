@@ -0,0 +1,59 @@
+import pandas as pd
+
+from qed.data import ResultStore, merge_df
+
+
+
+
+def _fill(store, results, order) :
+
+    batch = store.new_batch()
+
+    for i, j in order:
+        go = results[i].GO[j]
+        store.append(go, results[i].name, go['Database'].iloc[0], order=(batch, i, j))
+
+
+
+
+def test_merge_df_of_store_matches_geneset_list(make_results):
+
+    results = make_results(3, 2, 20)
+    store = ResultStore()
+
+    # Appended as requests would complete, in any order
+    _fill(store, results, [(2, 1), (0, 1), (1, 0), (0, 0), (2, 0), (1, 1)])
+
+    for term_suffix in [True, False]:
+        pd.testing.assert_frame_equal(merge_df(store, term_suffix), merge_df(results, term_suffix))
+
+
+
+
+def test_index_continues_across_reads(make_results):
+
+    results = make_results(2, 2, 10)
+    store = ResultStore()
+
+    _fill(store, results, [(0, 0), (1, 0)])
+    merge_df(store)
+    _fill(store, results, [(0, 1), (1, 1)])
+
+    df = merge_df(store)
+
+    assert df[df['Celltype'] == results[0].name].index.tolist() == list(range(20))
+    assert df[df['Celltype'] == results[1].name].index.tolist() == list(range(20))
+
+
+def test_batches_appended_before_a_read_are_not_interleaved(make_results):
+
+    first = make_results(2, 1, 5, seed=0)
+    second = make_results(2, 1, 5, seed=1)
+    store = ResultStore()
+
+    # Both calls use geneset indices 0 and 1
+    _fill(store, first, [(1, 0), (0, 0)])
+    _fill(store, second, [(0, 0), (1, 0)])
+
+    # Index aside (the store numbers rows per geneset name across calls), rows follow the calls
+    pd.testing.assert_frame_equal(merge_df(store).reset_index(drop=True), merge_df(first + second).reset_index(drop=True))
@@ -0,0 +1,116 @@
+import itertools
+
+import pytest
+
+from qed.data import ENRICHR_DB
+from qed.data import structure
+from qed.data.structure import EnrichR_DB, EnrichR_DB_info
+
+
+
+
+def _search_baseline(db, category, is_latest=True, by_name=None) :
+
+    """ search_DB before the registry was indexed """
+
+    if is_latest == True:
+        db_list = [info for info in db if info.category in category and info.is_latest == True]
+    else:
+        db_list = [info for info in db if info.category in category]
+
+    if by_name is not None:
+        db_list = [info for info in db_list if by_name.lower() in info.name.lower()]
+
+    return db_list
+
+
+def _info(name, category='Pathways', number_of_terms=10, is_latest=True) :
+
+    return EnrichR_DB_info(name, category, None, number_of_terms, 1000, 20, is_latest)
+
+
+
+
+def test_registry_matches_db_file():
+
+    assert ENRICHR_DB.names == structure.DB_DF['DB'].tolist()
+    assert ENRICHR_DB['KEGG_2021_Human'].number_of_terms == \
+        int(structure.DB_DF.set_index('DB').loc['KEGG_2021_Human', 'Terms'])
+    assert ENRICHR_DB.get('kegg_2021_human') is ENRICHR_DB['KEGG_2021_Human']
+    assert 'No_Such_Library' not in ENRICHR_DB
+
+
+@pytest.mark.parametrize('is_latest', [True, False])
+@pytest.mark.parametrize('by_name', [None, 'go', 'KEGG', 'Human', '_2019', 'no such name'])
+def test_search_matches_baseline(is_latest, by_name):
+
+    categories = ENRICHR_DB.categories
+    selections = [[category] for category in categories] + [categories, categories[::2], ['No such category']]
+
+    for category in selections:
+        expected = _search_baseline(ENRICHR_DB.db, category, is_latest, by_name)
+
+        assert ENRICHR_DB.search_DB(category, is_latest, by_name) == expected
+
+    # A single category as string, and None for all categories
+    assert ENRICHR_DB.search_DB(categories[0], is_latest, by_name) == \
+        _search_baseline(ENRICHR_DB.db, [categories[0]], is_latest, by_name)
+    assert ENRICHR_DB.search_DB(None, is_latest, by_name) == _search_baseline(ENRICHR_DB.db, categories, is_latest, by_name)
+
+
+@pytest.mark.parametrize('prefix', ['GO_', 'go_', 'KEGG', 'Achilles', 'z', 'No_such_prefix'])
+def test_search_by_prefix(prefix):
+
+    for is_latest in [True, False]:
+        expected = [info for info in ENRICHR_DB.db
+                    if info.name.lower().startswith(prefix.lower()) and (info.is_latest or not is_latest)]
+
+        assert ENRICHR_DB.search_DB(prefix=prefix, is_latest=is_latest) == expected
+
+
+def test_search_by_ranges():
+
+    bounds = [None, 100, 1000, 10000, 20000]
+
+    for (low, high), field in itertools.product(itertools.product(bounds, bounds),
+                                                ['terms', 'gene_coverage', 'genes_per_term']):
+        attr = 'number_of_terms' if field == 'terms' else field
+        expected = [info for info in ENRICHR_DB.db if info.is_latest
+                    and (low is None or getattr(info, attr) >= low) and (high is None or getattr(info, attr) <= high)]
+
+        assert ENRICHR_DB.search_DB(**{f'min_{field}': low, f'max_{field}': high}) == expected
+
+    # Bounds are inclusive, conditions are combined
+    kegg = ENRICHR_DB['KEGG_2021_Human']
+    found = ENRICHR_DB.search_DB(prefix='KEGG', min_terms=kegg.number_of_terms, max_terms=kegg.number_of_terms)
+
+    assert kegg in found
+    assert all(info.name.startswith('KEGG') and info.number_of_terms == kegg.number_of_terms for info in found)
+
+
+def test_registry_of_given_entries():
+
+    # Only ENRICHR_DB reads DB_FILE
+    assert len(EnrichR_DB()) == 0
+
+    db = EnrichR_DB([_info('Lib_A'), _info('Lib_B', 'Ontologies', 500), _info('Lib_A_old', is_latest=False)])
+    db.add_info(_info('lib_c', 'Ontologies'))
+
+    assert db.names == ['Lib_A', 'Lib_B', 'Lib_A_old', 'lib_c']
+    assert [info.name for info in db.search_DB(prefix='lib_a', is_latest=False)] == ['Lib_A', 'Lib_A_old']
+    assert [info.name for info in db.search_DB('Ontologies', min_terms=100)] == ['Lib_B']
+    assert list(db.to_frame()['name']) == db.names
+
+
+def test_deprecated_db_arguments():
+
+    db = EnrichR_DB()
+
+    with pytest.deprecated_call():
+        info = EnrichR_DB_info('Lib_A', 'Pathways', None, 10, 1000, 20, True, db=db)
+
+    with pytest.deprecated_call():
+        registry = EnrichR_DB(db=[info])
+
+    assert db.db == [info]
+    assert registry.db == [info]